@@ -14,11 +14,15 @@ import shutil
 import uvicorn
 import logging
 import sys
+import time
+import threading
+import contextlib
+from collections import deque
 
 # 로컬 모듈
 from deepfake.defend_stargan import generate_video_thumbnail
 from deepvoice.extract_audio import extract_audio
-from deepvoice.protect_audio import protect_audio
+from deepvoice.protect_audio import protect_audio, get_protector, PROTECTION_TIERS, DEFAULT_TIER
 from deepvoice.merge_video import merge_video
 from config import UPLOAD_FOLDER, OUTPUT_FOLDER
 
@@ -61,26 +65,69 @@ protector = None
 # 취소된 작업 추적
 cancelled_tasks = set()
 
+# 티어별 동시 실행 슬롯 (preview 가 standard/max 작업 뒤에 줄 서지 않도록 분리)
+TIER_CONCURRENCY = {"preview": 2, "standard": 1, "max": 1}
+tier_slots = {t: threading.BoundedSemaphore(TIER_CONCURRENCY.get(t, 1)) for t in PROTECTION_TIERS}
+tier_stats = {
+    t: {'waiting': 0, 'running': 0, 'completed': 0, 'failed': 0, 'slo_met': 0, 'slo_missed': 0,
+        'latencies': deque(maxlen=200), 'waits': deque(maxlen=200), 'runs': deque(maxlen=200)}
+    for t in PROTECTION_TIERS
+}
+tier_lock = threading.Lock()
+
 def init_protector():
-    """오디오 보호 시스템 초기화"""
+    """오디오 보호 시스템 초기화 (protect_audio 와 같은 인스턴스 공유, 반복 수는 티어별)"""
     global protector
     if protector is None:
-        print("Initializing HighQualityVoiceProtection...")
-        from deepvoice.protect_audio import HighQualityVoiceProtection
-        protector = HighQualityVoiceProtection(
-            epsilon=0.008,
-            alpha=0.0003,
-            iterations=1500,
-            lambda_psycho=0.2,
-            lambda_smooth=0.15,
-            lambda_spectral=0.1,
-            augmentation_prob=0.7,
-            attack_mode="quality",
-            use_pretrained=True,
-        )
+        protector = get_protector()
     return protector
 
 
+@contextlib.contextmanager
+def tier_slot(tier: str):
+    """티어 슬롯 대기 → 실행, 대기/실행 시간을 티어별로 집계 (SLO 는 대기 포함 end-to-end 기준)"""
+    stats = tier_stats[tier]
+    t_wait = time.time()
+    with tier_lock:
+        stats['waiting'] += 1
+    tier_slots[tier].acquire()
+    t_run = time.time()
+    with tier_lock:
+        stats['waiting'] -= 1
+        stats['running'] += 1
+        stats['waits'].append(t_run - t_wait)
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        t_end = time.time()
+        latency = t_end - t_wait
+        tier_slots[tier].release()
+        with tier_lock:
+            stats['running'] -= 1
+            if ok:
+                stats['completed'] += 1
+                stats['latencies'].append(latency)
+                stats['runs'].append(t_end - t_run)
+                if latency <= PROTECTION_TIERS[tier]['latency_slo_sec']:
+                    stats['slo_met'] += 1
+                else:
+                    stats['slo_missed'] += 1
+            else:
+                stats['failed'] += 1
+        logger.info(f"[tier:{tier}] {'done' if ok else 'failed'} in {latency:.2f}s "
+                    f"(wait {t_run - t_wait:.2f}s + run {t_end - t_run:.2f}s, "
+                    f"SLO {PROTECTION_TIERS[tier]['latency_slo_sec']}s)")
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
 @app.on_event("startup")
 async def startup_event():
     """앱 시작 시 실행"""
@@ -292,14 +339,14 @@ def _background_image_processing(task_id: str, image_path: str):
     print(f"[{task_id}] Background image processing completed")
 
 
-def _background_video_processing(task_id: str, video_path: str):
+def _background_video_processing(task_id: str, video_path: str, tier: str = DEFAULT_TIER):
     """
     백그라운드에서 비디오 처리:
     1. 오디오 추출 (extract_audio)
-    2. 오디오 보호 (protect_audio)
+    2. 오디오 보호 (protect_audio, tier 별 예산 / 슬롯)
     3. 비디오와 보호된 오디오 병합 (merge_video)
     """
-    print(f"[{task_id}] Background processing started for {video_path}")
+    print(f"[{task_id}] Background processing started for {video_path} (tier: {tier})")
 
     try:
         # 취소 확인
@@ -359,9 +406,10 @@ def _background_video_processing(task_id: str, video_path: str):
         if not os.path.exists(extracted_audio):
             raise ProcessingStopped(f"[{task_id}] Extracted audio deleted before protection")
         
-        # task_id와 cancelled_tasks를 전달하여 반복 중 취소 체크
-        protect_audio(extracted_audio, protected_audio, task_id, cancelled_tasks)
-        print(f"[{task_id}] Audio protected: {protected_audio}")
+        # task_id와 cancelled_tasks를 전달하여 반복 중 취소 체크 (티어 슬롯 안에서 실행)
+        with tier_slot(tier):
+            protect_audio(extracted_audio, protected_audio, task_id, cancelled_tasks, tier=tier)
+        print(f"[{task_id}] Audio protected ({tier}): {protected_audio}")
 
         # 진행률 70%
         try:
@@ -496,7 +544,8 @@ async def process_file(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     taskId: Optional[str] = Form(None),
-    fileType: Optional[str] = Form(None)
+    fileType: Optional[str] = Form(None),
+    tier: Optional[str] = Form(None)
 ):
     """
     통합 파일 처리 API (백엔드 호환)
@@ -505,15 +554,25 @@ async def process_file(
     - file: 업로드 파일 (비디오/이미지/오디오)
     - taskId: 백엔드에서 제공하는 작업 ID
     - fileType: 파일 타입 ('video', 'image', 'audio')
+    - tier: 오디오 보호 티어 ('preview', 'standard', 'max', 기본 max)
+            preview 로 빠르게 받은 뒤 같은 taskId 로 상위 티어를 다시 요청하면 결과가 교체됨
     
     Response:
     - task_id: 작업 ID
     - status: 'queued'
+    - tier: 적용 티어
     """
     try:
         if not file.filename:
             raise HTTPException(status_code=400, detail='No selected file')
         
+        tier = tier or DEFAULT_TIER
+        if tier not in PROTECTION_TIERS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown tier '{tier}'. Available: {', '.join(PROTECTION_TIERS)}"
+            )
+        
         # 작업 ID 생성 또는 사용 (백엔드에서 제공)
         task_id = taskId or str(uuid.uuid4())
         
@@ -543,8 +602,8 @@ async def process_file(
         # 파일 타입에 따라 처리
         if fileType == 'video':
             # 백그라운드 비디오 처리 (딥보이스 + 딥페이크)
-            background_tasks.add_task(_background_video_processing, task_id, saved_path)
-            logger.info(f"[{task_id}] Background video processing scheduled")
+            background_tasks.add_task(_background_video_processing, task_id, saved_path, tier)
+            logger.info(f"[{task_id}] Background video processing scheduled (tier: {tier})")
         elif fileType == 'image':
             # 백그라운드 이미지 처리 (딥페이크만)
             background_tasks.add_task(_background_image_processing, task_id, saved_path)
@@ -559,7 +618,8 @@ async def process_file(
         
         return {
             'task_id': task_id,
-            'status': 'uploading'
+            'status': 'uploading',
+            'tier': tier
         }
         
     except HTTPException:
@@ -568,6 +628,33 @@ async def process_file(
         logger.error(f"Error in process_file: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get('/api/v1/tiers')
+async def get_tiers():
+    """보호 티어 목록 + 티어별 큐/지연 시간 집계"""
+    tiers = {}
+    with tier_lock:
+        for t, cfg in PROTECTION_TIERS.items():
+            stats = tier_stats[t]
+            finished = stats['slo_met'] + stats['slo_missed']
+            tiers[t] = {
+                'method': cfg['method'],
+                'iterations': cfg['iterations'],
+                'latency_slo_sec': cfg['latency_slo_sec'],
+                'concurrency': TIER_CONCURRENCY.get(t, 1),
+                'waiting': stats['waiting'],
+                'running': stats['running'],
+                'completed': stats['completed'],
+                'failed': stats['failed'],
+                'slo_attainment': stats['slo_met'] / finished if finished else None,
+                # latency = 슬롯 대기 + 실행 (SLO 판정 기준)
+                'latency_p50_sec': _percentile(stats['latencies'], 0.5),
+                'latency_p95_sec': _percentile(stats['latencies'], 0.95),
+                'wait_p95_sec': _percentile(stats['waits'], 0.95),
+                'run_p95_sec': _percentile(stats['runs'], 0.95),
+            }
+    return {'default': DEFAULT_TIER, 'tiers': tiers}
+
+
 @app.get('/api/v1/files/thumbnail/{task_id}')
 async def get_thumbnail(task_id: str):
     """썸네일 이미지 다운로드"""
@@ -0,0 +1,228 @@
+"""
+audio_augment.py
+음성 보호기 공용 데이터 증강 (torch 네이티브 / 디바이스 상주 / 배치)
+
+- robust_ver2/3/4, final_ver4, protect_audio 가 모두 이 모듈의 DataAugmentation 을 사용
+- 입력 (B,1,T) 또는 (1,T) 텐서, 모든 연산은 입력 디바이스/dtype 에서 수행 (.cpu()/.item() 없음)
+- 무작위 파라미터(게인, SNR, cutoff, 비트수)는 아이템별로 디바이스에서 샘플링
+- 리샘플 커널은 (sr_in, sr_out, device, dtype) 별 1회 생성 후 캐시
+- chain(x, names): 선택된 증강들을 한 번의 호출로 연속 적용
+
+프리셋:
+    robust        resample / gain / noise / mp3(lowpass 3-7k + 양자화)      (robust_ver2)
+    robust_codec  robust + μ-law 코덱                                       (robust_ver3)
+    quality       resample / lowpass 5-8k                                   (robust_ver4, final_ver4, protect_audio)
+
+사용:
+    from audio_augment import DataAugmentation
+    aug = DataAugmentation(preset="quality")
+    y = aug.apply_random_augmentation(x)
+    y = aug.chain(x, ("resample", "mulaw"))
+"""
+import math
+import random
+import threading
+
+import torch
+import torch.nn.functional as F
+
+SAMPLE_RATE = 16000
+RESAMPLE_RATES = (8000, 12000, 16000, 24000)
+LOWPASS_TAPS = 101
+MU = 255
+A_LAW = 87.6
+CODEC_LEVELS = 127  # 8bit 코덱 (부호 + 7bit)
+
+PRESETS = {
+    "robust": dict(ops=("resample", "gain", "noise", "mp3"),
+                   cutoff=(3000, 7000), bits=(8, 12, 16), p_two=0.5),
+    "robust_codec": dict(ops=("resample", "gain", "noise", "mp3", "mulaw"),
+                         cutoff=(3000, 7000), bits=(8, 12, 16), p_two=0.6),
+    "quality": dict(ops=("resample", "lowpass"),
+                    cutoff=(5000, 8000), bits=None, p_two=0.0),
+}
+
+_RESAMPLERS = {}
+_CONSTS = {}
+_LOCK = threading.Lock()
+
+
+def _key(device, dtype):
+    return (str(device), str(dtype))
+
+
+def get_resampler(sr_in, sr_out, device, dtype=torch.float32):
+    """torchaudio Resample 모듈 캐시 (커널을 매 호출마다 다시 만들지 않음)"""
+    k = (sr_in, sr_out) + _key(device, dtype)
+    rs = _RESAMPLERS.get(k)
+    if rs is None:
+        import torchaudio
+        with _LOCK:
+            rs = _RESAMPLERS.get(k)
+            if rs is None:
+                rs = torchaudio.transforms.Resample(sr_in, sr_out).to(device=device, dtype=dtype)
+                _RESAMPLERS[k] = rs
+    return rs
+
+
+def _const(name, values, device, dtype):
+    """작은 상수 텐서 캐시 (매 호출 H2D 복사 방지)"""
+    k = (name, tuple(values)) + _key(device, dtype)
+    t = _CONSTS.get(k)
+    if t is None:
+        t = torch.tensor(values, device=device, dtype=dtype)
+        _CONSTS[k] = t
+    return t
+
+
+def _taps(n, device, dtype):
+    return _const("taps", [i - n // 2 for i in range(n)], device, dtype)
+
+
+def _batch_view(x):
+    """(..., T) → (B,1,T) 와 원래 shape"""
+    return x.reshape(-1, 1, x.shape[-1]), x.shape
+
+
+def _per_item(x, lo, hi):
+    """아이템별 U(lo, hi) — (B,1,1), 디바이스에서 샘플링"""
+    return torch.empty(x.shape[0], 1, 1, device=x.device, dtype=x.dtype).uniform_(lo, hi)
+
+
+# ---------------- 개별 연산 (모두 배치 / 디바이스) ----------------
+def resample_roundtrip(x, sr, target_sr):
+    """sr → target_sr → sr 왕복 후 길이 맞춤"""
+    if target_sr == sr:
+        return x
+    down = get_resampler(sr, target_sr, x.device, x.dtype)
+    up = get_resampler(target_sr, sr, x.device, x.dtype)
+    y = up(down(x))
+    T = x.shape[-1]
+    if y.shape[-1] > T:
+        y = y[..., :T]
+    elif y.shape[-1] < T:
+        y = F.pad(y, (0, T - y.shape[-1]))
+    return y
+
+
+def gain(x, db_range=(-3.0, 3.0)):
+    xb, shape = _batch_view(x)
+    g = torch.pow(10.0, _per_item(xb, *db_range) / 20)
+    return (xb * g).reshape(shape)
+
+
+def add_noise(x, snr_range=(20.0, 40.0)):
+    xb, shape = _batch_view(x)
+    snr = _per_item(xb, *snr_range)
+    p_sig = xb.pow(2).mean(dim=-1, keepdim=True)
+    p_noise = p_sig / torch.pow(10.0, snr / 10)
+    return (xb + torch.randn_like(xb) * p_noise.sqrt()).reshape(shape)
+
+
+def lowpass(x, sr, cutoff_range, taps=LOWPASS_TAPS):
+    """아이템별 cutoff 의 windowless sinc FIR — 커널은 디바이스에서 (B,taps) 로 생성, grouped conv 1회"""
+    xb, shape = _batch_view(x)
+    B = xb.shape[0]
+    fc = _per_item(xb, *cutoff_range).view(B, 1) / (sr / 2)
+    kern = torch.sinc(2 * fc * _taps(taps, xb.device, xb.dtype))
+    kern = (kern / kern.sum(dim=-1, keepdim=True)).unsqueeze(1)          # (B,1,taps)
+    pad = taps // 2
+    y = F.conv1d(F.pad(xb, (pad, pad), mode="reflect").transpose(0, 1), kern, groups=B)
+    return y.transpose(0, 1).reshape(shape)
+
+
+def quantize(x, bits=(8, 12, 16)):
+    """아이템별 비트수 양자화"""
+    xb, shape = _batch_view(x)
+    choice = _const("bits", bits, xb.device, xb.dtype)
+    idx = torch.randint(len(bits), (xb.shape[0], 1, 1), device=xb.device)
+    scale = torch.pow(2.0, choice[idx])
+    return (torch.round(xb * scale) / scale).reshape(shape)
+
+
+def mulaw_roundtrip(x, mu=MU, levels=CODEC_LEVELS):
+    """G.711 μ-law 압축 → 양자화 → 복원"""
+    c = torch.sign(x) * torch.log1p(mu * x.abs()) / math.log1p(mu)
+    c = torch.round(c * levels) / levels
+    return torch.sign(c) * (torch.pow(1.0 + mu, c.abs()) - 1) / mu
+
+
+def alaw_roundtrip(x, A=A_LAW, levels=CODEC_LEVELS):
+    """G.711 A-law 압축 → 양자화 → 복원"""
+    ax = x.abs()
+    la = 1 + math.log(A)
+    c = torch.where(ax < 1 / A, A * ax / la, (1 + torch.log((A * ax).clamp_min(1.0))) / la)
+    c = torch.round(c * levels) / levels
+    y = torch.where(c < 1 / la, c * la / A, torch.exp(c * la - 1) / A)
+    return torch.sign(x) * y
+
+
+class DataAugmentation:
+    """강건성을 위한 데이터 증강 (공용)"""
+    def __init__(self, sample_rate=SAMPLE_RATE, preset="quality", ops=None, cutoff=None,
+                 bits=None, p_two=None, rates=RESAMPLE_RATES):
+        cfg = dict(PRESETS[preset])
+        for k, v in (("ops", ops), ("cutoff", cutoff), ("bits", bits), ("p_two", p_two)):
+            if v is not None:
+                cfg[k] = v
+        self.sample_rate = sample_rate
+        self.preset = preset
+        self.ops = tuple(cfg["ops"])
+        self.cutoff = tuple(cfg["cutoff"])
+        self.bits = cfg["bits"]
+        self.p_two = cfg["p_two"]
+        self.rates = tuple(rates)
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._fns = {
+            "resample": self.random_resample,
+            "gain": self.random_gain,
+            "noise": self.add_background_noise,
+            "lowpass": self.lowpass_simulation,
+            "mp3": self.mp3_compression_simulation,
+            "mulaw": self.codec_simulation,
+            "alaw": self.alaw_simulation,
+        }
+
+    def random_resample(self, waveform, target_sr=None):
+        """무작위 리샘플 왕복 (배치 전체 동일 rate — 길이가 달라지므로)"""
+        return resample_roundtrip(waveform, self.sample_rate, target_sr or random.choice(self.rates))
+
+    def random_gain(self, waveform):
+        """무작위 게인 조정 (±3dB)"""
+        return gain(waveform)
+
+    def add_background_noise(self, waveform):
+        """배경 노이즈 추가 (SNR 20-40dB)"""
+        return add_noise(waveform)
+
+    def lowpass_simulation(self, waveform):
+        """Lowpass (압축 대역 제한) 시뮬레이션"""
+        return lowpass(waveform, self.sample_rate, self.cutoff)
+
+    def mp3_compression_simulation(self, waveform):
+        """MP3 압축 시뮬레이션 (lowpass + 비트 양자화)"""
+        y = lowpass(waveform, self.sample_rate, self.cutoff)
+        return quantize(y, self.bits) if self.bits else y
+
+    def codec_simulation(self, waveform):
+        """음성 코덱 시뮬레이션 (G.711 μ-law)"""
+        return mulaw_roundtrip(waveform)
+
+    def alaw_simulation(self, waveform):
+        """음성 코덱 시뮬레이션 (G.711 A-law)"""
+        return alaw_roundtrip(waveform)
+
+    def chain(self, waveform, names):
+        """증강들을 순서대로 한 번에 적용"""
+        for n in names:
+            waveform = self._fns[n](waveform)
+        return waveform
+
+    def sample_chain(self):
+        """프리셋 규칙대로 증강 1개(또는 p_two 확률로 2개) 선택 — 호스트 RNG 만 사용"""
+        k = 2 if self.p_two and random.random() < self.p_two else 1
+        return tuple(random.choice(self.ops) for _ in range(k))
+
+    def apply_random_augmentation(self, waveform):
+        """무작위 증강"""
+        return self.chain(waveform, self.sample_chain())
@@ -0,0 +1,92 @@
+"""
+embedding_cache.py
+클린(원본) 오디오 스피커 임베딩 캐시 — 보호 / 분석 / 검증이 공유.
+
+- 키: (오디오 내용 sha1, 인코더 id, 구간 스펙)  → 같은 업로드면 재시도·파라미터 스윕에서도 재계산 없음
+- 저장: <cache_dir>/<audio sha1>.<key sha1 12자>.npy  (float16, 원자적 교체)
+- 메모리 → 디스크 → 계산 순으로 조회, 반환은 항상 float16 왕복 값 (첫 실행/재실행 결과 동일)
+
+사용:
+    from embedding_cache import get_embedding_cache
+    cache = get_embedding_cache()
+    emb = cache.embed(waveform, "speechbrain/spkrec-ecapa-voxceleb", extract_fn)          # 전체
+    embs = cache.embed(waveform, enc_id, windows_fn, segment="win1.0_hop0.5")             # (N,D) 구간별
+"""
+import os
+import hashlib
+import threading
+
+import numpy as np
+import torch
+
+EMB_CACHE_DIR = os.environ.get("VOICE_EMB_CACHE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "assets", "emb_cache")
+ECAPA_SOURCE = "speechbrain/spkrec-ecapa-voxceleb"
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def audio_hash(waveform, sample_rate=16000):
+    """디코딩된 파형 내용 해시 (float32 바이트 + 샘플레이트)"""
+    h = hashlib.sha1(str(sample_rate).encode())
+    h.update(waveform.detach().float().reshape(-1).cpu().numpy().tobytes())
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir=None, disk=True):
+        self.cache_dir = cache_dir or EMB_CACHE_DIR
+        self.disk = disk
+        self._mem = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, ahash, encoder_id, segment):
+        kh = hashlib.sha1(f"{encoder_id}|{segment}".encode()).hexdigest()[:12]
+        return os.path.join(self.cache_dir, f"{ahash}.{kh}.npy")
+
+    def get(self, ahash, encoder_id, segment="full"):
+        key = (ahash, encoder_id, segment)
+        with self._lock:
+            arr = self._mem.get(key)
+        if arr is None and self.disk:
+            p = self.path(*key)
+            if os.path.exists(p):
+                arr = np.load(p)
+                with self._lock:
+                    self._mem[key] = arr
+        return arr
+
+    def put(self, ahash, encoder_id, segment, emb):
+        arr = (emb.detach().float().cpu().numpy() if torch.is_tensor(emb) else np.asarray(emb)).astype(np.float16)
+        with self._lock:
+            self._mem[(ahash, encoder_id, segment)] = arr
+        if self.disk:
+            p = self.path(ahash, encoder_id, segment)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = f"{p}.{os.getpid()}.tmp.npy"
+            np.save(tmp, arr)
+            os.replace(tmp, p)  # 원자적 교체 (동시 워커 안전)
+        return arr
+
+    def embed(self, waveform, encoder_id, compute_fn, segment="full", sample_rate=16000, ahash=None):
+        """캐시 조회 후 없으면 compute_fn(waveform) 계산·저장 → waveform 디바이스의 float32 텐서"""
+        ahash = ahash or audio_hash(waveform, sample_rate)
+        arr = self.get(ahash, encoder_id, segment)
+        if arr is None:
+            self.misses += 1
+            with torch.no_grad():
+                arr = self.put(ahash, encoder_id, segment, compute_fn(waveform))
+        else:
+            self.hits += 1
+        return torch.from_numpy(arr.astype(np.float32)).to(waveform.device)
+
+
+def get_embedding_cache(cache_dir=None, disk=True):
+    key = (cache_dir or EMB_CACHE_DIR, disk)
+    with _CACHES_LOCK:
+        if key not in _CACHES:
+            _CACHES[key] = EmbeddingCache(cache_dir, disk)
+        return _CACHES[key]
@@ -0,0 +1,136 @@
+"""
+frozen_surrogate.py
+오디오 스피커 인코더 공용 "고정 대리 모델" 래퍼.
+
+공격 루프는 입력(perturbation) gradient 만 필요하다. 인코더 파라미터가 requires_grad=True 이면
+매 step 수백만 개 가중치의 .grad 가 할당·누적되지만 아무도 읽지 않는다.
+FrozenSurrogate 는 eval + requires_grad_(False) 로 고정하고 나머지는 원래 인코더에 위임한다
+(encode_batch / mods / __call__ 그대로 사용 가능 → 기존 코드 수정 최소).
+
+사용:
+    self.encoder = FrozenSurrogate(EncoderClassifier.from_hparams(...))
+    emb = self.encoder.encode_batch(x)          # 기존과 동일
+    emb = self.encoder.embed(x)                 # (B,1,T) → 정규화 임베딩 (speechbrain/nn.Module 공통)
+
+벤치마크 (고정 전/후 step 시간, 파라미터 grad 메모리, CUDA peak):
+    python frozen_surrogate.py --seconds 5 --iters 20
+"""
+import time
+import argparse
+
+import torch
+import torch.nn.functional as F
+
+
+def encoder_modules(encoder):
+    """speechbrain EncoderClassifier → .mods, nn.Module → 그대로"""
+    return encoder.mods if hasattr(encoder, "mods") else encoder
+
+
+def freeze_module(module):
+    """eval + 파라미터 requires_grad_(False) → 고정한 파라미터 수"""
+    module.eval()
+    n = 0
+    for p in module.parameters():
+        p.requires_grad_(False)
+        n += p.numel()
+    return n
+
+
+def param_grad_bytes(module):
+    """현재 파라미터에 붙어 있는 .grad 총 바이트"""
+    return sum(p.grad.numel() * p.grad.element_size() for p in module.parameters() if p.grad is not None)
+
+
+def embed(encoder, waveform, wav_lens=None):
+    """(B,1,T) → L2 정규화 임베딩 (speechbrain / nn.Module 공통, 입력 gradient 유지)"""
+    if hasattr(encoder, "encode_batch"):
+        emb = encoder.encode_batch(waveform.squeeze(1), wav_lens)
+        if isinstance(emb, tuple):
+            emb = emb[0]
+    else:
+        emb = encoder(waveform)
+    return F.normalize(emb.float(), p=2, dim=-1)
+
+
+class FrozenSurrogate:
+    def __init__(self, encoder):
+        if isinstance(encoder, FrozenSurrogate):
+            encoder = encoder.encoder
+        self.encoder = encoder
+        self.n_frozen = freeze_module(encoder_modules(encoder))
+
+    def __getattr__(self, name):
+        # encode_batch, mods, hparams ... 는 원래 인코더로 위임
+        return getattr(self.__dict__["encoder"], name)
+
+    def __call__(self, *args, **kwargs):
+        return self.encoder(*args, **kwargs)
+
+    def embed(self, waveform, wav_lens=None):
+        return embed(self.encoder, waveform, wav_lens)
+
+    def param_grad_bytes(self):
+        return param_grad_bytes(encoder_modules(self.encoder))
+
+
+def benchmark_surrogate(encoder, seconds=5.0, iters=20, device=None, sample_rate=16000):
+    """
+    같은 인코더로 입력-gradient step 을 (1) 파라미터 grad 켠 상태 (2) 고정 상태로 반복해 비교
+    반환: [{'mode', 'sec_per_iter', 'param_grad_mb', 'peak_mb'}]
+    """
+    device = torch.device(device or ("cuda" if torch.cuda.is_available() else "cpu"))
+    mods = encoder_modules(encoder)
+    saved = [p.requires_grad for p in mods.parameters()]
+    x = torch.randn(1, 1, int(seconds * sample_rate), device=device) * 0.1
+    rows = []
+    try:
+        for mode in ("trainable", "frozen"):
+            for p in mods.parameters():
+                p.requires_grad_(mode == "trainable")
+                p.grad = None
+            mods.eval()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+            t0 = time.time()
+            for _ in range(iters):
+                delta = torch.zeros_like(x, requires_grad=True)
+                embed(encoder, x + delta).sum().backward()
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            rows.append({
+                'mode': mode,
+                'sec_per_iter': (time.time() - t0) / iters,
+                'param_grad_mb': param_grad_bytes(mods) / 2**20,
+                'peak_mb': torch.cuda.max_memory_allocated() / 2**20 if device.type == "cuda" else None,
+            })
+    finally:
+        for p, rg in zip(mods.parameters(), saved):
+            p.requires_grad_(rg)
+            p.grad = None
+
+    print(f"{'mode':<12}{'s/iter':>10}{'param .grad MB':>16}{'CUDA peak MB':>14}")
+    for r in rows:
+        peak = f"{r['peak_mb']:.1f}" if r['peak_mb'] is not None else "-"
+        print(f"{r['mode']:<12}{r['sec_per_iter']:>10.4f}{r['param_grad_mb']:>16.1f}{peak:>14}")
+    return rows
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=5.0, help="입력 오디오 길이 (초)")
+    ap.add_argument("--iters", type=int, default=20)
+    ap.add_argument("--device", default=None)
+    args = ap.parse_args()
+    try:
+        from speechbrain.inference.speaker import EncoderClassifier
+    except ImportError:
+        from speechbrain.pretrained import EncoderClassifier
+    dev = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    enc = EncoderClassifier.from_hparams(
+        source="speechbrain/spkrec-ecapa-voxceleb",
+        savedir="pretrained_models/spkrec-ecapa-voxceleb",
+        run_opts={"device": dev},
+    )
+    benchmark_surrogate(enc, args.seconds, args.iters, dev)
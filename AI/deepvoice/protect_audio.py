@@ -5,68 +5,25 @@ import numpy as np
 import random
 import sys
 import os
+import time
+import contextlib
 from scipy import signal as scipy_signal
 
 
-class DataAugmentation:
-    """강건성을 위한 데이터 증강"""
-    def __init__(self, sample_rate=16000):
-        self.sample_rate = sample_rate
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    def random_resample(self, waveform):
-        """무작위 리샘플"""
-        target_rates = [8000, 12000, 16000, 24000]
-        target_sr = random.choice(target_rates)
-        
-        if target_sr == self.sample_rate:
-            return waveform
-        
-        resampler_down = torchaudio.transforms.Resample(
-            self.sample_rate, target_sr
-        ).to(self.device)
-        resampler_up = torchaudio.transforms.Resample(
-            target_sr, self.sample_rate
-        ).to(self.device)
-        
-        resampled = resampler_down(waveform)
-        restored = resampler_up(resampled)
-        
-        if restored.shape[-1] > waveform.shape[-1]:
-            restored = restored[..., :waveform.shape[-1]]
-        elif restored.shape[-1] < waveform.shape[-1]:
-            padding = waveform.shape[-1] - restored.shape[-1]
-            restored = F.pad(restored, (0, padding))
-        
-        return restored
-    
-    def mp3_compression_simulation(self, waveform):
-        """MP3 압축 시뮬레이션"""
-        cutoff = random.uniform(5000, 8000)  # 더 높은 cutoff
-        nyquist = self.sample_rate / 2
-        normalized_cutoff = cutoff / nyquist
-        
-        kernel_size = 101
-        kernel = torch.sinc(
-            2 * normalized_cutoff * (torch.arange(kernel_size, dtype=torch.float32) - kernel_size // 2)
-        )
-        kernel = kernel / kernel.sum()
-        kernel = kernel.view(1, 1, -1).to(self.device)
-        
-        padded = F.pad(waveform, (kernel_size // 2, kernel_size // 2), mode='reflect')
-        filtered = F.conv1d(padded, kernel)
-        
-        return filtered
-    
-    def apply_random_augmentation(self, waveform):
-        """무작위 증강 (가벼운 버전)"""
-        augmentations = [
-            self.random_resample,
-            self.mp3_compression_simulation,
-        ]
-        
-        aug_func = random.choice(augmentations)
-        return aug_func(waveform)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from audio_augment import DataAugmentation  # 공용 증강 (torch 네이티브)
+from embedding_cache import get_embedding_cache, ECAPA_SOURCE  # 클린 임베딩 캐시
+from protection_metrics import ProtectionMetrics  # 루프 내 증분 지표 + 텔레메트리
+from frozen_surrogate import FrozenSurrogate, embed  # 고정 인코더 래퍼
+
+# 서비스 티어: preview = 몇 step signed-gradient PGD (FGSM 계열, 1초 목표), 나머지 = 최적화 반복 예산
+# latency_slo_sec 는 오디오 보호 단계의 티어 슬롯 대기 + 실행 (end-to-end) 기준 — app.py 가 티어별로 판정/집계
+PROTECTION_TIERS = {
+    "preview": dict(method="pgd", iterations=5, latency_slo_sec=1.0),
+    "standard": dict(method="optimize", iterations=500, latency_slo_sec=120.0),
+    "max": dict(method="optimize", iterations=1500, latency_slo_sec=360.0),
+}
+DEFAULT_TIER = "max"  # 기존 동작 (1500 iterations)
 
 
 class VoiceActivityDetector:
@@ -121,6 +78,9 @@ class HighQualityVoiceProtection:
         augmentation_prob=0.7,      
         attack_mode="quality",      # quality/balanced/aggressive
         use_pretrained=True,
+        precision="fp32",           # fp32/bf16 (bf16 = 인코더 forward/backward autocast)
+        compile_encoder=False,      # torch.compile(embedding_model)
+        freeze_encoder=True,        # 인코더 파라미터 requires_grad_(False) + eval
     ):
         self.epsilon = epsilon
         self.alpha = alpha
@@ -156,7 +116,14 @@ class HighQualityVoiceProtection:
             self.encoder = self._create_simple_encoder()
             self.use_pretrained = False
         
-        self.augmentor = DataAugmentation()
+        self.augmentor = DataAugmentation(preset="quality")
+        
+        self.precision = "fp32"
+        self.compile_encoder = False
+        self._eager_embedding_model = None
+        if freeze_encoder:
+            self.freeze_encoder()
+        self.configure_encoder(precision, compile_encoder)
         
         print(f"Device: {self.device}")
         print(f"Attack mode: {attack_mode} (Quality-focused)")
@@ -198,6 +165,45 @@ class HighQualityVoiceProtection:
         
         return waveform.unsqueeze(0).to(self.device)
     
+    def freeze_encoder(self):
+        """인코더 가중치 고정 (FrozenSurrogate): eval + requires_grad_(False) → 파라미터 .grad 누적 없음"""
+        self.encoder = FrozenSurrogate(self.encoder)
+    
+    def configure_encoder(self, precision=None, compile_encoder=None):
+        """
+        정밀도 / torch.compile 설정 (벤치마크에서 모드 전환용)
+        channels_last 는 적용하지 않음: ECAPA-TDNN 은 1-D conv (3D 텐서) 라 channels_last(4D NHWC) 대상이 아님
+        """
+        if precision is not None:
+            if precision not in ("fp32", "bf16"):
+                raise ValueError(f"unknown precision: {precision}")
+            self.precision = precision
+        if compile_encoder is not None and self.use_pretrained:
+            mods = self.encoder.mods
+            if self._eager_embedding_model is None:
+                self._eager_embedding_model = mods.embedding_model
+            if compile_encoder and hasattr(torch, "compile"):
+                try:
+                    mods.embedding_model = torch.compile(self._eager_embedding_model, dynamic=True)
+                    self.compile_encoder = True
+                except Exception as e:
+                    print(f"Warning: torch.compile unavailable: {e}")
+                    mods.embedding_model = self._eager_embedding_model
+                    self.compile_encoder = False
+            else:
+                mods.embedding_model = self._eager_embedding_model
+                self.compile_encoder = False
+    
+    def _autocast(self):
+        if self.precision == "bf16":
+            return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+    
+    def embed_for_attack(self, waveform, wav_lens=None):
+        """최적화 루프용 임베딩 (gradient 유지, 정밀도 모드 적용) → float32 정규화 임베딩"""
+        with self._autocast():
+            return embed(self.encoder, waveform, wav_lens)
+    
     def extract_embedding(self, waveform):
         """스피커 임베딩 추출"""
         with torch.no_grad():
@@ -211,14 +217,21 @@ class HighQualityVoiceProtection:
         
         return embedding
     
+    def original_embedding(self, waveform):
+        """원본(클린) 임베딩 — 사전학습 인코더면 임베딩 캐시 공유"""
+        if not self.use_pretrained:
+            return self.extract_embedding(waveform)
+        return get_embedding_cache().embed(waveform, ECAPA_SOURCE, self.extract_embedding)
+    
     def spectral_shaping_filter(self, perturbation):
         """
         스펙트럴 쉐이핑 - 자연스러운 노이즈 생성
         지지직 소리의 원인인 고주파 스파이크 제거
         """
-        # STFT
+        # STFT (배치: (B,1,T) → (B, n_freqs, n_frames))
+        B = perturbation.shape[0]
         stft = torch.stft(
-            perturbation.squeeze(), 
+            perturbation.reshape(B, -1), 
             n_fft=2048, 
             hop_length=512,
             window=torch.hann_window(2048).to(self.device),
@@ -228,16 +241,16 @@ class HighQualityVoiceProtection:
         magnitude = torch.abs(stft)
         phase = torch.angle(stft)
         
-        # magnitude shape: [n_freqs, n_frames]
-        n_freqs, n_frames = magnitude.shape
+        # magnitude shape: [B, n_freqs, n_frames]
+        n_freqs = magnitude.shape[1]
         
         # 주파수별 가중치 (자연스러운 pink noise 특성)
         freq_weights = 1.0 / torch.sqrt(torch.arange(1, n_freqs + 1).float()).to(self.device)
         freq_weights = freq_weights.unsqueeze(1)  # [n_freqs, 1]
         
         # Magnitude smoothing (지지직 제거)
-        # 주파수 축 스무딩 - reshape to [1, 1, n_freqs, n_frames]
-        magnitude_batch = magnitude.unsqueeze(0).unsqueeze(0)  # [1, 1, n_freqs, n_frames]
+        # 주파수 축 스무딩 - reshape to [B, 1, n_freqs, n_frames]
+        magnitude_batch = magnitude.unsqueeze(1)
         
         # 2D convolution으로 스무딩
         kernel_2d = torch.ones(1, 1, 3, 3).to(self.device) / 9
@@ -246,21 +259,21 @@ class HighQualityVoiceProtection:
             kernel_2d,
             padding=0
         )
-        magnitude_smooth = magnitude_smooth.squeeze(0).squeeze(0)  # [n_freqs, n_frames]
+        magnitude_smooth = magnitude_smooth.squeeze(1)  # [B, n_freqs, n_frames]
         
         # Pink noise 특성 적용
         magnitude_shaped = magnitude_smooth * freq_weights
         
         # 고주파 제한 (8kHz 이상 급격히 감소)
         cutoff_bin = int(n_freqs * 0.5)  # 8kHz at 16kHz sampling
-        high_freq_suppress = torch.ones_like(magnitude_shaped)
+        high_freq_suppress = torch.ones(n_freqs, 1, device=self.device)
         if cutoff_bin < n_freqs:
             suppress_factor = torch.exp(
                 -0.5 * torch.arange(n_freqs - cutoff_bin).float().to(self.device) / (n_freqs - cutoff_bin)
             ).unsqueeze(1)
             high_freq_suppress[cutoff_bin:] *= suppress_factor
         
-        magnitude_shaped *= high_freq_suppress
+        magnitude_shaped = magnitude_shaped * high_freq_suppress
         
         # 복원
         stft_shaped = magnitude_shaped * torch.exp(1j * phase)
@@ -272,12 +285,17 @@ class HighQualityVoiceProtection:
             length=perturbation.shape[-1]
         )
         
-        return perturbation_shaped.unsqueeze(0).unsqueeze(0)
+        return perturbation_shaped.reshape(B, 1, -1)
     
     def adaptive_noise_gate(self, perturbation, original_waveform):
         """
         적응형 노이즈 게이트 - 무음 구간의 노이즈 제거
         """
+        return perturbation * self.noise_gate(original_waveform, perturbation.shape[-1])
+    
+    def noise_gate(self, original_waveform, length=None):
+        """노이즈 게이트 마스크 (원본에만 의존 → 작업당 1회 계산 가능)"""
+        length = length or original_waveform.shape[-1]
         # 원본 신호의 에너지 계산
         energy = torch.sqrt(
             F.avg_pool1d(
@@ -286,13 +304,11 @@ class HighQualityVoiceProtection:
                 stride=400
             )
         )
-        energy = F.interpolate(energy, size=perturbation.shape[-1], mode='linear')
+        energy = F.interpolate(energy, size=length, mode='linear')
         
         # 에너지 기반 게이트 (무음 구간 = 낮은 perturbation)
         energy_norm = (energy - energy.min()) / (energy.max() - energy.min() + 1e-8)
-        gate = torch.sigmoid(10 * (energy_norm - 0.1))  # 부드러운 게이트
-        
-        return perturbation * gate
+        return torch.sigmoid(10 * (energy_norm - 0.1))  # 부드러운 게이트
     
     def temporal_smoothing(self, perturbation):
         """
@@ -316,12 +332,16 @@ class HighQualityVoiceProtection:
         
         return smoothed
     
-    def generate_perturbation(self, original_waveform, task_id=None, cancelled_tasks=None):
+    def generate_perturbation(self, original_waveform, task_id=None, cancelled_tasks=None, metrics=None,
+                              iterations=None):
         """
         고품질 perturbation 생성 - 음질 보존 최우선
+        metrics: ProtectionMetrics — 루프에서 계산한 코사인/대역 에너지를 그대로 기록
+        iterations: 반복 수 (None 이면 self.iterations, 티어별 예산 — 공유 인스턴스 상태는 바꾸지 않음)
         """
+        iterations = iterations or self.iterations
         print("\nExtracting original speaker embedding...")
-        original_embedding = self.extract_embedding(original_waveform)
+        original_embedding = self.original_embedding(original_waveform)
         print(f"Original embedding shape: {original_embedding.shape}")
         
         # 음성 구간 분석
@@ -339,16 +359,16 @@ class HighQualityVoiceProtection:
             optimizer, T_0=200, T_mult=2, eta_min=self.alpha * 0.01
         )
         
-        print(f"\nStarting high-quality optimization ({self.iterations} iterations)...")
+        print(f"\nStarting high-quality optimization ({iterations} iterations)...")
         print("Prioritizing audio quality...")
         
         best_loss = -float('inf')
         best_perturbation = perturbation.clone()
         
-        for iteration in range(self.iterations):
+        for iteration in range(iterations):
             # 취소 체크 (50번 반복마다)
             if iteration % 50 == 0 and cancelled_tasks is not None and task_id in cancelled_tasks:
-                print(f"\n[Protect Audio] Processing cancelled at iteration {iteration}/{self.iterations}")
+                print(f"\n[Protect Audio] Processing cancelled at iteration {iteration}/{iterations}")
                 raise Exception("Processing cancelled by user")
             optimizer.zero_grad()
             
@@ -383,21 +403,16 @@ class HighQualityVoiceProtection:
             
             # 가벼운 증강
             with torch.no_grad():
-                if random.random() < self.augmentation_prob:
+                is_augmented = random.random() < self.augmentation_prob
+                if is_augmented:
                     augmented = self.augmentor.apply_random_augmentation(perturbed_waveform.detach())
                 else:
                     augmented = perturbed_waveform.detach()
             
             augmented = augmented + (perturbed_waveform - perturbed_waveform.detach())
             
-            # 임베딩 추출
-            if self.use_pretrained:
-                perturbed_embedding = self.encoder.encode_batch(augmented.squeeze(1))
-                if isinstance(perturbed_embedding, tuple):
-                    perturbed_embedding = perturbed_embedding[0]
-                perturbed_embedding = F.normalize(perturbed_embedding, p=2, dim=-1)
-            else:
-                perturbed_embedding = self.encoder(augmented)
+            # 임베딩 추출 (정밀도 모드 적용)
+            perturbed_embedding = self.embed_for_attack(augmented)
             
             # Loss 계산
             cosine_similarity = F.cosine_similarity(
@@ -461,6 +476,10 @@ class HighQualityVoiceProtection:
             if not total_loss.requires_grad:
                 continue
             
+            if metrics is not None:
+                metrics.update(iteration, cosine_similarity, l2_distance, shaped_pert,
+                               bands=(sensitive_penalty, mid_penalty, high_penalty), augmented=is_augmented)
+            
             total_loss.backward()
             
             # Gradient clipping (안정성)
@@ -483,10 +502,12 @@ class HighQualityVoiceProtection:
             if -total_loss.item() > best_loss:
                 best_loss = -total_loss.item()
                 best_perturbation = shaped_pert.clone().detach()
+                if metrics is not None:
+                    metrics.mark_best(iteration)
             
             # Progress
             if (iteration + 1) % 100 == 0:
-                print(f"Iter {iteration+1}/{self.iterations}: "
+                print(f"Iter {iteration+1}/{iterations}: "
                       f"Cosine={cosine_similarity.item():.4f}, "
                       f"Psycho={psycho_loss.item():.4f}, "
                       f"Smooth={smoothness_loss.item():.4f}")
@@ -510,22 +531,294 @@ class HighQualityVoiceProtection:
         
         return best_perturbation.detach()
     
-    def analyze_protection(self, original_waveform, perturbation):
-        """보호 효과 분석"""
+    def generate_preview_perturbation(self, original_waveform, steps=5, task_id=None, cancelled_tasks=None,
+                                      metrics=None):
+        """
+        빠른 미리보기 perturbation - 몇 step signed-gradient PGD (1초 목표)
+        증강 / STFT shaping 없이 temporal smoothing + noise gate 만 루프 안에서 적용
+        """
+        original_embedding = self.original_embedding(original_waveform)
+        gate = self.noise_gate(original_waveform)
+        if self.attack_mode == "quality":
+            gate = gate * (0.2 + 0.8 * self.vad.detect_voice_segments(original_waveform))
+        
+        step = 2.5 * self.epsilon / max(steps - 1, 1)
+        # 랜덤 시작 (0 에서는 코사인이 최대 → 첫 gradient 부호가 사실상 노이즈)
+        perturbation = torch.empty_like(original_waveform).uniform_(-self.epsilon, self.epsilon)
+        best_cos = float('inf')
+        best_perturbation = perturbation
+        
+        print(f"\nApplying preview PGD attack ({steps} steps)...")
+        
+        for i in range(steps):
+            if cancelled_tasks is not None and task_id in cancelled_tasks:
+                print(f"\n[Protect Audio] Preview cancelled at step {i}/{steps}")
+                raise Exception("Processing cancelled by user")
+            last = i == steps - 1  # 마지막 step 은 평가만 (backward 생략)
+            perturbation.requires_grad = not last
+            
+            shaped_pert = self.temporal_smoothing(perturbation) * gate
+            perturbed_waveform = torch.clamp(original_waveform + shaped_pert, -1.0, 1.0)
+            perturbed_embedding = self.embed_for_attack(perturbed_waveform)
+            cosine_similarity = F.cosine_similarity(
+                original_embedding.detach(), perturbed_embedding, dim=-1
+            ).mean()
+            
+            if not last:
+                cosine_similarity.backward()
+            
+            with torch.no_grad():
+                if metrics is not None:
+                    l2_distance = torch.norm(original_embedding - perturbed_embedding, p=2, dim=-1).mean()
+                    metrics.update(i, cosine_similarity, l2_distance, shaped_pert)
+                if cosine_similarity.item() < best_cos:
+                    best_cos = cosine_similarity.item()
+                    best_perturbation = shaped_pert.detach()
+                    if metrics is not None:
+                        metrics.mark_best(i)
+                
+                # 코사인 유사도를 낮추는 방향 + Epsilon ball 제약
+                if not last:
+                    perturbation = perturbation - step * perturbation.grad.sign()
+                    perturbation = torch.clamp(perturbation, -self.epsilon, self.epsilon)
+            
+            print(f"  Step {i+1}/{steps}: Cosine={best_cos:.4f}")
+        
+        return best_perturbation * 0.8
+    
+    def generate_perturbation_batch(self, waveforms, task_id=None, cancelled_tasks=None,
+                                    stop_cosine=None, patience=300, check_every=50, return_stats=False):
+        """
+        N개 파형(각 (1,1,T_i))의 독립 perturbation 을 패딩 배치 1개로 동시에 최적화
+        - 아이템별 마스크: 패딩 구간 perturbation = 0, ECAPA 에는 wav_lens 로 유효 길이 전달
+        - 손실 / grad clip / L2 제약 / best 추적은 아이템별
+        - 조기 종료: check_every 마다 patience 동안 개선 없거나 코사인 < stop_cosine 이면 해당 아이템 중단
+        반환: perturbation 리스트 (각 (1,1,T_i)) [, 아이템별 통계]
+        """
+        B = len(waveforms)
+        lens = [w.shape[-1] for w in waveforms]
+        T = max(lens)
+        lengths = torch.tensor(lens, device=self.device)
+        original = torch.cat([F.pad(w, (0, T - n)) for w, n in zip(waveforms, lens)])          # (B,1,T)
+        item_mask = (torch.arange(T, device=self.device).view(1, 1, T) < lengths.view(B, 1, 1)).float()
+        wav_lens = lengths.float() / T
+        
+        # 원본에만 의존하는 값은 아이템별 (패딩 전 길이로) 1회 계산
+        original_embedding = torch.cat([self.original_embedding(w) for w in waveforms])
+        voice_mask = torch.cat([F.pad(self.vad.detect_voice_segments(w), (0, T - n)) for w, n in zip(waveforms, lens)])
+        gate = torch.cat([F.pad(self.noise_gate(w), (0, T - n)) for w, n in zip(waveforms, lens)])
+        if self.attack_mode == "quality":
+            voice_weight = (0.2 + 0.8 * voice_mask) * item_mask
+        elif self.attack_mode == "balanced":
+            voice_weight = (0.5 + 0.5 * voice_mask) * item_mask
+        else:
+            voice_weight = item_mask
+        max_norm = (self.epsilon * lengths.float().sqrt() * 0.5).view(B, 1, 1)
+        
+        perturbation = (torch.zeros_like(original).normal_(0, self.epsilon/20) * item_mask).requires_grad_(True)
+        optimizer = torch.optim.AdamW([perturbation], lr=self.alpha, weight_decay=0.001)
+        scheduler = torch.optim.lr_scheduler.CosineAnnealingWarmRestarts(
+            optimizer, T_0=200, T_mult=2, eta_min=self.alpha * 0.01
+        )
+        
+        best_loss = torch.full((B,), -float('inf'), device=self.device)
+        best_cos = torch.ones(B, device=self.device)
+        best_perturbation = perturbation.detach().clone()
+        last_improve = torch.zeros(B, dtype=torch.long, device=self.device)
+        stopped_at = torch.full((B,), self.iterations, dtype=torch.long, device=self.device)
+        active = torch.ones(B, dtype=torch.bool, device=self.device)
+        
+        print(f"\nStarting batched optimization: {B} clips, padded to {T/16000:.2f}s, "
+              f"{self.iterations} iterations")
+        
+        for iteration in range(self.iterations):
+            if iteration % 50 == 0 and cancelled_tasks is not None and task_id in cancelled_tasks:
+                print(f"\n[Protect Audio] Batch cancelled at iteration {iteration}/{self.iterations}")
+                raise Exception("Processing cancelled by user")
+            optimizer.zero_grad()
+            
+            if iteration > 100:
+                with torch.no_grad():
+                    pert_shaped = self.spectral_shaping_filter(perturbation.detach())
+                shaped_pert = pert_shaped + (perturbation - perturbation.detach())
+                shaped_pert = self.temporal_smoothing(shaped_pert) * gate
+            else:
+                shaped_pert = perturbation
+            shaped_pert = shaped_pert * voice_weight
+            
+            perturbed_waveform = torch.clamp(original + shaped_pert, -1.0, 1.0)
+            
+            with torch.no_grad():
+                if random.random() < self.augmentation_prob:
+                    augmented = self.augmentor.apply_random_augmentation(perturbed_waveform.detach())
+                else:
+                    augmented = perturbed_waveform.detach()
+            augmented = augmented + (perturbed_waveform - perturbed_waveform.detach())
+            
+            perturbed_embedding = self.embed_for_attack(augmented, wav_lens)
+            
+            # 아이템별 손실 (B,)
+            cosine_similarity = F.cosine_similarity(
+                original_embedding.detach(), perturbed_embedding, dim=-1
+            ).reshape(B)
+            l2_distance = torch.norm(
+                original_embedding.detach() - perturbed_embedding, p=2, dim=-1
+            ).reshape(B)
+            embedding_loss = cosine_similarity - 0.3 * l2_distance
+            
+            power = torch.abs(torch.fft.rfft(shaped_pert, dim=-1)).pow(2)
+            n_freqs = power.shape[-1]
+            sensitive_end, mid_end = int(0.25 * n_freqs), int(0.5 * n_freqs)
+            psycho_loss = (
+                2.0 * power[..., :sensitive_end].mean(dim=(1, 2)) +
+                0.5 * power[..., sensitive_end:mid_end].mean(dim=(1, 2)) -
+                0.1 * power[..., mid_end:].mean(dim=(1, 2))
+            )
+            
+            diff1 = torch.abs(shaped_pert[:, :, 1:] - shaped_pert[:, :, :-1])
+            diff2 = torch.abs(diff1[:, :, 1:] - diff1[:, :, :-1])
+            smoothness_loss = (
+                diff1.sum(dim=(1, 2)) / (lengths - 1).clamp_min(1) +
+                0.5 * diff2.sum(dim=(1, 2)) / (lengths - 2).clamp_min(1)
+            )
+            sparsity = shaped_pert.abs().sum(dim=(1, 2)) / lengths
+            
+            item_loss = (
+                embedding_loss +
+                self.lambda_psycho * psycho_loss +
+                self.lambda_smooth * smoothness_loss +
+                self.lambda_spectral * sparsity
+            )
+            (item_loss * active).sum().backward()
+            
+            with torch.no_grad():
+                # 아이템별 gradient clipping (max_norm=0.5)
+                g = perturbation.grad
+                g_norm = g.reshape(B, -1).norm(dim=1).view(B, 1, 1)
+                g.mul_(torch.clamp(0.5 / (g_norm + 1e-6), max=1.0) * active.view(B, 1, 1))
+            
+            optimizer.step()
+            scheduler.step()
+            
+            with torch.no_grad():
+                perturbation.clamp_(-self.epsilon, self.epsilon)
+                pert_norm = torch.norm(perturbation, p=2, dim=-1, keepdim=True)
+                perturbation.div_(torch.max(pert_norm / max_norm, torch.ones_like(pert_norm)))
+                perturbation.mul_(item_mask)
+                
+                # Best 저장 (아이템별, 호스트 동기화 없음)
+                neg = -item_loss.detach()
+                improved = (neg > best_loss) & active
+                best_loss = torch.where(improved, neg, best_loss)
+                best_cos = torch.where(improved, cosine_similarity.detach(), best_cos)
+                best_perturbation = torch.where(improved.view(B, 1, 1), shaped_pert.detach(), best_perturbation)
+                last_improve = torch.where(improved, torch.full_like(last_improve, iteration), last_improve)
+            
+            if (iteration + 1) % check_every == 0:
+                stop = (iteration - last_improve) >= patience
+                if stop_cosine is not None:
+                    stop |= best_cos < stop_cosine
+                stopped_at = torch.where(active & stop, torch.full_like(stopped_at, iteration + 1), stopped_at)
+                active &= ~stop
+                n_active = int(active.sum())
+                if (iteration + 1) % 100 == 0 or n_active == 0:
+                    print(f"Iter {iteration+1}/{self.iterations}: active {n_active}/{B}, "
+                          f"best cosine {best_cos.mean().item():.4f}")
+                if n_active == 0:
+                    print("All clips converged, stopping early.")
+                    break
+        
+        # 최종 후처리 (generate_perturbation 과 동일)
+        best_perturbation = self.spectral_shaping_filter(best_perturbation)
+        best_perturbation = self.temporal_smoothing(best_perturbation)
+        best_perturbation = best_perturbation * gate * 0.8
+        
+        perturbations = [best_perturbation[i:i + 1, :, :n].detach() for i, n in enumerate(lens)]
+        if not return_stats:
+            return perturbations
+        stats = [
+            {'cosine_best': c, 'iterations': it}
+            for c, it in zip(best_cos.tolist(), stopped_at.tolist())
+        ]
+        return perturbations, stats
+    
+    def protect_batch(self, input_paths, output_paths, max_batch=8, bucket_ratio=1.25,
+                      task_id=None, cancelled_tasks=None, **batch_kw):
+        """
+        여러 짧은 오디오를 길이 버킷(최장/최단 ≤ bucket_ratio, 최대 max_batch 개)으로 묶어 배치 보호
+        반환: 입력 순서대로 {'cosine_similarity', 'snr_db', 'iterations', 'output'} 리스트
+        """
+        waveforms = [self.load_audio(p) for p in input_paths]
+        order = sorted(range(len(waveforms)), key=lambda i: waveforms[i].shape[-1])
+        buckets, cur = [], []
+        for i in order:
+            if cur and (len(cur) >= max_batch or
+                        waveforms[i].shape[-1] > bucket_ratio * waveforms[cur[0]].shape[-1]):
+                buckets.append(cur)
+                cur = []
+            cur.append(i)
+        if cur:
+            buckets.append(cur)
+        
+        results = [None] * len(waveforms)
+        for b, idx in enumerate(buckets):
+            print(f"\n[Protect Batch] bucket {b+1}/{len(buckets)}: {len(idx)} clips")
+            perts, stats = self.generate_perturbation_batch(
+                [waveforms[i] for i in idx], task_id, cancelled_tasks, return_stats=True, **batch_kw
+            )
+            for i, pert, st in zip(idx, perts, stats):
+                w = waveforms[i]
+                snr_db = 10 * torch.log10(w.pow(2).mean() / pert.pow(2).mean().clamp_min(1e-12)).item()
+                self.save_protected_audio(w, pert, output_paths[i])
+                results[i] = {
+                    'cosine_similarity': st['cosine_best'],
+                    'snr_db': snr_db,
+                    'iterations': st['iterations'],
+                    'output': output_paths[i],
+                }
+        return results
+    
+    def output_cosine(self, original_waveform, perturbation):
+        """저장될 출력 (원본 + 최종 perturbation) 의 실제 코사인 — 임베딩 1회 추가"""
         perturbed_waveform = original_waveform + perturbation
         perturbed_waveform = torch.clamp(perturbed_waveform, -1.0, 1.0)
         
         # 임베딩 비교
-        original_emb = self.extract_embedding(original_waveform)
+        original_emb = self.original_embedding(original_waveform)
         perturbed_emb = self.extract_embedding(perturbed_waveform)
         
-        cosine_sim = F.cosine_similarity(original_emb, perturbed_emb, dim=-1).mean().item()
-        l2_dist = torch.norm(original_emb - perturbed_emb, p=2, dim=-1).mean().item()
-        
-        # SNR 계산
-        signal_power = torch.mean(original_waveform ** 2)
-        noise_power = torch.mean(perturbation ** 2)
-        snr_db = 10 * torch.log10(signal_power / noise_power).item()
+        return F.cosine_similarity(original_emb, perturbed_emb, dim=-1).mean().item()
+    
+    def analyze_protection(self, original_waveform, perturbation, metrics=None, extra=None, verify_output=False):
+        """
+        보호 효과 분석
+        metrics 가 있으면 루프 추정 코사인(증강 없는 뷰, 최종 후처리 전)과 최종 SNR/대역 에너지를 사용 → 임베딩 재계산 없음
+        루프 추정치는 후처리(shaping/gate/×0.8) 전 값이라 출력보다 보호를 과대평가할 수 있음
+        verify_output=True 면 출력의 실제 코사인을 1회 추가 계산해 사용
+        extra: 텔레메트리 레코드에 추가할 필드 (tier 등)
+        """
+        record = None
+        output_cos = None
+        if metrics is None or verify_output:
+            output_cos = self.output_cosine(original_waveform, perturbation)
+        if metrics is not None:
+            extra = dict(extra or {})
+            if output_cos is not None:
+                extra['cosine_output'] = output_cos
+            record = metrics.finalize(original_waveform, perturbation, extra=extra)
+            snr_db = record['snr_db']
+        if output_cos is not None:
+            cosine_sim, cosine_source = output_cos, "output"
+        else:
+            cosine_sim = record['cosine_clean_estimate']
+            if cosine_sim is None:
+                cosine_sim = record['cosine_best']
+            cosine_source = "loop_estimate"
+        if metrics is None:
+            # SNR 계산
+            signal_power = torch.mean(original_waveform ** 2)
+            noise_power = torch.mean(perturbation ** 2)
+            snr_db = 10 * torch.log10(signal_power / noise_power).item()
         
         # PESQ 추정
         pesq_estimate = min(4.5, max(1.0, 4.5 - max(0, 40 - snr_db) * 0.08))
@@ -536,7 +829,10 @@ class HighQualityVoiceProtection:
         print(f"Mode: {self.attack_mode.upper()} (Quality-focused)")
         
         print(f"\n[Protection Effectiveness]")
-        print(f"  Cosine Similarity: {cosine_sim:.4f}")
+        if cosine_source == "output":
+            print(f"  Cosine Similarity: {cosine_sim:.4f}")
+        else:
+            print(f"  Cosine Similarity: {cosine_sim:.4f} (loop estimate, before post-processing)")
         if cosine_sim < 0.4:
             print(f"    • Status: ✓ PROTECTED (Voice cloning prevented)")
         elif cosine_sim < 0.6:
@@ -556,13 +852,21 @@ class HighQualityVoiceProtection:
         else:
             print(f"    • Quality: △ ACCEPTABLE")
         
+        if record is not None:
+            print(f"\n[Telemetry] {record['iterations']} iters in {record['elapsed_sec']:.1f}s "
+                  f"({record['it_per_sec'] or 0:.1f} it/s), best iter {record['best_iter']}")
+        
         print("="*70)
         
-        return {
+        analysis = {
             'cosine_similarity': cosine_sim,
+            'cosine_source': cosine_source,   # "output" (실측) / "loop_estimate" (루프 추정)
             'snr_db': snr_db,
             'pesq_estimate': pesq_estimate
         }
+        if record is not None:
+            analysis['telemetry'] = record
+        return analysis
     
     def save_protected_audio(self, waveform, perturbation, output_path):
         """보호된 오디오 저장"""
@@ -601,16 +905,23 @@ def get_protector():
     return _protector
 
 
-def protect_audio(input_audio_path: str, output_audio_path: str, task_id=None, cancelled_tasks=None):
+def protect_audio(input_audio_path: str, output_audio_path: str, task_id=None, cancelled_tasks=None,
+                  perceptual=False, tier=DEFAULT_TIER, verify_output=False):
     """
     오디오 파일에 보호 노이즈 추가
     
     Args:
         input_audio_path: 입력 오디오 경로 (wav)
         output_audio_path: 출력 오디오 경로 (wav)
-        task_id: 작업 ID (취소 체크용)
+        task_id: 작업 ID (취소 체크용, 텔레메트리 job_id)
         cancelled_tasks: 취소된 작업 목록 (set)
+        perceptual: True 면 저장 후 실제 PESQ/STOI 를 백그라운드 스레드에서 계산
+        tier: PROTECTION_TIERS 키 (preview / standard / max)
+        verify_output: True 면 출력의 실제 코사인을 계산 (임베딩 1회 추가, 기본은 루프 추정치)
     """
+    if tier not in PROTECTION_TIERS:
+        raise ValueError(f"unknown protection tier: {tier}")
+    cfg = PROTECTION_TIERS[tier]
     try:
         # Protector 가져오기
         protector = get_protector()
@@ -622,15 +933,33 @@ def protect_audio(input_audio_path: str, output_audio_path: str, task_id=None, c
         duration = waveform.shape[-1] / 16000
         print(f"[Protect Audio] Duration: {duration:.2f} seconds")
         
-        # Perturbation 생성 (task_id와 cancelled_tasks 전달)
-        perturbation = protector.generate_perturbation(waveform, task_id, cancelled_tasks)
-        
-        # 분석
-        analysis = protector.analyze_protection(waveform, perturbation)
+        # Perturbation 생성 (task_id와 cancelled_tasks 전달) — 지표는 루프에서 증분 추적
+        t0 = time.time()
+        metrics = ProtectionMetrics(cfg['iterations'], waveform, job_id=task_id)
+        if cfg['method'] == "pgd":
+            perturbation = protector.generate_preview_perturbation(
+                waveform, cfg['iterations'], task_id, cancelled_tasks, metrics=metrics)
+        else:
+            perturbation = protector.generate_perturbation(
+                waveform, task_id, cancelled_tasks, metrics=metrics, iterations=cfg['iterations'])
+        latency = time.time() - t0
+        
+        # 분석 (기본: 추가 임베딩 패스 없음, 코사인은 루프 추정치)
+        analysis = protector.analyze_protection(waveform, perturbation, metrics=metrics,
+                                                verify_output=verify_output, extra={
+            'tier': tier,
+            'latency_sec': latency,
+            'latency_slo_sec': cfg['latency_slo_sec'],
+            'duration_sec': duration,
+        })
+        analysis.update(tier=tier, latency_sec=latency)  # 실행 시간만 (SLO 는 대기 포함으로 app.py 에서 판정)
         
         # 저장
         protector.save_protected_audio(waveform, perturbation, output_audio_path)
         
+        if perceptual:
+            metrics.start_perceptual(waveform, torch.clamp(waveform + perturbation, -1.0, 1.0))
+        
         print(f"[Protect Audio] ✓ Protected audio saved: {output_audio_path}")
         
         return analysis
@@ -640,7 +969,82 @@ def protect_audio(input_audio_path: str, output_audio_path: str, task_id=None, c
         raise
 
 
+def protect_audio_batch(input_audio_paths, output_audio_paths, task_id=None, cancelled_tasks=None, **batch_kw):
+    """
+    여러 오디오 파일을 배치로 보호 (짧은 음성 메모 다수용)
+    
+    Args:
+        input_audio_paths: 입력 오디오 경로 리스트 (wav)
+        output_audio_paths: 출력 오디오 경로 리스트 (같은 길이)
+        batch_kw: protect_batch 옵션 (max_batch, bucket_ratio, stop_cosine, patience ...)
+    """
+    if len(input_audio_paths) != len(output_audio_paths):
+        raise ValueError("input/output path lists must have the same length")
+    protector = get_protector()
+    return protector.protect_batch(
+        input_audio_paths, output_audio_paths, task_id=task_id, cancelled_tasks=cancelled_tasks, **batch_kw
+    )
+
+
+def benchmark_precision(audio_path, iterations=100, modes=(("fp32", False), ("bf16", False), ("bf16", True)),
+                        warmup=5):
+    """
+    정밀도 / compile 모드별 iterations/sec 와 최종 코사인 비교 (기준: fp32)
+    최종 코사인은 모드와 무관하게 fp32 임베딩으로 측정, compile 시간은 warmup 으로 제외
+    """
+    protector = get_protector()
+    waveform = protector.load_audio(audio_path)
+    saved = (protector.iterations, protector.precision, protector.compile_encoder)
+    protector.iterations = iterations
+    rows = []
+    try:
+        for precision, compiled in modes:
+            protector.configure_encoder(precision, compiled)
+            if warmup:
+                protector.iterations = warmup
+                protector.generate_perturbation(waveform)
+                protector.iterations = iterations
+            torch.manual_seed(0)
+            random.seed(0)
+            if protector.device.type == "cuda":
+                torch.cuda.synchronize()
+            t0 = time.time()
+            perturbation = protector.generate_perturbation(waveform)
+            if protector.device.type == "cuda":
+                torch.cuda.synchronize()
+            elapsed = time.time() - t0
+            protected = torch.clamp(waveform + perturbation, -1.0, 1.0)
+            cos = F.cosine_similarity(
+                protector.original_embedding(waveform), protector.extract_embedding(protected), dim=-1
+            ).mean().item()
+            rows.append({
+                'precision': precision,
+                'compiled': protector.compile_encoder,
+                'it_per_sec': iterations / elapsed,
+                'cosine': cos,
+            })
+    finally:
+        protector.iterations = saved[0]
+        protector.configure_encoder(saved[1], saved[2])
+    
+    base = rows[0]
+    print("\n" + "="*70)
+    print(f"PRECISION BENCHMARK ({iterations} iterations, {waveform.shape[-1]/16000:.1f}s audio)")
+    print("="*70)
+    print(f"{'mode':<16}{'it/s':>10}{'speedup':>10}{'cosine':>10}{'Δcos':>10}")
+    for r in rows:
+        name = r['precision'] + ("+compile" if r['compiled'] else "")
+        print(f"{name:<16}{r['it_per_sec']:>10.2f}{r['it_per_sec'] / base['it_per_sec']:>9.2f}x"
+              f"{r['cosine']:>10.4f}{r['cosine'] - base['cosine']:>+10.4f}")
+    return rows
+
+
 def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == "--bench":
+        # python protect_audio.py --bench input.wav [iterations]
+        benchmark_precision(sys.argv[2], int(sys.argv[3]) if len(sys.argv) >= 4 else 100)
+        return
+    
     input_file = "original_audio.wav"
     output_file = "protected_audio.wav"
     
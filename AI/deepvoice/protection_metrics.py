@@ -0,0 +1,157 @@
+"""
+protection_metrics.py
+보호 품질 지표를 최적화 루프 안에서 증분 추적 + 작업 단위 텔레메트리.
+
+- 루프에서 이미 계산한 임베딩 코사인 / 대역 에너지 / perturbation 파워를 디바이스 버퍼에 기록 (반복당 .item() 없음)
+- 작업 끝에서 버퍼를 1회만 호스트로 복사 → trace (log_every 간격) + 요약
+- SNR / 대역 에너지는 최종 perturbation 으로 정확히 계산 (임베딩 재계산 없음)
+- 실제 PESQ / STOI 는 선택: 작업 후 백그라운드 스레드에서 계산 (pesq, pystoi 설치 시)
+- 레코드는 JSON Lines 로 <VOICE_TELEMETRY> (기본 assets/telemetry/protect_jobs.jsonl) 에 추가
+
+사용:
+    m = ProtectionMetrics(iterations, original_waveform, job_id=task_id)
+    (루프) m.update(it, cosine, l2, shaped_pert, bands=(sens, mid, high), augmented=aug)
+    (루프) m.mark_best(it)
+    rec = m.finalize(original_waveform, final_perturbation)
+    m.start_perceptual(original_waveform, protected_waveform)     # 선택
+"""
+import os
+import json
+import time
+import threading
+
+import torch
+
+TELEMETRY_PATH = os.environ.get("VOICE_TELEMETRY") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "assets", "telemetry", "protect_jobs.jsonl")
+SAMPLE_RATE = 16000
+BAND_EDGES = (0.25, 0.5)  # rfft bin 비율: 0-4k / 4-8k / 8k+ (16kHz 기준, generate_perturbation 과 동일)
+COLS = ("cosine", "l2", "band_low", "band_mid", "band_high", "pert_power")
+
+_EMIT_LOCK = threading.Lock()
+
+
+def band_energies(perturbation, edges=BAND_EDGES):
+    """rfft 파워를 구간별 평균 (텐서 3개)"""
+    mag2 = torch.fft.rfft(perturbation, dim=-1).abs().pow(2)
+    n = mag2.shape[-1]
+    a, b = int(edges[0] * n), int(edges[1] * n)
+    return mag2[..., :a].mean(), mag2[..., a:b].mean(), mag2[..., b:].mean()
+
+
+def emit_telemetry(record, path=None):
+    """레코드 1줄 JSON 추가 (path="" 이면 기록 안 함)"""
+    path = TELEMETRY_PATH if path is None else path
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with _EMIT_LOCK, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class ProtectionMetrics:
+    def __init__(self, iterations, original_waveform, job_id=None, log_every=50, telemetry_path=None):
+        self.job_id = job_id
+        self.iterations = iterations
+        self.log_every = log_every
+        self.telemetry_path = telemetry_path
+        self.buf = torch.full((iterations, len(COLS)), float("nan"), device=original_waveform.device)
+        self.aug = torch.zeros(iterations, dtype=torch.bool, device=original_waveform.device)
+        self.signal_power = original_waveform.detach().pow(2).mean()
+        self.best_iter = None
+        self.n_done = 0
+        self.t0 = time.time()
+        self.record = None
+        self._perceptual = None
+
+    def update(self, iteration, cosine, l2, shaped_pert, bands=None, augmented=False):
+        """루프 1회분 기록 — 전부 디바이스 텐서 연산"""
+        with torch.no_grad():
+            if bands is None:
+                bands = band_energies(shaped_pert.detach())
+            row = torch.stack([cosine.detach(), l2.detach(), *(b.detach() for b in bands),
+                               shaped_pert.detach().pow(2).mean()])
+            self.buf[iteration] = row.float()
+            self.aug[iteration] = bool(augmented)
+        self.n_done = iteration + 1
+
+    def mark_best(self, iteration):
+        self.best_iter = iteration
+
+    def finalize(self, original_waveform, perturbation, extra=None):
+        """최종 perturbation 기준 SNR/대역 + 루프 추적 코사인 → 텔레메트리 레코드"""
+        elapsed = time.time() - self.t0
+        n = self.n_done
+        with torch.no_grad():
+            noise_power = perturbation.detach().pow(2).mean()
+            snr = 10 * torch.log10(self.signal_power / noise_power.clamp_min(1e-12))
+            bands = torch.stack(band_energies(perturbation.detach()))
+            host = torch.cat([self.buf[:n].reshape(-1), bands, snr.view(1),
+                              self.aug[:n].float()]).cpu().tolist()  # 호스트 전송 1회
+        rows = [host[i * len(COLS):(i + 1) * len(COLS)] for i in range(n)]
+        off = n * len(COLS)
+        final_bands, snr_db, aug = host[off:off + 3], host[off + 3], host[off + 4:]
+        clean = [r[0] for r, a in zip(rows, aug) if not a]
+        bi = self.best_iter if self.best_iter is not None else n - 1
+        best = rows[bi] if rows else None
+        # 증강 없는 뷰 기준 추정: best iter 가 클린이면 그 값, 아니면 마지막 클린 iter
+        clean_est = best[0] if best and not aug[bi] else (clean[-1] if clean else None)
+
+        record = {
+            "job_id": self.job_id,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "iterations": n,
+            "elapsed_sec": elapsed,
+            "it_per_sec": n / elapsed if elapsed > 0 else None,
+            "best_iter": self.best_iter,
+            # 루프에서 인코더가 본 값 (최종 후처리 전)
+            "cosine_best": best[0] if best else None,
+            "l2_best": best[1] if best else None,
+            "cosine_clean_last": clean[-1] if clean else None,
+            "cosine_clean_estimate": clean_est,
+            "cosine_min": min((r[0] for r in rows), default=None),
+            # 최종 perturbation 기준
+            "snr_db": snr_db,
+            "band_energy": dict(zip(("low", "mid", "high"), final_bands)),
+            "trace": [
+                dict(iter=i + 1, **dict(zip(COLS, rows[i])), augmented=bool(aug[i]))
+                for i in range(self.log_every - 1, n, self.log_every)
+            ] if self.log_every else [],
+        }
+        if extra:
+            record.update(extra)
+        self.record = record
+        emit_telemetry(record, self.telemetry_path)
+        return record
+
+    def start_perceptual(self, original_waveform, protected_waveform, on_done=None):
+        """실제 PESQ(wb) / STOI 를 백그라운드 스레드에서 계산 → 레코드 갱신 + 별도 텔레메트리 1줄"""
+        ref = original_waveform.detach().reshape(-1).float().cpu().numpy()
+        deg = protected_waveform.detach().reshape(-1).float().cpu().numpy()
+
+        def run():
+            out = {"job_id": self.job_id, "type": "perceptual"}
+            try:
+                from pesq import pesq
+                out["pesq_wb"] = float(pesq(SAMPLE_RATE, ref, deg, "wb"))
+            except Exception as e:  # 미설치 / 무음 입력 등
+                out["pesq_error"] = str(e)
+            try:
+                from pystoi import stoi
+                out["stoi"] = float(stoi(ref, deg, SAMPLE_RATE, extended=False))
+            except Exception as e:
+                out["stoi_error"] = str(e)
+            if self.record is not None:
+                self.record.update({k: v for k, v in out.items() if k != "type"})
+            emit_telemetry(out, self.telemetry_path)
+            if on_done is not None:
+                on_done(out)
+
+        self._perceptual = threading.Thread(target=run, name=f"perceptual-{self.job_id}", daemon=True)
+        self._perceptual.start()
+        return self._perceptual
+
+    def wait_perceptual(self, timeout=None):
+        if self._perceptual is not None:
+            self._perceptual.join(timeout)
+        return self.record
@@ -9,12 +9,22 @@ import torchaudio
 import torch.nn.functional as F
 import numpy as np
 from pathlib import Path
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "AI", "deepvoice"))
+from embedding_cache import get_embedding_cache, ECAPA_SOURCE  # 클린 임베딩 캐시
+
+# 인코더 이름 → 캐시 id (검증기는 정규화 전 raw 임베딩을 캐시)
+ENCODER_IDS = {'ECAPA-TDNN': ECAPA_SOURCE + "#raw"}
+WINDOW_BATCH = 64  # 구간 임베딩 1회 encode_batch 윈도 수
+
+
 class ProtectionValidatorV3:
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.encoders = {}
+        self._resamplers = {}
         self.load_encoders()
     
     def load_encoders(self):
@@ -45,8 +55,32 @@ class ProtectionValidatorV3:
         
         return waveform.to(self.device)
     
-    def segment_based_similarity(self, original, protected, encoder, segment_length=1.0):
-        """구간별 임베딩 비교"""
+    def encode(self, encoder, waveform):
+        """encode_batch → raw 임베딩 텐서"""
+        with torch.no_grad():
+            emb = encoder.encode_batch(waveform)
+        return emb[0] if isinstance(emb, tuple) else emb
+    
+    def original_embedding(self, encoder_name, waveform, compute_fn=None, segment="full"):
+        """원본 임베딩 — (내용 해시, 인코더, 구간 스펙) 캐시 공유"""
+        encoder = self.encoders[encoder_name]
+        compute_fn = compute_fn or (lambda w: self.encode(encoder, w))
+        return get_embedding_cache().embed(
+            waveform, ENCODER_IDS.get(encoder_name, encoder_name), compute_fn, segment=segment
+        )
+    
+    def window_batch(self, waveform, segment_samples, hop_samples, n_windows):
+        """unfold 로 (N, segment_samples) 윈도 배치 생성 (복사 없는 view)"""
+        return waveform.reshape(-1).unfold(0, segment_samples, hop_samples)[:n_windows]
+    
+    def encode_windows(self, encoder, windows, batch_size=WINDOW_BATCH):
+        """윈도 배치를 batch_size 단위 encode_batch → (N, D)"""
+        embs = [self.encode(encoder, windows[i:i + batch_size]) for i in range(0, len(windows), batch_size)]
+        return torch.cat([e.reshape(e.shape[0], -1) for e in embs])
+    
+    def segment_based_similarity(self, original, protected, encoder, segment_length=1.0, encoder_name=None,
+                                 batch_size=WINDOW_BATCH):
+        """구간별 임베딩 비교 (윈도 일괄 임베딩 + 벡터화 코사인)"""
         # 먼저 길이 맞춤
         min_len = min(original.shape[-1], protected.shape[-1])
         original = original[..., :min_len]
@@ -56,32 +90,82 @@ class ProtectionValidatorV3:
         segment_samples = int(segment_length * sample_rate)
         hop_samples = segment_samples // 2
         
-        similarities = []
-        positions = []
+        n_windows = len(range(0, min_len - segment_samples, hop_samples))
+        if n_windows == 0:
+            return [], []
         
-        for start in range(0, min_len - segment_samples, hop_samples):
-            end = start + segment_samples
-            
-            orig_segment = original[:, start:end]
-            prot_segment = protected[:, start:end]
-            
-            with torch.no_grad():
-                orig_emb = encoder.encode_batch(orig_segment)
-                prot_emb = encoder.encode_batch(prot_segment)
-                
-                if isinstance(orig_emb, tuple):
-                    orig_emb = orig_emb[0]
-                if isinstance(prot_emb, tuple):
-                    prot_emb = prot_emb[0]
-                
-                orig_norm = F.normalize(orig_emb, p=2, dim=-1)
-                prot_norm = F.normalize(prot_emb, p=2, dim=-1)
-                sim = F.cosine_similarity(orig_norm, prot_norm, dim=-1).item()
-                
-            similarities.append(sim)
-            positions.append(start / sample_rate)
+        def window_embeddings(w):
+            return self.encode_windows(
+                encoder, self.window_batch(w, segment_samples, hop_samples, n_windows), batch_size
+            )
         
-        return positions, similarities
+        # 원본 구간 임베딩은 캐시에서 (인코더 이름을 알 때만)
+        if encoder_name is not None:
+            orig_embs = self.original_embedding(
+                encoder_name, original, window_embeddings,
+                segment=f"win{segment_length}_hop{hop_samples / sample_rate}"
+            )
+        else:
+            orig_embs = window_embeddings(original)
+        prot_embs = window_embeddings(protected)
+        
+        sims = F.cosine_similarity(
+            F.normalize(orig_embs.reshape(n_windows, -1), p=2, dim=-1),
+            F.normalize(prot_embs, p=2, dim=-1), dim=-1
+        )
+        positions = [i * hop_samples / sample_rate for i in range(n_windows)]
+        return positions, sims.tolist()
+    
+    def stream_segment_similarity(self, original_path, protected_path, encoder, segment_length=1.0,
+                                  chunk_sec=60.0, batch_size=WINDOW_BATCH):
+        """
+        매우 긴 파일용 스트리밍 버전: chunk_sec 단위로 읽어 윈도 배치 처리
+        chunk 마다 (positions, similarities) 를 yield (메모리는 chunk 크기로 제한)
+        """
+        sample_rate = 16000
+        segment_samples = int(segment_length * sample_rate)
+        hop_samples = segment_samples // 2
+        chunk = max(hop_samples, int(chunk_sec * sample_rate) // hop_samples * hop_samples)
+        
+        info_o, info_p = torchaudio.info(original_path), torchaudio.info(protected_path)
+        total = min(
+            int(info_o.num_frames * sample_rate / info_o.sample_rate),
+            int(info_p.num_frames * sample_rate / info_p.sample_rate),
+        )
+        last_start = total - segment_samples  # segment_based_similarity 와 같은 윈도 범위
+        
+        for c0 in range(0, max(last_start, 0), chunk):
+            n_windows = len(range(c0, min(c0 + chunk, last_start), hop_samples))
+            need = (n_windows - 1) * hop_samples + segment_samples
+            orig = self.load_audio_span(original_path, info_o.sample_rate, c0, need)
+            prot = self.load_audio_span(protected_path, info_p.sample_rate, c0, need)
+            
+            orig_embs = self.encode_windows(encoder, self.window_batch(orig, segment_samples, hop_samples, n_windows), batch_size)
+            prot_embs = self.encode_windows(encoder, self.window_batch(prot, segment_samples, hop_samples, n_windows), batch_size)
+            sims = F.cosine_similarity(
+                F.normalize(orig_embs, p=2, dim=-1), F.normalize(prot_embs, p=2, dim=-1), dim=-1
+            )
+            yield [(c0 + i * hop_samples) / sample_rate for i in range(n_windows)], sims.tolist()
+    
+    def load_audio_span(self, path, sr, start, length):
+        """16kHz 기준 [start, start+length) 구간만 읽어 16kHz 모노로 반환"""
+        margin = 64  # 리샘플 경계 여유
+        offset = max(0, int(start * sr / 16000) - margin)
+        num = int(length * sr / 16000) + 2 * margin
+        waveform, _ = torchaudio.load(path, frame_offset=offset, num_frames=num)
+        if waveform.shape[0] > 1:
+            waveform = waveform.mean(dim=0, keepdim=True)
+        waveform = waveform.to(self.device)
+        if sr != 16000:
+            key = (sr, str(self.device))
+            if key not in self._resamplers:
+                self._resamplers[key] = torchaudio.transforms.Resample(sr, 16000).to(self.device)
+            waveform = self._resamplers[key](waveform)
+        skip = start - int(round(offset * 16000 / sr))
+        waveform = waveform[:, skip:skip + length]
+        if waveform.shape[-1] < length:
+            waveform = F.pad(waveform, (0, length - waveform.shape[-1]))
+        return waveform
     
     def compute_spectral_difference(self, original, protected):
         """Mel-spectrogram 차이 분석 (길이 자동 맞춤)"""
@@ -160,13 +244,8 @@ class ProtectionValidatorV3:
         
         for encoder_name, encoder in self.encoders.items():
             with torch.no_grad():
-                orig_emb = encoder.encode_batch(original)
-                prot_emb = encoder.encode_batch(protected)
-                
-                if isinstance(orig_emb, tuple):
-                    orig_emb = orig_emb[0]
-                if isinstance(prot_emb, tuple):
-                    prot_emb = prot_emb[0]
+                orig_emb = self.original_embedding(encoder_name, original)
+                prot_emb = self.encode(encoder, protected)
                 
                 # Normalized
                 orig_norm = F.normalize(orig_emb, p=2, dim=-1)
@@ -199,7 +278,7 @@ class ProtectionValidatorV3:
         
         for encoder_name, encoder in self.encoders.items():
             positions, similarities = self.segment_based_similarity(
-                original, protected, encoder
+                original, protected, encoder, encoder_name=encoder_name
             )
             
             if similarities:
@@ -282,6 +361,8 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--original', required=True)
     parser.add_argument('--protected', required=True)
+    parser.add_argument('--stream', action='store_true', help='매우 긴 파일: 구간별 유사도만 chunk 스트리밍으로 계산')
+    parser.add_argument('--chunk_sec', type=float, default=60.0)
     
     args = parser.parse_args()
     
@@ -294,6 +375,18 @@ def main():
         sys.exit(1)
     
     validator = ProtectionValidatorV3()
+    if args.stream:
+        for encoder_name, encoder in validator.encoders.items():
+            sims = []
+            for positions, chunk_sims in validator.stream_segment_similarity(
+                args.original, args.protected, encoder, chunk_sec=args.chunk_sec
+            ):
+                sims.extend(chunk_sims)
+                print(f"{encoder_name} @ {positions[-1]:.0f}s: chunk avg {np.mean(chunk_sims):.4f}")
+            if sims:
+                print(f"{encoder_name}: average {np.mean(sims):.4f}, "
+                      f"protected {sum(1 for x in sims if x < 0.5)}/{len(sims)}")
+        return
     results = validator.validate(args.original, args.protected)
 
 
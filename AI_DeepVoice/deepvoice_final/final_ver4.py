@@ -8,65 +8,10 @@ import os
 from scipy import signal as scipy_signal
 
 
-class DataAugmentation:
-    """강건성을 위한 데이터 증강"""
-    def __init__(self, sample_rate=16000):
-        self.sample_rate = sample_rate
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    def random_resample(self, waveform):
-        """무작위 리샘플"""
-        target_rates = [8000, 12000, 16000, 24000]
-        target_sr = random.choice(target_rates)
-        
-        if target_sr == self.sample_rate:
-            return waveform
-        
-        resampler_down = torchaudio.transforms.Resample(
-            self.sample_rate, target_sr
-        ).to(self.device)
-        resampler_up = torchaudio.transforms.Resample(
-            target_sr, self.sample_rate
-        ).to(self.device)
-        
-        resampled = resampler_down(waveform)
-        restored = resampler_up(resampled)
-        
-        if restored.shape[-1] > waveform.shape[-1]:
-            restored = restored[..., :waveform.shape[-1]]
-        elif restored.shape[-1] < waveform.shape[-1]:
-            padding = waveform.shape[-1] - restored.shape[-1]
-            restored = F.pad(restored, (0, padding))
-        
-        return restored
-    
-    def mp3_compression_simulation(self, waveform):
-        """MP3 압축 시뮬레이션"""
-        cutoff = random.uniform(5000, 8000)  # 더 높은 cutoff
-        nyquist = self.sample_rate / 2
-        normalized_cutoff = cutoff / nyquist
-        
-        kernel_size = 101
-        kernel = torch.sinc(
-            2 * normalized_cutoff * (torch.arange(kernel_size, dtype=torch.float32) - kernel_size // 2)
-        )
-        kernel = kernel / kernel.sum()
-        kernel = kernel.view(1, 1, -1).to(self.device)
-        
-        padded = F.pad(waveform, (kernel_size // 2, kernel_size // 2), mode='reflect')
-        filtered = F.conv1d(padded, kernel)
-        
-        return filtered
-    
-    def apply_random_augmentation(self, waveform):
-        """무작위 증강 (가벼운 버전)"""
-        augmentations = [
-            self.random_resample,
-            self.mp3_compression_simulation,
-        ]
-        
-        aug_func = random.choice(augmentations)
-        return aug_func(waveform)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "AI", "deepvoice"))
+from audio_augment import DataAugmentation  # 공용 증강 (torch 네이티브)
+from embedding_cache import get_embedding_cache, ECAPA_SOURCE  # 클린 임베딩 캐시
+from frozen_surrogate import FrozenSurrogate  # 고정 인코더 래퍼 (파라미터 grad 없음)
 
 
 class VoiceActivityDetector:
@@ -156,7 +101,10 @@ class HighQualityVoiceProtection:
             self.encoder = self._create_simple_encoder()
             self.use_pretrained = False
         
-        self.augmentor = DataAugmentation()
+        # 인코더 파라미터 고정 (입력 gradient 만 필요)
+        self.encoder = FrozenSurrogate(self.encoder)
+        
+        self.augmentor = DataAugmentation(preset="quality")
         
         print(f"Device: {self.device}")
         print(f"Attack mode: {attack_mode} (Quality-focused)")
@@ -211,6 +159,12 @@ class HighQualityVoiceProtection:
         
         return embedding
     
+    def original_embedding(self, waveform):
+        """원본(클린) 임베딩 — 사전학습 인코더면 임베딩 캐시 공유"""
+        if not self.use_pretrained:
+            return self.extract_embedding(waveform)
+        return get_embedding_cache().embed(waveform, ECAPA_SOURCE, self.extract_embedding)
+    
     def spectral_shaping_filter(self, perturbation):
         """
         스펙트럴 쉐이핑 - 자연스러운 노이즈 생성
@@ -321,7 +275,7 @@ class HighQualityVoiceProtection:
         고품질 perturbation 생성 - 음질 보존 최우선
         """
         print("\nExtracting original speaker embedding...")
-        original_embedding = self.extract_embedding(original_waveform)
+        original_embedding = self.original_embedding(original_waveform)
         print(f"Original embedding shape: {original_embedding.shape}")
         
         # 음성 구간 분석
@@ -512,7 +466,7 @@ class HighQualityVoiceProtection:
         perturbed_waveform = torch.clamp(perturbed_waveform, -1.0, 1.0)
         
         # 임베딩 비교
-        original_emb = self.extract_embedding(original_waveform)
+        original_emb = self.original_embedding(original_waveform)
         perturbed_emb = self.extract_embedding(perturbed_waveform)
         
         cosine_sim = F.cosine_similarity(original_emb, perturbed_emb, dim=-1).mean().item()
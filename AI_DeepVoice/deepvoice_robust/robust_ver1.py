@@ -18,6 +18,9 @@ import random
 import sys
 import os
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "AI", "deepvoice"))
+from frozen_surrogate import FrozenSurrogate  # 고정 인코더 래퍼 (파라미터 grad 없음)
+
 
 class PracticalProtection:
     """
@@ -82,6 +85,8 @@ class PracticalProtection:
                 savedir="pretrained_models/spkrec-ecapa-voxceleb",
                 run_opts={"device": str(self.device)}
             )
+            # adversarial_noise 는 입력 gradient 만 필요 → 파라미터 고정
+            self.encoder = FrozenSurrogate(self.encoder)
             print("✓ Encoder loaded!")
             self.has_encoder = True
         except Exception as e:
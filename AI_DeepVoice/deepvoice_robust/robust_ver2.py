@@ -21,106 +21,10 @@ import sys
 import os
 
 
-class DataAugmentation:
-    """
-    강건성을 위한 데이터 증강
-    MP3 압축, 리샘플, 노이즈, 리버브 등을 시뮬레이션
-    """
-    def __init__(self, sample_rate=16000):
-        self.sample_rate = sample_rate
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    
-    def random_resample(self, waveform):
-        """무작위 리샘플 (8k/12k/16k/24k)"""
-        target_rates = [8000, 12000, 16000, 24000]
-        target_sr = random.choice(target_rates)
-        
-        if target_sr == self.sample_rate:
-            return waveform
-        
-        # 리샘플 후 다시 원래 샘플레이트로
-        resampler_down = torchaudio.transforms.Resample(
-            self.sample_rate, target_sr
-        ).to(self.device)
-        resampler_up = torchaudio.transforms.Resample(
-            target_sr, self.sample_rate
-        ).to(self.device)
-        
-        resampled = resampler_down(waveform)
-        restored = resampler_up(resampled)
-        
-        # 길이 맞춤
-        if restored.shape[-1] > waveform.shape[-1]:
-            restored = restored[..., :waveform.shape[-1]]
-        elif restored.shape[-1] < waveform.shape[-1]:
-            padding = waveform.shape[-1] - restored.shape[-1]
-            restored = F.pad(restored, (0, padding))
-        
-        return restored
-    
-    def random_gain(self, waveform):
-        """무작위 게인 조정 (±3dB)"""
-        gain_db = random.uniform(-3, 3)
-        gain_linear = 10 ** (gain_db / 20)
-        return waveform * gain_linear
-    
-    def add_background_noise(self, waveform):
-        """배경 노이즈 추가 (SNR 20-40dB)"""
-        snr_db = random.uniform(20, 40)
-        signal_power = torch.mean(waveform ** 2)
-        noise_power = signal_power / (10 ** (snr_db / 10))
-        
-        noise = torch.randn_like(waveform) * torch.sqrt(noise_power)
-        return waveform + noise
-    
-    def mp3_compression_simulation(self, waveform):
-        """
-        MP3 압축 시뮬레이션 (더 강하게)
-        """
-        # 더 공격적인 압축 시뮬레이션
-        cutoff = random.uniform(3000, 7000)  # 더 낮은 주파수
-        nyquist = self.sample_rate / 2
-        normalized_cutoff = cutoff / nyquist
-        
-        # Lowpass filter
-        kernel_size = 101
-        kernel = torch.sinc(
-            2 * normalized_cutoff * (torch.arange(kernel_size, dtype=torch.float32) - kernel_size // 2)
-        )
-        kernel = kernel / kernel.sum()
-        kernel = kernel.view(1, 1, -1).to(self.device)
-        
-        # Convolution
-        padded = F.pad(waveform, (kernel_size // 2, kernel_size // 2), mode='reflect')
-        filtered = F.conv1d(padded, kernel)
-        
-        # 추가: 비트 양자화 시뮬레이션 (MP3 효과)
-        bits = random.choice([8, 12, 16])
-        scale = 2 ** bits
-        quantized = torch.round(filtered * scale) / scale
-        
-        return quantized
-    
-    def apply_random_augmentation(self, waveform):
-        """무작위로 증강 기법 하나 또는 여러 개 적용"""
-        augmentations = [
-            self.random_resample,
-            self.random_gain,
-            self.add_background_noise,
-            self.mp3_compression_simulation,
-        ]
-        
-        # 50% 확률로 2개 연속 적용 (더 강건하게)
-        if random.random() < 0.5:
-            aug_func1 = random.choice(augmentations)
-            aug_func2 = random.choice(augmentations)
-            waveform = aug_func1(waveform)
-            waveform = aug_func2(waveform)
-        else:
-            aug_func = random.choice(augmentations)
-            waveform = aug_func(waveform)
-        
-        return waveform
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "AI", "deepvoice"))
+from audio_augment import DataAugmentation  # 공용 증강 (torch 네이티브)
+from embedding_cache import get_embedding_cache, ECAPA_SOURCE  # 클린 임베딩 캐시
+from frozen_surrogate import FrozenSurrogate  # 고정 인코더 래퍼 (파라미터 grad 없음)
 
 
 class RobustVoiceProtection:
@@ -172,7 +76,10 @@ class RobustVoiceProtection:
             self.use_pretrained = False
         
         # Data Augmentation 초기화
-        self.augmentor = DataAugmentation()
+        # 인코더 파라미터 고정 (입력 gradient 만 필요)
+        self.encoder = FrozenSurrogate(self.encoder)
+        
+        self.augmentor = DataAugmentation(preset="robust")
         
         print(f"Device: {self.device}")
         print(f"Parameters: epsilon={epsilon}, alpha={alpha}, iterations={iterations}")
@@ -232,6 +139,12 @@ class RobustVoiceProtection:
         
         return embedding
     
+    def original_embedding(self, waveform):
+        """원본(클린) 임베딩 — 사전학습 인코더면 임베딩 캐시 공유"""
+        if not self.use_pretrained:
+            return self.extract_embedding(waveform)
+        return get_embedding_cache().embed(waveform, ECAPA_SOURCE, self.extract_embedding)
+    
     def psychoacoustic_penalty(self, perturbation):
         """
         Psychoacoustic 페널티
@@ -258,7 +171,7 @@ class RobustVoiceProtection:
         """
         # 원본 임베딩 추출
         print("\nExtracting original speaker embedding...")
-        original_embedding = self.extract_embedding(original_waveform)
+        original_embedding = self.original_embedding(original_waveform)
         print(f"Original embedding shape: {original_embedding.shape}")
         print(f"Original embedding norm: {original_embedding.norm().item():.4f}")
         
@@ -352,7 +265,7 @@ class RobustVoiceProtection:
         perturbed_waveform = torch.clamp(perturbed_waveform, -1.0, 1.0)
         
         # 임베딩 비교
-        original_emb = self.extract_embedding(original_waveform)
+        original_emb = self.original_embedding(original_waveform)
         perturbed_emb = self.extract_embedding(perturbed_waveform)
         
         cosine_sim = F.cosine_similarity(original_emb, perturbed_emb, dim=-1).mean().item()
@@ -13,12 +13,15 @@ import cv2
 import math
 import argparse
 import numpy as np
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 # 랜드마크 추출: face_alignment(FAN)
 # pip install face-alignment
 import face_alignment
 
+from spsa_engine import SPSAOptimizer
+from face_track import resolve_face_track
+
 
 # ---------------------------
 # 유틸
@@ -96,6 +99,19 @@ def largest_face(landmarks_list: List[np.ndarray]) -> np.ndarray:
 # ---------------------------
 # SPSA 기반 노이즈 업데이트 (블랙박스)
 # ---------------------------
+def landmark_cosine_oracle(baseline_hm, fa_detector, sigma_pix: float, k: int):
+    """배치 oracle: X [N,H,W,3] in [0,1] → 기준 히트맵과의 코사인 유사도 (N,)"""
+    H, W = baseline_hm.shape[1:]
+    def oracle(X):
+        out = np.empty(len(X), dtype=np.float32)
+        for i, img in enumerate(X):
+            # RGB 그대로 전달 (FIX)
+            lm = largest_face(fa_detector.get_landmarks(to_uint8(np.clip(img, 0.0, 1.0))))
+            hm = make_heatmap_from_landmarks(lm, H, W, sigma_pix=sigma_pix, k=k)
+            out[i] = cosine_similarity(hm, baseline_hm)
+        return out
+    return oracle
+
 def spsa_step(image01: np.ndarray,
               baseline_hm: np.ndarray,
               fa_detector,
@@ -103,40 +119,21 @@ def spsa_step(image01: np.ndarray,
               delta: float,
               sigma_pix: float,
               k: int,
-              spsa_samples: int = 8) -> np.ndarray:
+              spsa_samples: int = 8,
+              optimizer: SPSAOptimizer = None) -> np.ndarray:
     """
     image01: [H,W,3] in [0,1]
     baseline_hm: [K,H,W]
     반환: 업데이트 스텝 (image 크기)  -> sign로 적용
     """
-    H, W = image01.shape[:2]
-    g_hat = np.zeros_like(image01, dtype=np.float32)
-
-    # SPSA: u ~ Rademacher {-1,+1}, L+ L- 평가 → (L+ - L-)/(2 delta) * u
-    for _ in range(spsa_samples):
-        u = np.random.choice([-1.0, 1.0], size=image01.shape).astype(np.float32)
-
-        # +delta
-        img_p = np.clip(image01 + delta * u, 0.0, 1.0)
-        # RGB 그대로 전달 (FIX)
-        lm_p = fa_detector.get_landmarks(to_uint8(img_p))
-        lm_p = largest_face(lm_p)
-        hm_p = make_heatmap_from_landmarks(lm_p, H, W, sigma_pix=sigma_pix, k=k)
-        Lp = cosine_similarity(hm_p, baseline_hm)
-
-        # -delta
-        img_m = np.clip(image01 - delta * u, 0.0, 1.0)
-        # RGB 그대로 전달 (FIX)
-        lm_m = fa_detector.get_landmarks(to_uint8(img_m))
-        lm_m = largest_face(lm_m)
-        hm_m = make_heatmap_from_landmarks(lm_m, H, W, sigma_pix=sigma_pix, k=k)
-        Lm = cosine_similarity(hm_m, baseline_hm)
-
-        # 목표: 유사도 ↓ → 손실 = cos → 감소시키는 방향
-        g_hat += ((Lp - Lm) / (2.0 * delta)) * u
-
-    g_hat /= float(max(1, spsa_samples))
-    step = -alpha * np.sign(g_hat)  # cos 낮추기 위한 하강 방향
+    # SPSA: u ~ Rademacher {-1,+1}, L+ L- 평가 → (L+ - L-)/(2 delta) * u  (spsa_engine)
+    opt = optimizer or SPSAOptimizer(K=spsa_samples, c=delta, dist="rademacher")
+    g_hat = opt.estimate(image01, landmark_cosine_oracle(baseline_hm, fa_detector, sigma_pix, k),
+                         c=delta, K=spsa_samples)
+    if g_hat is None:  # 쿼리 예산 소진
+        return np.zeros_like(image01, dtype=np.float32)
+    # 목표: 유사도 ↓ → 손실 = cos → 감소시키는 방향
+    step = -alpha * np.sign(g_hat)
     return step
 
 
@@ -151,16 +148,19 @@ def attack_frame_blackbox(frame_bgr: np.ndarray,
                           k: int,
                           sigma_pix: float,
                           spsa_samples: int = 8,
-                          debug_prefix: str = None) -> np.ndarray:
+                          debug_prefix: str = None,
+                          lms0: Optional[List[np.ndarray]] = None) -> np.ndarray:
     """
     epsilon, alpha: [픽셀] 단위(예: 8, 1) → 내부에서 /255
+    lms0: 원본 프레임 랜드마크 (get_landmarks 형식, 얼굴 트랙에서 전달) — None이면 직접 검출
     """
     H, W = frame_bgr.shape[:2]
     img01 = from_uint8(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))  # [0,1], RGB
 
     # 기준 랜드마크/히트맵 — RGB 그대로 전달 (FIX)
-    lm0 = fa_detector.get_landmarks(to_uint8(img01))
-    lm0 = largest_face(lm0)
+    if lms0 is None:
+        lms0 = fa_detector.get_landmarks(to_uint8(img01))
+    lm0 = largest_face(lms0)
     hm0 = make_heatmap_from_landmarks(lm0, H, W, sigma_pix=sigma_pix, k=k)
 
     if hm0.sum() == 0.0:
@@ -174,11 +174,12 @@ def attack_frame_blackbox(frame_bgr: np.ndarray,
 
     x_adv = img01.copy()
     x_orig = img01.copy()
+    opt = SPSAOptimizer(K=spsa_samples, c=delta01, dist="rademacher", chunk=8, name="LMB")
 
     for t in range(steps):
         step_dir = spsa_step(x_adv, hm0, fa_detector, alpha=alpha01,
                              delta=delta01, sigma_pix=sigma_pix, k=k,
-                             spsa_samples=spsa_samples)
+                             spsa_samples=spsa_samples, optimizer=opt)
         x_adv = np.clip(x_adv + step_dir, 0.0, 1.0)
 
         # 원본 대비 L_inf 프로젝션
@@ -211,7 +212,7 @@ def process_image(in_path, out_path, args, fa_detector):
     cv2.imwrite(out_path, adv)
     print(f"[OK] Saved image: {out_path}")
 
-def process_video(in_path, out_path, args, fa_detector):
+def process_video(in_path, out_path, args, fa_detector, track=None):
     cap = cv2.VideoCapture(in_path)
     if not cap.isOpened():
         raise RuntimeError(f"영상을 열 수 없습니다: {in_path}")
@@ -242,7 +243,8 @@ def process_video(in_path, out_path, args, fa_detector):
                 frame, fa_detector,
                 steps=args.steps, epsilon=args.epsilon, alpha=args.alpha,
                 k=args.k, sigma_pix=args.sigma_pix,
-                spsa_samples=args.spsa, debug_prefix=debug_prefix
+                spsa_samples=args.spsa, debug_prefix=debug_prefix,
+                lms0=track.landmarks_list(f) if track is not None else None
             )
             noise_cache = (adv.astype(np.int16) - frame.astype(np.int16))
         else:
@@ -311,6 +313,8 @@ def main():
     ap.add_argument("--dump_every", type=int, default=10, help="디버그 프레임 저장 주기")
     ap.add_argument("--device", type=str, default="cuda",
                     help="face_alignment 실행 디바이스: 'cuda' 또는 'cpu' (기본 cuda)")
+    ap.add_argument("--face_track", type=str, default=None,
+                    help="face_track.py 트랙 npz 경로 또는 auto (영상 해시로 로드/생성, 원본 프레임 검출 생략)")
 
     args = ap.parse_args()
 
@@ -337,7 +341,8 @@ def main():
     if args.mode == "image":
         process_image(args.input, args.output, args, fa)
     else:
-        process_video(args.input, args.output, args, fa)
+        track = resolve_face_track(args.face_track, args.input, fa=fa)
+        process_video(args.input, args.output, args, fa, track=track)
 
 if __name__ == "__main__":
     main()
@@ -21,6 +21,9 @@ import onnxruntime as ort
 import face_alignment
 from scipy.fftpack import dct, idct
 
+from spsa_engine import SPSAOptimizer
+from face_track import resolve_face_track
+
 # ---------------- helpers ----------------
 def to_uint8(x):
     return np.clip(x*255.0,0,255).astype(np.uint8)
@@ -77,38 +80,150 @@ def largest_face(landmarks_list):
     return landmarks_list[int(np.argmax(sizes))]
 
 # ---------------- optical flow propagation ----------------
-def propagate_perturb(prev_frame, cur_frame, prev_noise):
+# 속도/품질 프리셋: method, 흐름 계산 해상도 배율, DIS 프리셋
+FLOW_PRESETS = {
+    "quality":  dict(method="farneback", scale=1.0),
+    "balanced": dict(method="dis", scale=0.5, dis="medium"),
+    "fast":     dict(method="dis", scale=0.25, dis="ultrafast"),
+}
+_DIS_PRESETS = {"ultrafast": "DISOPTICAL_FLOW_PRESET_ULTRAFAST",
+                "fast": "DISOPTICAL_FLOW_PRESET_FAST",
+                "medium": "DISOPTICAL_FLOW_PRESET_MEDIUM"}
+
+def noise_roi(noise, pad=16):
+    """노이즈가 0이 아닌 영역의 bbox (+pad) → (x1,y1,x2,y2) 또는 None"""
+    nz = np.any(noise != 0, axis=-1) if noise.ndim == 3 else (noise != 0)
+    ys = np.flatnonzero(nz.any(axis=1)); xs = np.flatnonzero(nz.any(axis=0))
+    if len(ys) == 0: return None
+    h, w = nz.shape
+    return (max(0, xs[0]-pad), max(0, ys[0]-pad), min(w, xs[-1]+1+pad), min(h, ys[-1]+1+pad))
+
+class FlowPropagator:
+    """
+    이전 프레임 노이즈를 optical flow 로 현재 프레임에 워핑.
+    - 기준 격자(meshgrid)는 해상도별 1회만 생성해 재사용
+    - 흐름은 (선택) 얼굴 ROI 안에서만, scale 배율로 줄여 계산 후 업샘플 (ROI 밖은 그대로 유지)
+    - method: "farneback" | "dis" (CPU에서 훨씬 빠름)
+    - t_flow / n: 흐름 계산 누적 시간 / 횟수 (ms_per_frame)
+    """
+    def __init__(self, preset="quality", method=None, scale=None, dis=None):
+        cfg = dict(FLOW_PRESETS[preset])
+        self.method = method or cfg["method"]
+        self.scale = float(scale if scale is not None else cfg["scale"])
+        self.dis_preset = dis or cfg.get("dis", "fast")
+        self._grid = None
+        self._dis = None
+        self.t_flow = 0.0
+        self.n = 0
+
+    def grid(self, h, w):
+        if self._grid is None or self._grid[0].shape != (h, w):
+            xx, yy = np.meshgrid(np.arange(w, dtype=np.float32), np.arange(h, dtype=np.float32))
+            self._grid = (xx, yy)
+        return self._grid
+
+    def _flow(self, prev_gray, cur_gray):
+        if self.method == "dis":
+            if self._dis is None:
+                self._dis = cv2.DISOpticalFlow_create(getattr(cv2, _DIS_PRESETS[self.dis_preset]))
+            return self._dis.calc(prev_gray, cur_gray, None)
+        return cv2.calcOpticalFlowFarneback(prev_gray, cur_gray,
+                                            None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+    def flow(self, prev_gray, cur_gray):
+        """scale<1 이면 축소 해상도에서 계산 후 원래 크기·변위로 복원"""
+        t0 = time.time()
+        h, w = prev_gray.shape[:2]
+        if self.scale < 1.0:
+            sw, sh = max(16, int(w*self.scale)), max(16, int(h*self.scale))
+            small = self._flow(cv2.resize(prev_gray, (sw, sh), interpolation=cv2.INTER_AREA),
+                               cv2.resize(cur_gray, (sw, sh), interpolation=cv2.INTER_AREA))
+            flow = cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+            flow[..., 0] *= w / sw; flow[..., 1] *= h / sh
+        else:
+            flow = self._flow(prev_gray, cur_gray)
+        self.t_flow += time.time() - t0
+        self.n += 1
+        return flow
+
+    def __call__(self, prev_frame, cur_frame, prev_noise, roi=None):
+        prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
+        cur_gray = cv2.cvtColor(cur_frame, cv2.COLOR_BGR2GRAY)
+        h, w = prev_gray.shape[:2]
+        xx, yy = self.grid(h, w)
+        if roi is None:
+            flow = self.flow(prev_gray, cur_gray)
+            map_x = xx + flow[..., 0]
+            map_y = yy + flow[..., 1]
+            return cv2.remap(prev_noise, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        x1, y1, x2, y2 = roi
+        flow = self.flow(prev_gray[y1:y2, x1:x2], cur_gray[y1:y2, x1:x2])
+        # ROI 좌표는 전역 격자 기준 → ROI 밖 픽셀도 샘플링 가능
+        map_x = xx[y1:y2, x1:x2] + flow[..., 0]
+        map_y = yy[y1:y2, x1:x2] + flow[..., 1]
+        warped = prev_noise.copy()
+        warped[y1:y2, x1:x2] = cv2.remap(prev_noise, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+        return warped
+
+    @property
+    def ms_per_frame(self):
+        return 1000.0 * self.t_flow / max(1, self.n)
+
+_PROPAGATOR = None
+
+def propagate_perturb(prev_frame, cur_frame, prev_noise, propagator=None, roi=None):
     # prev_frame, cur_frame: BGR uint8
     # prev_noise: float32 noise same shape as frame in [-eps,eps] (value scale 0..1)
     # return estimated noise for cur_frame by warping prev_noise via flow
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    cur_gray = cv2.cvtColor(cur_frame, cv2.COLOR_BGR2GRAY)
-    flow = cv2.calcOpticalFlowFarneback(prev_gray, cur_gray,
-                                        None, 0.5, 3, 15, 3, 5, 1.2, 0)
-    h,w = flow.shape[:2]
-    # grid
-    xx, yy = np.meshgrid(np.arange(w), np.arange(h))
-    map_x = (xx + flow[...,0]).astype(np.float32)
-    map_y = (yy + flow[...,1]).astype(np.float32)
-    warped = cv2.remap(prev_noise, map_x, map_y, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
-    return warped
+    global _PROPAGATOR
+    if propagator is None:
+        if _PROPAGATOR is None:
+            _PROPAGATOR = FlowPropagator("quality")
+        propagator = _PROPAGATOR
+    return propagator(prev_frame, cur_frame, prev_noise, roi=roi)
+
+def bench_flow(input_path, n_frames=60, presets=None, roi=None):
+    """프리셋별 흐름 계산 시간(ms/frame) 측정: 연속 프레임 쌍에 대해 propagate 실행"""
+    cap = cv2.VideoCapture(input_path)
+    frames = []
+    while len(frames) < n_frames + 1:
+        ok, f = cap.read()
+        if not ok: break
+        frames.append(f)
+    cap.release()
+    if len(frames) < 2:
+        raise RuntimeError("Need at least 2 frames for flow benchmark.")
+    noise = np.zeros(frames[0].shape, np.float32)
+    res = {}
+    for name in (presets or FLOW_PRESETS):
+        prop = FlowPropagator(name)
+        t0 = time.time()
+        for a, b in zip(frames[:-1], frames[1:]):
+            prop(a, b, noise, roi=roi)
+        total = 1000.0 * (time.time() - t0) / (len(frames) - 1)
+        res[name] = (prop.ms_per_frame, total)
+        print(f"[flow-bench] {name:9s} ({prop.method}, scale {prop.scale:g}) | flow {prop.ms_per_frame:.1f} ms/frame | propagate {total:.1f} ms/frame")
+    return res
 
 # ---------------- universal HF watermark (tile pattern in DCT domain) ----------------
+# 패턴은 (H, W, tile, strength, seed) 로 완전히 결정됨 → 프로세스 캐시 + (선택) 디스크 캐시
+HF_CACHE_DIR = os.environ.get("LMB_HF_CACHE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "hf_cache")
+_HF_CACHE = {}
+
+def hf_ring_mask(ph, pw):
+    # 중심 반경 r 안쪽(저주파) 0, 나머지 1 — 이중 루프 대신 브로드캐스트
+    cx,cy = ph//2, pw//2
+    r = min(ph,pw)//4
+    i = np.arange(ph)[:,None]; j = np.arange(pw)[None,:]
+    return ((i-cx)**2 + (j-cy)**2 >= r*r).astype(np.float64)
+
 def make_hf_watermark(H, W, strength=0.05, tile=16, seed=1234):
     rng = np.random.RandomState(seed)
     # create small random high-frequency patch in DCT domain
     ph = tile; pw = tile
     base = rng.randn(ph,pw)
     # zero out low frequencies: keep high-frequency ring
-    mask = np.ones_like(base)
-    cx,cy = ph//2, pw//2
-    r = min(ph,pw)//4
-    for i in range(ph):
-        for j in range(pw):
-            # distance from center
-            if (i-cx)**2 + (j-cy)**2 < (r*r):
-                mask[i,j] = 0.0
-    base *= mask
+    base *= hf_ring_mask(ph, pw)
     # upsample tile to full size by tiling plus slight jitter
     tiles_y = int(math.ceil(H/ph)); tiles_x = int(math.ceil(W/pw))
     big = np.tile(base, (tiles_y, tiles_x))
@@ -123,36 +238,74 @@ def make_hf_watermark(H, W, strength=0.05, tile=16, seed=1234):
     pat = pat * strength
     return pat.astype(np.float32)  # values in approx [-strength, +strength]
 
+def hf_disk_enabled(cache_dir=None):
+    """--hf_cache 지정 또는 env LMB_HF_CACHE 설정 시 디스크 캐시 사용"""
+    return cache_dir is not None or bool(os.environ.get("LMB_HF_CACHE"))
+
+def hf_cache_path(H, W, tile, strength, seed, cache_dir=None):
+    return os.path.join(cache_dir or HF_CACHE_DIR, f"hf_{H}x{W}_t{tile}_s{strength:g}_seed{seed}.npy")
+
+def get_hf_watermark(H, W, strength=0.05, tile=16, seed=1234, cache_dir=None, disk=False):
+    """
+    make_hf_watermark 캐시 버전 (읽기 전용으로 공유 — 수정하지 말 것)
+    disk=True 면 cache_dir(기본 assets/hf_cache, env LMB_HF_CACHE) 의 .npy 를 영상/워커 간 재사용
+    """
+    key = (int(H), int(W), int(tile), float(strength), int(seed))
+    pat = _HF_CACHE.get(key)
+    if pat is not None:
+        return pat
+    path = hf_cache_path(*key, cache_dir=cache_dir) if disk else None
+    if path and os.path.exists(path):
+        pat = np.load(path)
+    else:
+        pat = make_hf_watermark(H, W, strength=strength, tile=tile, seed=seed)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp.npy"
+            np.save(tmp, pat)
+            os.replace(tmp, path)  # 다른 워커와 동시 저장해도 안전
+    pat.setflags(write=False)
+    _HF_CACHE[key] = pat
+    return pat
+
+def hf_watermark_for_frame(H, W, tile=16, seed=1234, base=256, cache_dir=None, disk=False):
+    """base×base 유니버설 패턴을 프레임 크기로 타일링 (프레임 크기별 1회만 계산)"""
+    key = ("frame", int(H), int(W), int(tile), int(seed), int(base))
+    big = _HF_CACHE.get(key)
+    if big is None:
+        hf_pat = get_hf_watermark(base, base, strength=1.0, tile=tile, seed=seed, cache_dir=cache_dir, disk=disk)
+        tile_y = int(math.ceil(H/base)); tile_x = int(math.ceil(W/base))
+        big = np.ascontiguousarray(np.tile(hf_pat, (tile_y, tile_x, 1))[:H,:W,:])
+        big.setflags(write=False)
+        _HF_CACHE[key] = big
+    return big
+
 # ---------------- SPSA on heatmap loss (stronger) ----------------
-def spsa_step_blackbox(img01, baseline_hm, fa_detector, alpha, delta, sigma_pix, k, spsa_samples=32):
+def spsa_step_blackbox(img01, baseline_hm, fa_detector, alpha, delta, sigma_pix, k, spsa_samples=32, optimizer=None):
     H,W = img01.shape[:2]
-    g_hat = np.zeros_like(img01, dtype=np.float32)
-    for _ in range(spsa_samples):
-        u = np.random.choice([-1.0,1.0], size=img01.shape).astype(np.float32)
-        img_p = np.clip(img01 + delta*u, 0.0, 1.0)
-        lm_p = fa_detector.get_landmarks(to_uint8(img_p))
-        lm_p = largest_face(lm_p)
-        hm_p = make_heatmap_from_landmarks(lm_p, H, W, sigma_pix=sigma_pix, k=k)
-        Lp = cosine_similarity(hm_p, baseline_hm)
-
-        img_m = np.clip(img01 - delta*u, 0.0, 1.0)
-        lm_m = fa_detector.get_landmarks(to_uint8(img_m))
-        lm_m = largest_face(lm_m)
-        hm_m = make_heatmap_from_landmarks(lm_m, H, W, sigma_pix=sigma_pix, k=k)
-        Lm = cosine_similarity(hm_m, baseline_hm)
-
-        g_hat += ((Lp - Lm) / (2.0 * delta)) * u
-    g_hat /= float(max(1, spsa_samples))
+    def oracle(X):
+        out = np.empty(len(X), dtype=np.float32)
+        for i, img in enumerate(X):
+            lm = largest_face(fa_detector.get_landmarks(to_uint8(np.clip(img, 0.0, 1.0))))
+            hm = make_heatmap_from_landmarks(lm, H, W, sigma_pix=sigma_pix, k=k)
+            out[i] = cosine_similarity(hm, baseline_hm)
+        return out
+    opt = optimizer or SPSAOptimizer(K=spsa_samples, c=delta, chunk=8)
+    g_hat = opt.estimate(img01, oracle, c=delta, K=max(1, spsa_samples))
+    if g_hat is None:
+        return np.zeros_like(img01, dtype=np.float32)
     step = -alpha * np.sign(g_hat)
     return step
 
 def attack_frame_strong(frame_bgr, fa_detector,
                         steps=8, epsilon=12, alpha=2, k=68, sigma_pix=1.2,
-                        spsa_samples=64, eot=3, hf_pat=None, hf_strength=0.04):
+                        spsa_samples=64, eot=3, hf_pat=None, hf_strength=0.04, lms0=None):
+    # lms0: 원본 프레임 랜드마크 (get_landmarks 형식, 얼굴 트랙) — None이면 직접 검출
     H,W = frame_bgr.shape[:2]
     img01 = from_uint8(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
-    lm0 = fa_detector.get_landmarks(to_uint8(img01))
-    lm0 = largest_face(lm0)
+    if lms0 is None:
+        lms0 = fa_detector.get_landmarks(to_uint8(img01))
+    lm0 = largest_face(lms0)
     if lm0 is None:
         return frame_bgr, np.zeros_like(img01, dtype=np.float32)
     baseline_hm = make_heatmap_from_landmarks(lm0, H, W, sigma_pix=sigma_pix, k=k)
@@ -167,6 +320,7 @@ def attack_frame_strong(frame_bgr, fa_detector,
     if hf_pat is not None:
         x_adv = np.clip(x_adv + hf_pat*hf_strength, 0.0, 1.0)
 
+    opt = SPSAOptimizer(K=spsa_samples, c=delta01, chunk=8, name="Hybrid")
     for t in range(steps):
         # SPSA optimizer with EOT
         g = np.zeros_like(x_adv)
@@ -174,7 +328,7 @@ def attack_frame_strong(frame_bgr, fa_detector,
             step_dir = spsa_step_blackbox(x_adv, baseline_hm, fa_detector,
                                          alpha=alpha01, delta=delta01,
                                          sigma_pix=sigma_pix, k=k,
-                                         spsa_samples=spsa_samples//max(1,eot))
+                                         spsa_samples=spsa_samples//max(1,eot), optimizer=opt)
             g += step_dir
         g /= float(max(1,eot))
         x_adv = np.clip(x_adv + g, 0.0, 1.0)
@@ -215,10 +369,8 @@ def process_video(input_path, output_path, args):
     else:
         LT = 1
     fa = face_alignment.FaceAlignment(LT, device=args.face_device, face_detector=args.face_detector)
+    track = resolve_face_track(args.face_track, input_path, fa=fa)
 
-    # universal HF pattern
-    hf_pat = make_hf_watermark(256,256, strength=1.0, tile=args.hf_tile, seed=args.hf_seed)
-    # resize hf pattern to frames dynamically later by cropping/tiling
     cap = cv2.VideoCapture(input_path)
     if not cap.isOpened():
         raise RuntimeError("Cannot open input video.")
@@ -226,8 +378,13 @@ def process_video(input_path, output_path, args):
     W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     fourcc = cv2.VideoWriter_fourcc(*"mp4v")
     writer = cv2.VideoWriter(output_path, fourcc, fps, (W,H))
+    # universal HF pattern: 프레임 크기별로 1회 (캐시 — 영상/워커 간 재사용)
+    big = hf_watermark_for_frame(H, W, tile=args.hf_tile, seed=args.hf_seed,
+                                 cache_dir=args.hf_cache, disk=hf_disk_enabled(args.hf_cache))
+    prop = FlowPropagator(args.flow_preset)
     prev_frame = None
     prev_noise = None
+    prev_roi = None
     frame_idx = 0
     total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
     print("[Hybrid] start video", input_path, "->", output_path)
@@ -236,18 +393,13 @@ def process_video(input_path, output_path, args):
         ok, frame = cap.read()
         if not ok:
             break
-        # generate hf pattern for this size
-        # tile/resize hf_pat to HxW
-        hh, ww = hf_pat.shape[0], hf_pat.shape[1]
-        tile_y = int(math.ceil(H/hh)); tile_x = int(math.ceil(W/ww))
-        big = np.tile(hf_pat, (tile_y, tile_x, 1))[:H,:W,:]
         # if stride skip heavy optimize and reuse propagated or cached noise
         if (frame_idx % max(1,args.stride)) == 0:
             # attempt propagate previous noise via optical flow to warmstart
             propagated = None
             if (prev_frame is not None) and (prev_noise is not None):
                 try:
-                    propagated = propagate_perturb(prev_frame, frame, prev_noise)
+                    propagated = propagate_perturb(prev_frame, frame, prev_noise, propagator=prop, roi=prev_roi)
                 except Exception as e:
                     propagated = None
             # attack this frame strongly
@@ -255,15 +407,17 @@ def process_video(input_path, output_path, args):
                                              steps=args.steps, epsilon=args.eps,
                                              alpha=args.alpha, k=args.k, sigma_pix=args.sigma_pix,
                                              spsa_samples=args.spsa, eot=args.eot,
-                                             hf_pat=big, hf_strength=args.hf_strength)
+                                             hf_pat=big, hf_strength=args.hf_strength,
+                                             lms0=track.landmarks_list(frame_idx) if track is not None else None)
             prev_noise = noise
+            prev_roi = noise_roi(noise) if args.flow_roi else None
         else:
             # reuse prev_noise if available (to save time) or propagate
             if prev_noise is None:
                 out = frame
             else:
                 try:
-                    propagated = propagate_perturb(prev_frame, frame, prev_noise)
+                    propagated = propagate_perturb(prev_frame, frame, prev_noise, propagator=prop, roi=prev_roi)
                     # apply propagated noise with small temporal smoothing
                     blend_noise = 0.85*prev_noise + 0.15*propagated
                     tmp = (from_uint8(frame.astype(np.uint8)) + blend_noise)
@@ -279,12 +433,14 @@ def process_video(input_path, output_path, args):
     writer.release()
     cap.release()
     print("[done] total time:", time.time()-start_t)
+    if prop.n:
+        print(f"[flow] {args.flow_preset}: {prop.ms_per_frame:.1f} ms/frame over {prop.n} frames")
 
 # ---------------- argparse ----------------
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--input", required=True)
-    p.add_argument("--output", required=True)
+    p.add_argument("--output", default=None)
     p.add_argument("--device", default="cuda", choices=["cuda","cpu"])
     p.add_argument("--face_device", default="cuda")
     p.add_argument("--face_detector", default="sfd", choices=["sfd","blazeface"])
@@ -299,9 +455,19 @@ def main():
     p.add_argument("--hf_strength", type=float, default=0.06)
     p.add_argument("--hf_tile", type=int, default=16)
     p.add_argument("--hf_seed", type=int, default=1337)
+    p.add_argument("--hf_cache", default=None, help=f"HF 패턴 디스크 캐시 폴더 (예: {HF_CACHE_DIR}; env LMB_HF_CACHE 만 설정해도 사용)")
     p.add_argument("--log_every", type=int, default=30)
+    p.add_argument("--flow_preset", default="quality", choices=list(FLOW_PRESETS), help="노이즈 전파 optical flow 속도/품질 프리셋")
+    p.add_argument("--flow_roi", action="store_true", help="노이즈가 있는 얼굴 ROI 안에서만 흐름 계산")
+    p.add_argument("--face_track", default=None, help="face_track.py 트랙 npz 경로 또는 auto (원본 프레임 검출 생략)")
+    p.add_argument("--bench_flow", type=int, default=0, help=">0 이면 처음 N 프레임으로 흐름 프리셋 벤치마크만 실행")
     args = p.parse_args()
 
+    if args.bench_flow > 0:
+        bench_flow(args.input, n_frames=args.bench_flow)
+        return
+    if not args.output:
+        p.error("--output is required")
     # face_alignment device handling already done via args.face_device
     process_video(args.input, args.output, args)
 
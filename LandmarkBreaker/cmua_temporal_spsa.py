@@ -2,35 +2,21 @@
 import os, cv2, numpy as np, argparse
 from tqdm import tqdm
 
-try:
-    import mediapipe as mp
-    MP_OK = True
-except Exception:
-    MP_OK = False
-
-def jpeg_sim(img, q=85):
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(q)]
-    _, enc = cv2.imencode(".jpg", img, encode_param)
-    dec = cv2.imdecode(enc, cv2.IMREAD_COLOR)
-    return dec
+from mp_service import MP_OK, get_mp_service
+from eot_engine import jpeg_sim_batch
 
 def detect_landmarks(img_bgr):
     if not MP_OK: return None
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    mp_face_mesh = mp.solutions.face_mesh
-    with mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True) as fm:
-        res = fm.process(img_rgb)
-    if not res.multi_face_landmarks:
-        return None
-    pts = res.multi_face_landmarks[0].landmark
-    h, w = img_bgr.shape[:2]
-    coords = np.array([[p.x*w, p.y*h] for p in pts], dtype=np.float32)
-    return coords
+    return get_mp_service(max_num_faces=1, refine_landmarks=True).face_landmarks(img_bgr)
 
 def landmark_var_loss(base_list, pert_list):
     acc = 0.0; count = 0
-    for b, p in zip(base_list, pert_list):
-        lm0 = detect_landmarks(b); lm1 = detect_landmarks(p)
+    if not MP_OK:  # 랜드마크 미검출과 동일하게 프레임당 5.0 페널티 (기존 동작)
+        return -5.0 if len(base_list) else 0.0
+    svc = get_mp_service(max_num_faces=1, refine_landmarks=True)
+    lms0 = svc.face_landmarks_batch(base_list)
+    lms1 = svc.face_landmarks_batch(pert_list)
+    for lm0, lm1 in zip(lms0, lms1):
         if lm0 is None or lm1 is None: 
             acc += 5.0; count += 1
             continue
@@ -44,27 +30,40 @@ def tv_norm(x):
     dy = np.abs(x[1:,:,:] - x[:-1,:,:]).mean()
     return dx + dy
 
-def cmua_temporal_opt(frames, eps=5, steps=10, iters=200, jpegq=88, lambda_temporal=2.0, lambda_tv=0.05):
-    W = [np.zeros_like(frames[0], dtype=np.float32) for _ in frames]
-
-    for it in tqdm(range(iters), desc="CMUA-temporal"):
-        pert = []
-        for t in range(len(frames)):
-            base = frames[t]
-            w = W[t]
-            if t>0:
-                w = 0.7 * W[t] + 0.3 * W[t-1]
-            img = np.clip(base.astype(np.float32) + w, 0, 255).astype(np.uint8)
-            img = jpeg_sim(img, q=jpegq)
-            pert.append(img)
-
-        L_main = landmark_var_loss(frames, pert)
-        L_temp = 0.0
-        L_tv = 0.0
-        for t in range(1, len(W)):
-            L_temp += np.mean(np.abs(W[t] - W[t-1])) / 255.0
-        for t in range(len(W)):
-            L_tv  += tv_norm(W[t]/255.0)
+def tv_grad(x):
+    """tv_norm 의 부호 subgradient (픽셀당 [-1, 1])"""
+    g = np.zeros_like(x, dtype=np.float32)
+    sx = np.sign(x[:,1:,:] - x[:,:-1,:]); g[:,1:,:] += sx; g[:,:-1,:] -= sx
+    sy = np.sign(x[1:,:,:] - x[:-1,:,:]); g[1:,:,:] += sy; g[:-1,:,:] -= sy
+    return 0.25 * g
+
+def temporal_grad(W, t, anchor):
+    """sum_t |W[t]-W[t-1]| 의 W[t] 부호 subgradient (t=0 은 anchor 와 비교, 픽셀당 [-1, 1])"""
+    prev = W[t-1] if t > 0 else anchor
+    nxt = W[t+1] if t+1 < len(W) else None
+    g = np.zeros_like(W[t], dtype=np.float32); n = 0
+    for nb in (prev, nxt):
+        if nb is not None:
+            g += np.sign(W[t] - nb); n += 1
+    return g / n if n else g
+
+def _disp(a, b):
+    if a is None or b is None: return 5.0
+    return np.linalg.norm(a-b,axis=1).mean()
+
+def _opt_window(frames, W, anchor, eps=5, iters=200, jpegq=88, lambda_temporal=2.0, lambda_tv=0.05,
+                desc="CMUA-temporal"):
+    """
+    윈도우 하나(frames[0..T-1])에 대해 W를 최적화.
+    update = SPSA 랜드마크 방향 (단위 step, 기존과 동일) + lambda_temporal * 시간 항 + lambda_tv * TV
+    anchor: 직전 윈도우의 마지막 확정 W (없으면 None) → W[0] 의 시간 항 이웃 (윈도우 경계 연속성)
+    """
+    # 원본 프레임의 랜드마크는 반복마다 바뀌지 않으므로 윈도우당 1회만 검출
+    svc = get_mp_service(max_num_faces=1, refine_landmarks=True) if MP_OK else None
+    lms0 = svc.face_landmarks_batch(frames) if svc else [None]*len(frames)
+
+    for it in tqdm(range(iters), desc=desc, leave=False):
+        W_prev = list(W)  # 시간 항은 반복 시작 시점의 W 기준
 
         # SPSA-like update
         for t in range(len(W)):
@@ -72,26 +71,71 @@ def cmua_temporal_opt(frames, eps=5, steps=10, iters=200, jpegq=88, lambda_tempo
             delta = np.random.choice([-1.0, 1.0], size=w.shape).astype(np.float32)
             wp = np.clip(w + delta, -eps, eps)
             imgp = np.clip(base.astype(np.float32)+wp, 0, 255).astype(np.uint8)
-            imgp = jpeg_sim(imgp, q=jpegq)
             wm = np.clip(w - delta, -eps, eps)
             imgm = np.clip(base.astype(np.float32)+wm, 0, 255).astype(np.uint8)
-            imgm = jpeg_sim(imgm, q=jpegq)
+            imgp, imgm = jpeg_sim_batch([imgp, imgm], q=jpegq)
 
-            lm0 = detect_landmarks(base); lmp = detect_landmarks(imgp); lmm = detect_landmarks(imgm)
-            def disp(a,b):
-                if a is None or b is None: return 5.0
-                return np.linalg.norm(a-b,axis=1).mean()
-            Lp = -disp(lm0,lmp); Lm = -disp(lm0,lmm)
+            lm0 = lms0[t]; lmp = detect_landmarks(imgp); lmm = detect_landmarks(imgm)
+            Lp = -_disp(lm0,lmp); Lm = -_disp(lm0,lmm)
             g = (Lp - Lm) / (2.0 + 1e-8) * delta
             g = g / (np.mean(np.abs(g)) + 1e-8)
-            W[t] = np.clip(w - 1.0 * g, -eps, eps)
-
+            g = g + lambda_temporal * temporal_grad(W_prev, t, anchor) + lambda_tv * tv_grad(w)
+            W[t] = np.clip(w - g, -eps, eps)
+
+    # 윈도우 결과 로그 (윈도우당 1회만 FaceMesh 평가)
+    if MP_OK:
+        pert = [np.clip(f.astype(np.float32) + w, 0, 255).astype(np.uint8) for f, w in zip(frames, W)]
+        tqdm.write(f"{desc}: landmark displacement {-landmark_var_loss(frames, jpeg_sim_batch(pert, q=jpegq)):.3f}px")
+    return W
+
+def cmua_temporal_stream(frame_iter, write_fn, window=16, eps=5, steps=10, iters=200, jpegq=88,
+                         lambda_temporal=2.0, lambda_tv=0.05):
+    """
+    슬라이딩 윈도우 스트리밍 버전: 메모리에는 window개의 프레임/W만 유지.
+    - frame_iter: BGR uint8 프레임 iterator
+    - write_fn(frame): 확정된 프레임을 바로 writer로 전달
+    - 윈도우 경계: 직전 윈도우의 마지막 W를 anchor로 넘겨 W[0] 의 시간 항에 사용하고
+      새 윈도우의 W 초기값도 anchor로 warm-start
+    반환: 처리한 프레임 수
+    """
+    window = max(1, int(window))
+    anchor = None
+    n_done = 0
+    buf = []
+
+    def flush(buf, anchor):
+        init = np.zeros_like(buf[0], dtype=np.float32) if anchor is None else anchor
+        W = [init.copy() for _ in buf]
+        W = _opt_window(buf, W, anchor, eps=eps, iters=iters, jpegq=jpegq,
+                        lambda_temporal=lambda_temporal, lambda_tv=lambda_tv, desc=f"CMUA-temporal [{n_done}:{n_done+len(buf)}]")
+        for t in range(len(buf)):
+            write_fn(np.clip(buf[t].astype(np.float32) + W[t], 0, 255).astype(np.uint8))
+        return W[-1]
+
+    for f in frame_iter:
+        buf.append(f)
+        if len(buf) == window:
+            anchor = flush(buf, anchor)
+            n_done += len(buf)
+            buf = []
+    if buf:
+        flush(buf, anchor)
+        n_done += len(buf)
+    return n_done
+
+def cmua_temporal_opt(frames, eps=5, steps=10, iters=200, jpegq=88, lambda_temporal=2.0, lambda_tv=0.05, window=None):
+    """리스트 입력 호환용 래퍼 (window=None이면 전체를 한 윈도우로 최적화)"""
     out = []
-    for t in range(len(frames)):
-        img = np.clip(frames[t].astype(np.float32) + W[t], 0, 255).astype(np.uint8)
-        out.append(img)
+    cmua_temporal_stream(iter(frames), out.append, window=window or len(frames), eps=eps, steps=steps,
+                         iters=iters, jpegq=jpegq, lambda_temporal=lambda_temporal, lambda_tv=lambda_tv)
     return out
 
+def read_frames(cap):
+    while True:
+        ret, f = cap.read()
+        if not ret: break
+        yield f
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True)
@@ -103,6 +147,7 @@ def main():
     ap.add_argument("--jpegq", type=int, default=88)
     ap.add_argument("--lambda-temporal", type=float, default=2.0)
     ap.add_argument("--lambda-tv", type=float, default=0.05)
+    ap.add_argument("--window", type=int, default=16, help="슬라이딩 윈도우 프레임 수 (메모리 상한)")
     args = ap.parse_args()
 
     cap = cv2.VideoCapture(args.input)
@@ -110,22 +155,15 @@ def main():
     W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     FPS = args.fps if args.fps>0 else cap.get(cv2.CAP_PROP_FPS)
-    frames = []
-    while True:
-        ret, f = cap.read()
-        if not ret: break
-        frames.append(f.copy())
-    cap.release()
-    if len(frames)==0: raise SystemExit("No frames.")
 
-    out_frames = cmua_temporal_opt(
-        frames, eps=args.eps, steps=args.steps, iters=args.iters, jpegq=args.jpegq,
+    outv = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (W,H))
+    n = cmua_temporal_stream(
+        read_frames(cap), outv.write, window=args.window,
+        eps=args.eps, steps=args.steps, iters=args.iters, jpegq=args.jpegq,
         lambda_temporal=args.lambda_temporal, lambda_tv=args.lambda_tv
     )
-
-    outv = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (W,H))
-    for f in out_frames: outv.write(f)
-    outv.release()
+    cap.release(); outv.release()
+    if n==0: raise SystemExit("No frames.")
     print("Saved:", args.output)
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""
+eot_engine.py
+블랙박스 공격 공용 EOT(Expectation over Transformation) 엔진.
+
+- 한 이미지에서 M개의 변환본을 한 번에 생성 (리사이즈 지터 / JPEG / 블러 / 밝기·대비)
+- 리사이즈·JPEG·블러는 샘플별로 스레드 풀에서 실행 (cv2 연산은 GIL 해제)
+- 밝기/대비 지터는 배치 전체에 한 번의 벡터 연산
+- 출력 버퍼 (M,H,W,3) uint8 을 스텝 간 재사용 (호출 스레드별) → 호출 결과를 보관하려면 .copy() 필요
+  공용 풀을 여러 스레드가 동시에 호출해도 서로의 결과를 덮어쓰지 않음
+
+사용:
+    from eot_engine import EOTPool, LMB_EOT, DCT_EOT, jpeg_sim, jpeg_sim_batch
+    pool = EOTPool(M=4, **LMB_EOT)
+    variants = pool(img_bgr_u8)          # (4,H,W,3) 한 이미지의 M개 변환본
+    pair = pool.map([img_p, img_m])      # 입력마다 변환 1개씩
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# defend/landmarkBreakr.py eot_augment 와 동일한 분포
+LMB_EOT = dict(scale=(0.87, 1.10), jpeg_q=(40, 90), p_jpeg=1.0, blur_ks=(3, 5), p_blur=0.5,
+               contrast=(0.92, 1.08), brightness=(-7, 7), order=("resize", "jpeg", "blur"))
+# eot_etc.py apply_eot_rgb01 과 동일한 분포 (RGB 입력)
+DCT_EOT = dict(scale=(0.92, 1.06), jpeg_q=(60, 95), p_jpeg=0.9, blur_ks=(1, 3, 5), p_blur=0.5,
+               contrast=None, brightness=None, order=("resize", "blur", "jpeg"), rgb=True)
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+def get_executor(n_workers=None):
+    """프로세스 공용 스레드 풀 (처음 호출 시 생성)"""
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            n = n_workers or min(8, os.cpu_count() or 1)
+            _EXECUTOR = ThreadPoolExecutor(max_workers=n, thread_name_prefix="eot")
+    return _EXECUTOR
+
+
+# ---------------- JPEG 왕복 ----------------
+def jpeg_roundtrip(img, q=85, rgb=False):
+    """uint8 3채널 이미지 JPEG 인코딩→디코딩 (rgb=True면 RGB 순서 유지)"""
+    src = cv2.cvtColor(img, cv2.COLOR_RGB2BGR) if rgb else img
+    _, enc = cv2.imencode(".jpg", src, [int(cv2.IMWRITE_JPEG_QUALITY), int(q)])
+    dec = cv2.imdecode(enc, cv2.IMREAD_COLOR)
+    return cv2.cvtColor(dec, cv2.COLOR_BGR2RGB) if rgb else dec
+
+def jpeg_sim(img, q=85):
+    return jpeg_roundtrip(img, q=q)
+
+def jpeg_sim_batch(imgs, q=85):
+    """여러 이미지를 스레드 풀에서 동시에 JPEG 왕복"""
+    if len(imgs) <= 1:
+        return [jpeg_roundtrip(im, q=q) for im in imgs]
+    return list(get_executor().map(lambda im: jpeg_roundtrip(im, q=q), imgs))
+
+
+# ---------------- EOT 풀 ----------------
+class EOTPool:
+    def __init__(self, M=4, scale=(0.87, 1.10), jpeg_q=(40, 90), p_jpeg=1.0,
+                 blur_ks=(3, 5), p_blur=0.5, contrast=(0.92, 1.08), brightness=(-7, 7),
+                 order=("resize", "jpeg", "blur"), rgb=False, n_workers=None, seed=None):
+        self.M = int(M)
+        self.scale = scale
+        self.jpeg_q = jpeg_q
+        self.p_jpeg = p_jpeg
+        self.blur_ks = np.asarray(blur_ks, dtype=np.int32)
+        self.p_blur = p_blur
+        self.contrast = contrast
+        self.brightness = brightness
+        self.order = tuple(order)
+        self.rgb = rgb
+        self.rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()   # Generator 는 스레드 안전하지 않음
+        self.executor = get_executor(n_workers)
+        self._local = threading.local()     # 스레드별 out (N,H,W,3) uint8 / 밝기·대비용 f32 버퍼
+
+    def _buffers(self, n, shape):
+        tl = self._local
+        out = getattr(tl, "out", None)
+        if out is None or out.shape[0] < n or out.shape[1:] != shape:
+            tl.out = np.empty((n,) + shape, dtype=np.uint8)
+            tl.f32 = np.empty((n,) + shape, dtype=np.float32)
+        return tl.out[:n], tl.f32[:n]
+
+    def sample_params(self, n):
+        """n개 샘플의 변환 파라미터를 한 번에 추출"""
+        with self._rng_lock:
+            return self._sample_params(n)
+
+    def _sample_params(self, n):
+        r = self.rng
+        p = {}
+        p["scale"] = r.uniform(*self.scale, size=n) if self.scale else np.ones(n)
+        p["jpeg"] = r.random(n) < self.p_jpeg if self.jpeg_q else np.zeros(n, bool)
+        p["q"] = r.uniform(*self.jpeg_q, size=n).astype(np.int32) if self.jpeg_q else np.zeros(n, np.int32)
+        blur = r.random(n) < self.p_blur if len(self.blur_ks) else np.zeros(n, bool)
+        p["ks"] = np.where(blur, r.choice(self.blur_ks, size=n) if len(self.blur_ks) else 1, 1)
+        p["alpha"] = r.uniform(*self.contrast, size=n).astype(np.float32) if self.contrast else None
+        p["beta"] = r.uniform(*self.brightness, size=n).astype(np.float32) if self.brightness else None
+        return p
+
+    def _one(self, src, dst, s, do_jpeg, q, k):
+        h, w = src.shape[:2]
+        cur = src
+        for op in self.order:
+            if op == "resize" and abs(s - 1.0) > 1e-6:
+                small = cv2.resize(cur, (max(8, int(w * s)), max(8, int(h * s))), interpolation=cv2.INTER_LINEAR)
+                cur = cv2.resize(small, (w, h), dst=dst, interpolation=cv2.INTER_LINEAR)
+            elif op == "jpeg" and do_jpeg:
+                cur = jpeg_roundtrip(cur, q=q, rgb=self.rgb)
+            elif op == "blur" and k > 1:
+                cur = cv2.GaussianBlur(cur, (int(k), int(k)), 0)
+        if cur is not dst:
+            dst[...] = cur
+
+    def _run(self, srcs, n):
+        shape = srcs[0].shape
+        out, f32 = self._buffers(n, shape)
+        p = self.sample_params(n)
+        futs = [self.executor.submit(self._one, srcs[i], out[i], p["scale"][i], p["jpeg"][i], p["q"][i], p["ks"][i])
+                for i in range(n)]
+        for f in futs:
+            f.result()
+        # 밝기/대비: 배치 전체 한 번에
+        if p["alpha"] is not None or p["beta"] is not None:
+            a = p["alpha"] if p["alpha"] is not None else np.ones(n, np.float32)
+            b = p["beta"] if p["beta"] is not None else np.zeros(n, np.float32)
+            np.multiply(out, a[:, None, None, None], out=f32)
+            f32 += b[:, None, None, None]
+            np.clip(f32, 0, 255, out=f32)
+            np.copyto(out, f32, casting="unsafe")
+        return out
+
+    def __call__(self, img_u8, M=None):
+        """한 이미지의 M개 변환본 (N,H,W,3) uint8 — 호출 스레드 버퍼 뷰"""
+        n = int(M or self.M)
+        return self._run([img_u8] * n, n)
+
+    def map(self, imgs_u8):
+        """입력 이미지마다 랜덤 변환 1개씩 (N,H,W,3) uint8 — 호출 스레드 버퍼 뷰"""
+        return self._run(list(imgs_u8), len(imgs_u8))
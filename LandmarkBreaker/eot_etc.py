@@ -5,19 +5,16 @@
 #   python LMB_DCT_EOT.py --input ../input/testvideo_480p.mp4 --output ../output/dct_eot_lb.avi \
 #     --device cuda --epsilon 16 --alpha 3 --steps 8 --spsa 32 --lf 3 --stride 1 --face_detector sfd
 
-import os, io, argparse
+import os, argparse
+from functools import lru_cache
 import cv2
 import numpy as np
-from PIL import Image
 
 # 랜드마크: face_alignment (필수)
 import face_alignment
-HAS_MEDIAPIPE = False
-try:
-    import mediapipe as mp
-    HAS_MEDIAPIPE = True
-except Exception:
-    HAS_MEDIAPIPE = False
+from mp_service import MP_OK as HAS_MEDIAPIPE, get_mp_service
+from eot_engine import EOTPool, DCT_EOT
+from spsa_engine import SPSAOptimizer
 
 
 # -----------------------------
@@ -76,17 +73,10 @@ class FAWrapper:
 
 class MPWrapper:
     def __init__(self):
-        self.mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True)
+        # 프로세스 공용 FaceMesh 서비스 재사용 (스레드별 그래프 1개)
+        self.svc = get_mp_service(max_num_faces=1, refine_landmarks=False)
     def get_landmarks(self, rgb_uint8):
-        h,w = rgb_uint8.shape[:2]
-        res = self.mesh.process(rgb_uint8)
-        if not res.multi_face_landmarks:
-            return None
-        out=[]
-        for lm in res.multi_face_landmarks:
-            pts=[(p.x*w, p.y*h) for p in lm.landmark]
-            out.append(np.array(pts))
-        return out
+        return self.svc.face_landmarks_all(rgb_uint8, rgb=True)
 
 
 # -----------------------------
@@ -98,20 +88,39 @@ def block_dct_2d(block):
 def block_idct_2d(block_dct):
     return cv2.idct(block_dct.astype(np.float32))
 
+@lru_cache(maxsize=None)
+def dct_basis(lf=3, block=8):
+    """
+    저주파 lf×lf 계수용 IDCT 기저 (lf, lf, block, block), 1회 계산 후 캐시.
+    cv2.idct(8x8, 좌상단 lf×lf만 채움) == einsum('uv,uvij->ij', coeffs, basis)
+    """
+    n = np.arange(block)
+    k = np.arange(lf)[:, None]
+    C = np.cos(np.pi * (2 * n[None, :] + 1) * k / (2.0 * block))  # (lf, block) orthonormal DCT-II 행
+    C *= np.sqrt(2.0 / block)
+    C[0] *= np.sqrt(0.5)
+    basis = np.einsum('ui,vj->uvij', C, C).astype(np.float32)
+    basis.setflags(write=False)
+    return basis
+
 def reconstruct_deltaY_from_coeffs(coeffs, H, W, lf=3, block=8):
     """
-    coeffs: (H//block, W//block, lf, lf)  각 8x8 블록의 좌상단 lf×lf 계수
-    반환: deltaY (H,W) float32
+    coeffs: (..., H//block, W//block, lf, lf)  각 8x8 블록의 좌상단 lf×lf 계수
+            (앞쪽 배치 차원 허용: 예) SPSA 샘플 전체 (S, bh, bw, lf, lf))
+    반환: deltaY (..., H, W) float32
+    블록별 cv2.idct 루프 대신 기저 einsum + reshape 한 번으로 계산
     """
-    out = np.zeros((H, W), dtype=np.float32)
-    bh, bw = coeffs.shape[:2]
-    for bi in range(bh):
-        for bj in range(bw):
-            d = np.zeros((block, block), dtype=np.float32)
-            d[:lf, :lf] = coeffs[bi, bj, :lf, :lf]
-            idct = block_idct_2d(d)
-            i0, j0 = bi * block, bj * block
-            out[i0:i0+block, j0:j0+block] = idct[:min(block, H-i0), :min(block, W-j0)]
+    basis = dct_basis(lf, block)
+    coeffs = np.asarray(coeffs, dtype=np.float32)[..., :lf, :lf]
+    lead = coeffs.shape[:-4]
+    bh, bw = coeffs.shape[-4:-2]
+    blocks = np.einsum('...abuv,uvij->...aibj', coeffs, basis, optimize=True)
+    blocks = blocks.reshape(lead + (bh * block, bw * block))
+    if blocks.shape[-2:] == (H, W):
+        return np.ascontiguousarray(blocks)
+    out = np.zeros(lead + (H, W), dtype=np.float32)
+    hh, ww = min(H, bh * block), min(W, bw * block)
+    out[..., :hh, :ww] = blocks[..., :hh, :ww]
     return out
 
 def coeffs_like(H, W, lf=3, block=8):
@@ -121,28 +130,21 @@ def coeffs_like(H, W, lf=3, block=8):
 # -----------------------------
 # EOT 변환 (리사이즈/블러/JPEG)
 # -----------------------------
+_EOT_POOL = None
+
+def get_eot_pool(p_jpeg=0.9):
+    global _EOT_POOL
+    if _EOT_POOL is None or _EOT_POOL.p_jpeg != p_jpeg:
+        _EOT_POOL = EOTPool(M=2, **dict(DCT_EOT, p_jpeg=p_jpeg))
+    return _EOT_POOL
+
 def apply_eot_rgb01(img01, p_jpeg=0.9):
-    H, W = img01.shape[:2]
-    out = img01.copy()
-    # scale
-    s = np.random.uniform(0.92, 1.06)
-    if abs(s - 1.0) > 1e-6:
-        out = cv2.resize(out, (max(1, int(W*s)), max(1, int(H*s))), interpolation=cv2.INTER_LINEAR)
-        out = cv2.resize(out, (W, H), interpolation=cv2.INTER_LINEAR)
-    # blur
-    if np.random.rand() < 0.5:
-        k = np.random.choice([1,3,5])
-        if k > 1:
-            out = cv2.GaussianBlur(out, (k, k), 0)
-    # jpeg
-    if np.random.rand() < p_jpeg:
-        pil = Image.fromarray((out*255).astype(np.uint8))
-        buf = io.BytesIO()
-        q = int(np.random.uniform(60, 95))
-        pil.save(buf, format='JPEG', quality=q)
-        arr = np.frombuffer(buf.getvalue(), dtype=np.uint8)
-        out = cv2.imdecode(arr, cv2.IMREAD_COLOR)[:, :, ::-1].astype(np.float32) / 255.0
-    return out
+    out = get_eot_pool(p_jpeg)(to_uint8(img01), M=1)[0]
+    return from_uint8(out)
+
+def apply_eot_batch_u8(imgs01, p_jpeg=0.9):
+    """SPSA 후보 여러 개에 EOT 1개씩 병렬 적용 → uint8 RGB 배열 (N,H,W,3)"""
+    return get_eot_pool(p_jpeg).map([to_uint8(x) for x in imgs01])
 
 
 # -----------------------------
@@ -178,35 +180,20 @@ def attack_frame_dct_spsa(frame_bgr, detectors, baselines, eps_pix, alpha_pix, s
     C = coeffs_like(H, W, lf=lf, block=block)
     # SPSA 하이퍼
     delta_c = max(1.0, alpha_pix)  # 픽셀 스텝 기준을 DCT 계수로 환산하기 어렵지만, 상대 크기만 맞춰 사용
-    # 반복
-    for t in range(steps):
-        g = np.zeros_like(C, dtype=np.float32)
-        for _ in range(spsa):
-            U = np.random.choice([-1.0, 1.0], size=C.shape).astype(np.float32)
-
-            # +delta
-            C_p = C + delta_c * U
-            dY_p = reconstruct_deltaY_from_coeffs(C_p, H, W, lf=lf, block=block)
-            adv_p_rgb01 = apply_deltaY_and_project(orig_rgb01, dY_p, eps_pix)
-            if eot:
-                eval_p = apply_eot_rgb01(adv_p_rgb01)
-            else:
-                eval_p = adv_p_rgb01
-            Lp = ensemble_cosine(to_uint8(eval_p), baselines, detectors, sigma_pix)
-
-            # -delta
-            C_m = C - delta_c * U
-            dY_m = reconstruct_deltaY_from_coeffs(C_m, H, W, lf=lf, block=block)
-            adv_m_rgb01 = apply_deltaY_and_project(orig_rgb01, dY_m, eps_pix)
-            if eot:
-                eval_m = apply_eot_rgb01(adv_m_rgb01)
-            else:
-                eval_m = adv_m_rgb01
-            Lm = ensemble_cosine(to_uint8(eval_m), baselines, detectors, sigma_pix)
 
-            g += ((Lp - Lm) / (2.0 * delta_c)) * U
+    # 배치 oracle: 계수 후보 (N,bh,bw,lf,lf) → 한 번에 IDCT → 투영 → EOT(병렬) → 앙상블 코사인
+    def oracle(Cs):
+        dYs = reconstruct_deltaY_from_coeffs(Cs, H, W, lf=lf, block=block)
+        advs = [apply_deltaY_and_project(orig_rgb01, dY, eps_pix) for dY in dYs]
+        evals = apply_eot_batch_u8(advs) if eot else [to_uint8(a) for a in advs]
+        return [ensemble_cosine(e, baselines, detectors, sigma_pix) for e in evals]
 
-        g /= float(max(1, spsa))
+    opt = SPSAOptimizer(K=spsa, c=delta_c, dist="rademacher", chunk=8, name="DCT-EOT")
+    # 반복
+    for t in range(steps):
+        g = opt.estimate(C, oracle)
+        if g is None:
+            break
         # 목적: 유사도 ↓ → C ← C - α * sign(grad)
         C = C - alpha_pix * np.sign(g)
 
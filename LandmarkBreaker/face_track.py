@@ -0,0 +1,207 @@
+"""
+face_track.py
+작업(영상) 단위 얼굴 트랙 아티팩트 — 모든 방어 스테이지가 공유.
+
+- 프레임별 얼굴 박스 (x1,y1,x2,y2) / 68점 랜드마크 / 검출 신뢰도를 영상당 1회만 계산
+- <track_dir>/<영상 sha1>.facetrack.npz 로 저장 → 경로가 달라도 같은 영상이면 재사용
+- 검출은 face_alignment 로 프레임당 1번 (박스 + 68점 + 신뢰도 동시), 가장 큰 얼굴 1개
+- 얼굴 없는 프레임: valid=False, 박스/랜드마크는 NaN
+
+사용:
+    from face_track import get_face_track, resolve_face_track
+    track = get_face_track("in.mp4")        # 없으면 생성·저장, 있으면 로드
+    track.landmarks(i)                       # (68,2) float32 or None
+    track.landmarks_list(i)                  # fa.get_landmarks() 형식: [lm] 또는 []
+    track.box(i)                             # (x1,y1,x2,y2) float32 or None
+    track = resolve_face_track(args.face_track, args.input)   # CLI: 경로 / "auto" / None
+
+단독 실행:
+    python face_track.py in.mp4 --device cuda
+"""
+import os
+import json
+import hashlib
+import argparse
+import threading
+import numpy as np
+import cv2
+
+TRACK_DIR = os.environ.get("FACE_TRACK_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "face_tracks")
+N_LMK = 68
+
+_TRACKS = {}
+_TRACKS_LOCK = threading.Lock()
+
+
+def video_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for blk in iter(lambda: f.read(1 << 20), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+
+def track_path(vhash, track_dir=None):
+    return os.path.join(track_dir or TRACK_DIR, f"{vhash}.facetrack.npz")
+
+
+class FaceTrack:
+    def __init__(self, boxes, lmks, confs, meta=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32)   # (T,4)
+        self.lmks = np.asarray(lmks, dtype=np.float32)     # (T,68,2)
+        self.confs = np.asarray(confs, dtype=np.float32)   # (T,)
+        self.valid = ~np.isnan(self.boxes[:, 0])
+        self.meta = dict(meta or {})
+
+    def __len__(self):
+        return len(self.boxes)
+
+    # ---------- 프레임 조회 ----------
+    def has_face(self, i):
+        return i is not None and 0 <= i < len(self) and bool(self.valid[i])
+
+    def box(self, i):
+        return self.boxes[i] if self.has_face(i) else None
+
+    def landmarks(self, i):
+        return self.lmks[i] if self.has_face(i) else None
+
+    def landmarks_list(self, i):
+        """face_alignment get_landmarks() 와 같은 형식 (얼굴 없으면 빈 리스트)"""
+        return [self.lmks[i]] if self.has_face(i) else []
+
+    def confidence(self, i):
+        return float(self.confs[i]) if self.has_face(i) else 0.0
+
+    def xywh(self, i):
+        b = self.box(i)
+        if b is None:
+            return None
+        x1, y1, x2, y2 = (int(round(v)) for v in b)
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    def to_face_boxes(self):
+        """load_face_boxes(csv) 와 같은 {frame: (x,y,w,h) or None}"""
+        return {i: self.xywh(i) for i in range(len(self))}
+
+    # ---------- 저장 / 로드 ----------
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez_compressed(tmp, boxes=self.boxes, lmks=self.lmks, confs=self.confs,
+                            meta=np.array(json.dumps(self.meta)))
+        os.replace(tmp, path)  # 원자적 교체 (동시 워커 안전)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"])) if "meta" in z else {}
+            return cls(z["boxes"], z["lmks"], z["confs"], meta)
+
+
+# ---------------- 생성 ----------------
+def _largest(lms, boxes):
+    areas = [(b[2] - b[0]) * (b[3] - b[1]) for b in boxes]
+    j = int(np.argmax(areas))
+    return lms[j], boxes[j]
+
+
+def detect_frame(fa, rgb):
+    """face_alignment 1회 호출 → (box(5,) [x1,y1,x2,y2,conf], lm(68,2)) 또는 None"""
+    try:
+        lms, _, boxes = fa.get_landmarks_from_image(rgb, return_bboxes=True)
+    except TypeError:
+        # 구버전 face_alignment: 박스 미반환 → 랜드마크 범위로 대체
+        lms = fa.get_landmarks_from_image(rgb)
+        boxes = None if lms is None else [np.r_[lm.min(axis=0), lm.max(axis=0), 1.0] for lm in lms]
+    if lms is None or len(lms) == 0:
+        return None
+    lm, b = _largest(lms, boxes)
+    b = np.asarray(b, dtype=np.float32)
+    conf = float(b[4]) if len(b) > 4 else 1.0
+    return np.r_[b[:4], conf].astype(np.float32), np.asarray(lm, dtype=np.float32)[:N_LMK, :2]
+
+
+def make_fa(device=None, face_detector="sfd"):
+    import face_alignment
+    import torch
+    LT = face_alignment.LandmarksType
+    lmk2d = next((getattr(LT, n) for n in ("TWO_D", "_2D") if hasattr(LT, n)), 1)
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    return face_alignment.FaceAlignment(lmk2d, device=device, face_detector=face_detector, flip_input=False)
+
+
+def build_face_track(video_path, fa=None, device=None, face_detector="sfd", max_frames=None, log_every=100):
+    """영상 전체를 한 번 디코드하며 프레임당 1회 검출"""
+    fa = fa or make_fa(device, face_detector)
+    cap = cv2.VideoCapture(str(video_path))
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open: {video_path}")
+    W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    boxes, lmks, confs = [], [], []
+    nan_box = np.full(4, np.nan, np.float32); nan_lm = np.full((N_LMK, 2), np.nan, np.float32)
+    while max_frames is None or len(boxes) < max_frames:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        det = detect_frame(fa, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if det is None:
+            boxes.append(nan_box); lmks.append(nan_lm); confs.append(0.0)
+        else:
+            boxes.append(det[0][:4]); lmks.append(det[1]); confs.append(det[0][4])
+        if log_every and len(boxes) % log_every == 0:
+            print(f"[face-track] {len(boxes)} frames")
+    cap.release()
+    T = len(boxes)
+    meta = {"video": os.path.basename(str(video_path)), "width": W, "height": H,
+            "frames": T, "detector": f"face_alignment/{face_detector}"}
+    if T == 0:
+        return FaceTrack(np.zeros((0, 4)), np.zeros((0, N_LMK, 2)), np.zeros(0), meta)
+    return FaceTrack(np.stack(boxes), np.stack(lmks), np.asarray(confs), meta)
+
+
+def get_face_track(video_path, track_dir=None, build=True, **build_kw):
+    """영상 해시로 트랙 조회: 메모리 → 디스크 → (build=True면) 생성 후 저장"""
+    vh = video_hash(video_path)
+    with _TRACKS_LOCK:
+        if vh in _TRACKS:
+            return _TRACKS[vh]
+    path = track_path(vh, track_dir)
+    if os.path.exists(path):
+        track = FaceTrack.load(path)
+    elif build:
+        print(f"[face-track] building track for {video_path} → {path}")
+        track = build_face_track(video_path, **build_kw)
+        track.meta["sha1"] = vh
+        track.save(path)
+    else:
+        return None
+    with _TRACKS_LOCK:
+        _TRACKS[vh] = track
+    return track
+
+
+def resolve_face_track(spec, video_path=None, track_dir=None, **build_kw):
+    """CLI 옵션 해석: None/"" → None, "auto" → 영상 해시로 로드/생성, 그 외 → npz 경로"""
+    if not spec:
+        return None
+    if spec == "auto":
+        if video_path is None:
+            raise ValueError("--face_track auto requires an input video")
+        return get_face_track(video_path, track_dir=track_dir, **build_kw)
+    track = FaceTrack.load(spec)
+    print(f"[face-track] loaded {spec} ({int(track.valid.sum())}/{len(track)} frames with face)")
+    return track
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("video")
+    ap.add_argument("--track_dir", default=None, help=f"기본 {TRACK_DIR} (env FACE_TRACK_DIR)")
+    ap.add_argument("--device", default=None)
+    ap.add_argument("--face_detector", default="sfd", choices=["sfd", "blazeface"])
+    args = ap.parse_args()
+    tr = get_face_track(args.video, track_dir=args.track_dir, device=args.device, face_detector=args.face_detector)
+    print(f"[face-track] {len(tr)} frames, {int(tr.valid.sum())} with face → "
+          f"{track_path(video_hash(args.video), args.track_dir)}")
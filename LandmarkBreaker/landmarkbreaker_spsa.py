@@ -2,11 +2,9 @@
 import os, cv2, numpy as np, argparse
 from tqdm import tqdm
 
-try:
-    import mediapipe as mp
-    MP_OK = True
-except Exception:
-    MP_OK = False
+from mp_service import MP_OK, get_mp_service
+from eot_engine import jpeg_sim
+from spsa_engine import SPSAOptimizer
 
 def temporal_smooth(prev_W, W, alpha=0.7):
     if prev_W is None:
@@ -28,52 +26,44 @@ def face_edge_mask(h, w, cx, cy, r_inner=0.45, r_outer=0.85):
     mask = mask[:,:,None]
     return mask
 
-def jpeg_sim(img, q=85):
-    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(q)]
-    _, enc = cv2.imencode(".jpg", img, encode_param)
-    dec = cv2.imdecode(enc, cv2.IMREAD_COLOR)
-    return dec
-
 def detect_landmarks(img_bgr):
     if not MP_OK:
         return None, None
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    mp_face_mesh = mp.solutions.face_mesh
-    with mp_face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True) as fm:
-        res = fm.process(img_rgb)
-    if not res.multi_face_landmarks:
+    coords = get_mp_service(max_num_faces=1, refine_landmarks=True).face_landmarks(img_bgr)
+    if coords is None:
         return None, None
-    pts = res.multi_face_landmarks[0].landmark
-    h, w = img_bgr.shape[:2]
-    coords = np.array([[p.x*w, p.y*h] for p in pts], dtype=np.float32)
     cx, cy = coords[:,0].mean(), coords[:,1].mean()
     return coords, (cx, cy)
 
-def landmark_instability_loss(img_clean, img_pert):
-    lm0, _ = detect_landmarks(img_clean)
+def landmark_instability_loss(img_clean, img_pert, lm0=None):
+    # lm0: 원본 프레임 랜드마크 (프레임당 1회 검출한 값 재사용)
+    if lm0 is None:
+        lm0, _ = detect_landmarks(img_clean)
     lm1, _ = detect_landmarks(img_pert)
     if lm0 is None or lm1 is None:
         return 0.0, 0.0
     d = np.linalg.norm(lm0 - lm1, axis=1).mean()
     return -d, d
 
-def spsa_step(base, work, loss_fn, step_size=1.0, mask=None, eps=6):
-    h, w, c = base.shape
-    delta = np.random.choice([-1.0, 1.0], size=(h, w, c)).astype(np.float32)
-    if mask is not None:
-        delta *= mask
+def spsa_step(base, work, loss_fn, step_size=1.0, mask=None, eps=6, optimizer=None):
     c_k = 1.0
-    x_plus  = np.clip(work.astype(np.float32) + c_k*delta, 0, 255).astype(np.uint8)
-    x_minus = np.clip(work.astype(np.float32) - c_k*delta, 0, 255).astype(np.uint8)
-    Lp, _ = loss_fn(base, x_plus)
-    Lm, _ = loss_fn(base, x_minus)
-    g_hat = (Lp - Lm) / (2.0 * c_k + 1e-8) * delta
-    g = g_hat / (np.mean(np.abs(g_hat)) + 1e-8)
+    Ls = []
+    def oracle(X):
+        out = []
+        for x in X:
+            L, _ = loss_fn(base, np.clip(x, 0, 255).astype(np.uint8))
+            out.append(L)
+        Ls.extend(out)
+        return out
+    opt = optimizer or SPSAOptimizer(K=1, c=c_k, normalize="mean_abs")
+    g = opt.estimate(work.astype(np.float32), oracle, mask=mask)
+    if g is None:
+        return work, 0.0, 0.0
     x_new = work.astype(np.float32) - step_size * g
     diff = x_new.astype(np.int32) - base.astype(np.int32)
     diff = np.clip(diff, -eps, eps).astype(np.int16)
     x_new = np.clip(base.astype(np.int32) + diff, 0, 255).astype(np.uint8)
-    return x_new, float(Lp), float(Lm)
+    return x_new, float(Ls[0]), float(Ls[-1])
 
 def main():
     ap = argparse.ArgumentParser()
@@ -96,6 +86,7 @@ def main():
 
     outv = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (W,H))
     tmp_prev_W = None
+    opt = SPSAOptimizer(K=1, c=1.0, normalize="mean_abs", log_every=200, name="LandmarkBreaker++")
 
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.get(cv2.CAP_PROP_FRAME_COUNT)>0 else None
     pbar = tqdm(total=total_frames, desc="LandmarkBreaker++")
@@ -115,14 +106,14 @@ def main():
 
         def loss_on_img(clean, pert):
             sim = jpeg_sim(pert, q=args.jpegq)
-            L, raw = landmark_instability_loss(clean, sim)
+            L, raw = landmark_instability_loss(clean, sim, lm0=lm)
             tv = tv_norm((sim.astype(np.float32)-clean.astype(np.float32))/255.0)
             return L + 0.05*tv, raw
 
         work = base.copy()
         for _ in range(args.iters-per-frame if False else args.iters_per_frame):
             for _s in range(args.steps):
-                work, Lp, Lm = spsa_step(base, work, loss_on_img, step_size=1.0, mask=mask, eps=args.eps)
+                work, Lp, Lm = spsa_step(base, work, loss_on_img, step_size=1.0, mask=mask, eps=args.eps, optimizer=opt)
             if tmp_prev_W is not None:
                 curr_W = (work.astype(np.float32) - base.astype(np.float32))
                 sm_W = temporal_smooth(tmp_prev_W, curr_W, alpha=args.alpha_temporal)
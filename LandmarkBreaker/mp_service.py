@@ -0,0 +1,128 @@
+"""
+mp_service.py
+MediaPipe 얼굴 검출기 / FaceMesh 를 한 번만 만들어 재사용하는 공용 서비스.
+
+- 기존 스크립트는 objective 호출마다 `with FaceDetection(...)` / `with FaceMesh(...)` 로
+  그래프를 새로 만들었음 → 영상 1개에 수천 번 재생성
+- 여기서는 스레드(워커)마다 인스턴스를 1개씩 lazy 생성해서 계속 재사용
+  (MediaPipe 그래프는 스레드 간 공유 불가 → threading.local 로 분리)
+
+사용:
+    from mp_service import MP_OK, get_mp_service
+    svc = get_mp_service()
+    dets = svc.detect_faces(img_bgr)            # [(x1,y1,x2,y2,conf), ...]
+    lm   = svc.face_landmarks(img_bgr)          # (468|478, 2) float32 or None
+    lms  = svc.face_landmarks_batch([a, b, c])  # 배치 API
+"""
+import threading
+import cv2
+import numpy as np
+
+try:
+    import mediapipe as mp
+    MP_OK = True
+except Exception:
+    MP_OK = False
+
+
+class MediaPipeService:
+    def __init__(self, det_model_selection=1, min_detection_confidence=0.3,
+                 max_num_faces=1, refine_landmarks=True):
+        self.det_model_selection = det_model_selection
+        self.min_detection_confidence = min_detection_confidence
+        self.max_num_faces = max_num_faces
+        self.refine_landmarks = refine_landmarks
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._instances = []  # close() 용 (모든 스레드의 그래프)
+
+    # ---------- 스레드별 그래프 ----------
+    def _register(self, obj):
+        with self._lock:
+            self._instances.append(obj)
+        return obj
+
+    def _detector(self):
+        fd = getattr(self._local, "fd", None)
+        if fd is None:
+            fd = self._register(mp.solutions.face_detection.FaceDetection(
+                model_selection=self.det_model_selection,
+                min_detection_confidence=self.min_detection_confidence))
+            self._local.fd = fd
+        return fd
+
+    def _mesh(self):
+        fm = getattr(self._local, "fm", None)
+        if fm is None:
+            fm = self._register(mp.solutions.face_mesh.FaceMesh(
+                static_image_mode=True,
+                max_num_faces=self.max_num_faces,
+                refine_landmarks=self.refine_landmarks))
+            self._local.fm = fm
+        return fm
+
+    # ---------- 얼굴 검출 ----------
+    def detect_faces(self, img_bgr, rgb=False):
+        """반환: [(x1,y1,x2,y2,conf), ...] (픽셀 좌표)"""
+        if not MP_OK: return []
+        img_rgb = img_bgr if rgb else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        res = self._detector().process(img_rgb)
+        if not res.detections: return []
+        h, w = img_rgb.shape[:2]
+        outs = []
+        for det in res.detections:
+            loc = det.location_data.relative_bounding_box
+            x1 = int(loc.xmin * w); y1 = int(loc.ymin * h)
+            x2 = int((loc.xmin + loc.width) * w); y2 = int((loc.ymin + loc.height) * h)
+            outs.append((x1, y1, x2, y2, float(det.score[0])))
+        return outs
+
+    def detect_faces_batch(self, imgs_bgr, rgb=False):
+        return [self.detect_faces(im, rgb=rgb) for im in imgs_bgr]
+
+    # ---------- FaceMesh 랜드마크 ----------
+    def face_landmarks_all(self, img_bgr, rgb=False):
+        """반환: 얼굴별 (N,2) float32 좌표 리스트 (없으면 None)"""
+        if not MP_OK: return None
+        img_rgb = img_bgr if rgb else cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        res = self._mesh().process(img_rgb)
+        if not res.multi_face_landmarks:
+            return None
+        h, w = img_rgb.shape[:2]
+        outs = []
+        for face in res.multi_face_landmarks:
+            coords = np.array([[p.x * w, p.y * h] for p in face.landmark], dtype=np.float32)
+            outs.append(coords)
+        return outs
+
+    def face_landmarks(self, img_bgr, rgb=False):
+        """첫 얼굴의 (N,2) float32 좌표 또는 None"""
+        lms = self.face_landmarks_all(img_bgr, rgb=rgb)
+        return None if lms is None else lms[0]
+
+    def face_landmarks_batch(self, imgs_bgr, rgb=False):
+        return [self.face_landmarks(im, rgb=rgb) for im in imgs_bgr]
+
+    def close(self):
+        with self._lock:
+            for obj in self._instances:
+                try:
+                    obj.close()
+                except Exception:
+                    pass
+            self._instances = []
+        self._local = threading.local()
+
+
+# 프로세스 공용 인스턴스 (설정별 1개)
+_SERVICES = {}
+_SERVICES_LOCK = threading.Lock()
+
+def get_mp_service(**kwargs):
+    key = tuple(sorted(kwargs.items()))
+    with _SERVICES_LOCK:
+        svc = _SERVICES.get(key)
+        if svc is None:
+            svc = MediaPipeService(**kwargs)
+            _SERVICES[key] = svc
+    return svc
@@ -2,6 +2,8 @@ import os, cv2, argparse, numpy as np
 import face_alignment
 import torch
 
+from face_track import resolve_face_track
+
 def to_uint8(x): return np.clip(x*255.0,0,255).astype(np.uint8)
 def from_uint8(x): return x.astype(np.float32)/255.0
 
@@ -27,37 +29,89 @@ FACE_HULL = JAW + BROW_L + BROW_R + [JAW[0]]
 def poly_from_indices(pts, idxs):
     return np.array([pts[i] for i in idxs], dtype=np.int32)
 
+REGION_IDX = sorted(set(EYE_L+EYE_R+BROW_L+BROW_R+NOSE))  # soft 노이즈 관심영역
+MASK_SIGMA = 2
+MASK_PAD = 8  # GaussianBlur(σ=2) 반경 6px + 여유 → ROI 밖 마스크는 항상 0
+
 def make_checker(H,W,cell=6,phase=0):
     yy,xx = np.mgrid[0:H,0:W]
     pat = (( (xx+phase)//cell + (yy+phase)//cell ) % 2).astype(np.float32)
     pat = (pat*2-1) # -1..1
     return pat
 
-def apply_soft_noise(rgb, lms, strength=0.12, cell=6, eot_shift=(0,0)):
-    H,W = rgb.shape[:2]
+class CheckerBank:
+    """
+    해상도·cell 별 체크보드 패턴 뱅크.
+    체크보드는 위상 주기가 2*cell 이므로 (H+2c, W+2c) int8 한 장에 모든 위상이 들어있음:
+      make_checker(H,W,cell,p) == base[p:p+H, p:p+W]  (p mod 2c, 복사 없는 뷰)
+    """
+    def __init__(self, H, W, cell=6):
+        self.H, self.W, self.cell = H, W, cell
+        self.period = 2*cell
+        yy = np.arange(H+self.period)[:,None]; xx = np.arange(W+self.period)[None,:]
+        self.base = (((xx//cell + yy//cell) % 2)*2 - 1).astype(np.int8)
+
+    def pattern(self, phase, roi=None):
+        """위상 phase 의 체크보드 (roi=(y0,y1,x0,x1) 이면 그 영역만) — int8 뷰"""
+        y0,y1,x0,x1 = roi if roi is not None else (0,self.H,0,self.W)
+        p = int(phase) % self.period
+        return self.base[y0+p:y1+p, x0+p:x1+p]
+
+    def pattern3(self, phase, roi=None, bgr=False):
+        """채널별 위상 (p, p+2, p+4) 를 RGB 순서로 쌓은 (h,w,3) float32"""
+        phases = [phase, phase+2, phase+4]
+        if bgr: phases = phases[::-1]
+        return np.stack([self.pattern(q, roi) for q in phases], axis=2).astype(np.float32)
+
+_BANKS = {}
+
+def get_checker_bank(H, W, cell=6):
+    key = (H, W, cell)
+    if key not in _BANKS:
+        _BANKS[key] = CheckerBank(H, W, cell)
+    return _BANKS[key]
+
+def face_roi_mask(lms, H, W, pad=MASK_PAD):
+    """
+    관심영역 hull 의 bbox(+pad) 안에서만 마스크 생성/블러.
+    반환: ((y0,y1,x0,x1), maskf(h,w) float32) 또는 None
+    """
     pts = lms.reshape(-1,2).astype(np.int32)
-    # 관심영역: 눈/눈썹/코 주변을 큰 폴리곤으로 묶음
-    region_idx = sorted(set(EYE_L+EYE_R+BROW_L+BROW_R+NOSE))
-    hull = cv2.convexHull(pts[region_idx]).reshape(-1,2)
+    hull = cv2.convexHull(pts[REGION_IDX]).reshape(-1,2)
+    x0,y0 = hull.min(axis=0) - pad; x1,y1 = hull.max(axis=0) + pad + 1
+    x0,y0 = max(0,int(x0)), max(0,int(y0)); x1,y1 = min(W,int(x1)), min(H,int(y1))
+    if x1<=x0 or y1<=y0: return None
+    mask = np.zeros((y1-y0, x1-x0), np.uint8)
+    cv2.fillConvexPoly(mask, (hull - [x0,y0]).astype(np.int32), 255)
+    maskf = cv2.GaussianBlur(mask,(0,0),sigmaX=MASK_SIGMA,sigmaY=MASK_SIGMA).astype(np.float32)/255.0
+    return (y0,y1,x0,x1), maskf
+
+def apply_soft_noise_batch(frames01, lms_list, strength=0.12, cell=6, shifts=None, bgr=False):
+    """
+    frames01: (N,H,W,3) float [0,1] — 제자리(in-place) 수정 후 반환
+    lms_list: 프레임별 68점 랜드마크 (None 이면 건너뜀)
+    얼굴 hull bbox ROI 에만 체크보드 × 부드러운 마스크를 더함 (풀프레임 할당 없음)
+    """
+    N,H,W = frames01.shape[:3]
+    bank = get_checker_bank(H, W, cell)
+    phases = np.random.randint(0, cell*2, size=N)
+    for i in range(N):
+        if lms_list[i] is None: continue
+        rm = face_roi_mask(lms_list[i], H, W)
+        if rm is None: continue
+        (y0,y1,x0,x1), maskf = rm
+        # 체크보드 + 위상 지터, 채널별 위상 살짝 다르게
+        phase = phases[i] + (int(shifts[i][0]) if shifts is not None else 0)
+        noise = bank.pattern3(phase, (y0,y1,x0,x1), bgr=bgr)
+        noise *= (strength * maskf)[:,:,None] # [-s..s]
+        roi = frames01[i, y0:y1, x0:x1]
+        roi += noise
+        np.clip(roi, 0.0, 1.0, out=roi)
+    return frames01
 
-    mask = np.zeros((H,W), np.uint8)
-    cv2.fillConvexPoly(mask, hull, 255)
-
-    # 체크보드 + 위상 지터
-    phase = np.random.randint(0,cell*2) + int(eot_shift[0])
-    pat = make_checker(H,W,cell=cell,phase=phase)
-    # 채널별 위상 살짝 다르게
-    pat3 = np.stack([
-        pat,
-        make_checker(H,W,cell=cell,phase=phase+2),
-        make_checker(H,W,cell=cell,phase=phase+4)
-    ], axis=2)
-
-    # 마스크 경계 부드럽게
-    maskf = cv2.GaussianBlur(mask,(0,0),sigmaX=2,sigmaY=2).astype(np.float32)/255.0
-    noise = pat3 * (strength) # [-s..s]
-    out = np.clip(rgb + noise*maskf[:,:,None], 0.0, 1.0)
-    return out
+def apply_soft_noise(rgb, lms, strength=0.12, cell=6, eot_shift=(0,0)):
+    out = rgb.astype(np.float32, copy=True)[None]
+    return apply_soft_noise_batch(out, [lms], strength=strength, cell=cell, shifts=[eot_shift])[0]
 
 def apply_hard_blur(bgr, lms, blur_ks=31, mosaic=0):
     H,W = bgr.shape[:2]
@@ -74,7 +128,19 @@ def apply_hard_blur(bgr, lms, blur_ks=31, mosaic=0):
     inv = cv2.bitwise_and(bgr,bgr,mask=255-mask)
     return cv2.add(inv, face_blur)
 
-def process_video(in_path, out_path, args, fa):
+def read_batches(cap, n):
+    buf = []
+    while True:
+        ok, frame = cap.read()
+        if not ok: break
+        buf.append(frame)
+        if len(buf) == n:
+            yield buf
+            buf = []
+    if buf:
+        yield buf
+
+def process_video(in_path, out_path, args, fa, track=None):
     cap = cv2.VideoCapture(in_path)
     if not cap.isOpened():
         raise RuntimeError(f"Cannot open: {in_path}")
@@ -87,29 +153,35 @@ def process_video(in_path, out_path, args, fa):
         raise RuntimeError("VideoWriter open failed. Try --fourcc XVID and .avi")
 
     f=0
-    while True:
-        ok, frame = cap.read()
-        if not ok: break
-        # RGB float
-        rgb01 = from_uint8(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        lms_list = fa.get_landmarks(to_uint8(rgb01))
-        lms = largest_face(lms_list)
-        if lms is None:
-            out = frame
+    for frames in read_batches(cap, max(1, args.batch)):
+        if track is not None:
+            # 작업 단위 얼굴 트랙 재사용 (검출 생략)
+            lms = [track.landmarks(f+i) for i in range(len(frames))]
         else:
+            lms = [largest_face(fa.get_landmarks(cv2.cvtColor(fr, cv2.COLOR_BGR2RGB))) for fr in frames]
+        outs = list(frames)
+        idx = [i for i,l in enumerate(lms) if l is not None]
+        if idx:
             if args.mode=="soft":
+                # 얼굴 있는 프레임만 배치로: BGR 그대로 (채널 위상만 뒤집음)
+                batch = np.stack([frames[i] for i in idx]).astype(np.float32) / 255.0
                 # 프레임별 1~2px 이동/밝기 지터 (EOT)
-                shift = (np.random.randint(-2,3), np.random.randint(-2,3))
-                rgb01 = np.clip(rgb01*(1.0 + np.random.randn()*0.01), 0.0, 1.0)
-                adv01 = apply_soft_noise(rgb01, lms, strength=args.strength, cell=args.cell, eot_shift=shift)
-                out = cv2.cvtColor(to_uint8(adv01), cv2.COLOR_RGB2BGR)
+                shifts = np.random.randint(-2,3,size=(len(idx),2))
+                batch *= (1.0 + np.random.randn(len(idx))*0.01).astype(np.float32)[:,None,None,None]
+                np.clip(batch, 0.0, 1.0, out=batch)
+                apply_soft_noise_batch(batch, [lms[i] for i in idx], strength=args.strength,
+                                       cell=args.cell, shifts=shifts, bgr=True)
+                adv = to_uint8(batch)
+                for j,i in enumerate(idx): outs[i] = adv[j]
             else:
-                out = apply_hard_blur(frame, lms, blur_ks=args.blur, mosaic=args.mosaic)
-
-        wr.write(out)
-        if args.log_every>0 and (f%args.log_every==0):
-            print(f"[ROOP-BLOCK] frame {f}")
-        f+=1
+                for i in idx:
+                    outs[i] = apply_hard_blur(frames[i], lms[i], blur_ks=args.blur, mosaic=args.mosaic)
+
+        for out in outs:
+            wr.write(out)
+            if args.log_every>0 and (f%args.log_every==0):
+                print(f"[ROOP-BLOCK] frame {f}")
+            f+=1
     cap.release(); wr.release()
     print(f"[OK] saved: {out_path}")
 
@@ -155,18 +227,21 @@ def main():
     ap.add_argument("--device", default="cuda")
     ap.add_argument("--fourcc", default="mp4v")
     ap.add_argument("--log_every", type=int, default=30)
+    ap.add_argument("--batch", type=int, default=16, help="영상 모드 배치 프레임 수")
     ap.add_argument("--type", choices=["image","video"], default="video")
+    ap.add_argument("--face_track", default=None, help="face_track.py 트랙 npz 경로 또는 auto (영상 해시로 로드/생성)")
     args = ap.parse_args()
 
     if args.device=="cuda" and not torch.cuda.is_available():
         raise RuntimeError("CUDA 강제 지정했지만 사용 불가. PyTorch CUDA/드라이버 확인 필요.")
     lmk2d = resolve_landmarks_type_2d()
-    fa = face_alignment.FaceAlignment(lmk2d, device=args.device, face_detector="sfd")
+    track = resolve_face_track(args.face_track, args.input, device=args.device) if args.type=="video" else None
+    fa = face_alignment.FaceAlignment(lmk2d, device=args.device, face_detector="sfd") if track is None else None
 
     if args.type=="image":
         process_image(args.input, args.output, args, fa)
     else:
-        process_video(args.input, args.output, args, fa)
+        process_video(args.input, args.output, args, fa, track=track)
 
 if __name__=="__main__":
     main()
@@ -0,0 +1,149 @@
+"""
+spsa_engine.py
+defend/ 와 LandmarkBreaker/ 의 블랙박스 공격이 공유하는 SPSA / NES 그래디언트 추정기.
+
+- K개의 탐색 방향(Rademacher ±1 또는 Gaussian)을 한 번에 (K,*shape) 배열로 생성
+- ± 쿼리를 묶어서 배치 oracle 콜백 한 번으로 평가 (oracle(X) -> (N,) 손실)
+- antithetic(±) / one-sided(+ vs 기준점) 추정, 정규화, momentum, 쿼리 예산, queries/sec 로그
+- numpy 배열과 torch 텐서 모두 지원 (x 타입을 따라감)
+
+사용:
+    from spsa_engine import SPSAOptimizer
+    opt = SPSAOptimizer(K=8, c=1/255, dist="rademacher")
+    g = opt.estimate(x, oracle)          # 손실 기울기 추정 (x와 같은 shape)
+    x = x - alpha * np.sign(g)
+
+각 스크립트는 oracle(손실 정의)만 작성하면 됨.
+"""
+import time
+import numpy as np
+
+
+def _is_torch(x):
+    return hasattr(x, "detach") and hasattr(x, "device")
+
+
+class SPSAOptimizer:
+    def __init__(self, K=8, c=1.0, dist="rademacher", antithetic=True, momentum=0.0,
+                 normalize=None, query_budget=None, chunk=None, seed=None,
+                 log_every=0, name="SPSA"):
+        """
+        K: 스텝당 탐색 방향 수 (antithetic이면 2K 쿼리, 아니면 K+1)
+        c: 유한차분 크기 (estimate(c=...)로 스텝마다 바꿀 수 있음)
+        dist: "rademacher" | "gaussian"
+        normalize: None | "mean_abs" | "l2"  (momentum 누적 전에 적용)
+        query_budget: 총 oracle 쿼리 상한 (초과하면 estimate가 None 반환)
+        chunk: 한 번에 oracle에 넘길 방향 수 (메모리 제한용, None이면 K 전체)
+        """
+        self.K = int(K)
+        self.c = c
+        self.dist = dist
+        self.antithetic = antithetic
+        self.momentum = momentum
+        self.normalize = normalize
+        self.query_budget = query_budget
+        self.chunk = chunk
+        self.rng = np.random.default_rng(seed)
+        self.log_every = log_every
+        self.name = name
+        self.m = None
+        self.n_queries = 0
+        self.n_steps = 0
+        self.t_oracle = 0.0
+        self.t_start = time.time()
+
+    # ---------- 상태 ----------
+    def reset(self):
+        self.m = None
+
+    @property
+    def exhausted(self):
+        return self.query_budget is not None and self.n_queries >= self.query_budget
+
+    def stats(self):
+        el = max(time.time() - self.t_start, 1e-9)
+        return {"queries": self.n_queries, "steps": self.n_steps,
+                "qps": self.n_queries / el, "oracle_qps": self.n_queries / max(self.t_oracle, 1e-9)}
+
+    # ---------- 방향 생성 ----------
+    def directions(self, shape, k, like=None, mask=None):
+        """(k,*shape) 방향 텐서 한 번에 생성"""
+        if like is not None and _is_torch(like):
+            import torch
+            if self.dist == "gaussian":
+                U = torch.randn((k,) + tuple(shape), device=like.device, dtype=like.dtype)
+            else:
+                U = torch.randint(0, 2, (k,) + tuple(shape), device=like.device).to(like.dtype) * 2 - 1
+        else:
+            if self.dist == "gaussian":
+                U = self.rng.standard_normal((k,) + tuple(shape), dtype=np.float32)
+            else:
+                U = (self.rng.integers(0, 2, size=(k,) + tuple(shape), dtype=np.int8) * 2 - 1).astype(np.float32)
+        if mask is not None:
+            U = U * mask
+        return U
+
+    def _query(self, oracle, X):
+        t0 = time.time()
+        L = oracle(X)
+        self.t_oracle += time.time() - t0
+        self.n_queries += len(X)
+        return L
+
+    # ---------- 추정 ----------
+    def estimate(self, x, oracle, c=None, mask=None, K=None):
+        """
+        x: 현재 점 (numpy / torch)
+        oracle: X(N,*shape) -> 손실 (N,)  (낮을수록 좋음)
+        반환: 정규화·momentum 적용된 그래디언트 추정 (x와 같은 shape), 예산 초과 시 None
+        """
+        if self.exhausted:
+            return None
+        c = self.c if c is None else c
+        K = self.K if K is None else int(K)
+        torch_mode = _is_torch(x)
+        if torch_mode:
+            import torch
+        shape = tuple(x.shape)
+        g = None
+        L0 = None
+        if not self.antithetic:
+            L0 = float(self._query(oracle, x[None])[0])
+        done = 0
+        step = self.chunk or K
+        while done < K:
+            k = min(step, K - done)
+            U = self.directions(shape, k, like=x, mask=mask)
+            if self.antithetic:
+                X = (torch.cat([x[None] + c * U, x[None] - c * U]) if torch_mode
+                     else np.concatenate([x[None] + c * U, x[None] - c * U]))
+                L = np.asarray(self._query(oracle, X), dtype=np.float32)
+                coef = (L[:k] - L[k:]) / (2.0 * c)
+            else:
+                X = x[None] + c * U
+                L = np.asarray(self._query(oracle, X), dtype=np.float32)
+                coef = (L - L0) / c
+            if torch_mode:
+                coef_t = torch.as_tensor(coef, device=x.device, dtype=x.dtype)
+                part = (coef_t.view((-1,) + (1,) * len(shape)) * U).sum(dim=0)
+            else:
+                part = np.tensordot(coef, U, axes=(0, 0))
+            g = part if g is None else g + part
+            done += k
+        g = g / float(max(1, K))
+        g = self._normalize(g, torch_mode)
+        if self.momentum:
+            self.m = g if self.m is None else self.momentum * self.m + g
+            g = self.m
+        self.n_steps += 1
+        if self.log_every and self.n_steps % self.log_every == 0:
+            st = self.stats()
+            print(f"[{self.name}] step {st['steps']} | queries {st['queries']} | {st['qps']:.1f} q/s (oracle {st['oracle_qps']:.1f} q/s)")
+        return g
+
+    def _normalize(self, g, torch_mode):
+        if self.normalize == "mean_abs":
+            return g / ((g.abs().mean() if torch_mode else np.mean(np.abs(g))) + 1e-12)
+        if self.normalize == "l2":
+            return g / ((g.norm() if torch_mode else np.linalg.norm(g)) + 1e-12)
+        return g
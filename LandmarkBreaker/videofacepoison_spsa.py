@@ -2,28 +2,13 @@
 import os, cv2, numpy as np, argparse
 from tqdm import tqdm
 
-try:
-    import mediapipe as mp
-    MP_OK = True
-except Exception:
-    MP_OK = False
+from mp_service import MP_OK, get_mp_service
+from spsa_engine import SPSAOptimizer
+from face_track import resolve_face_track
 
 def detect_faces_conf(img_bgr):
     if not MP_OK: return []
-    mp_face = mp.solutions.face_detection
-    with mp_face.FaceDetection(model_selection=1, min_detection_confidence=0.3) as fd:
-        img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-        res = fd.process(img_rgb)
-        if not res.detections: return []
-        h, w = img_bgr.shape[:2]
-        outs = []
-        for det in res.detections:
-            loc = det.location_data.relative_bounding_box
-            x1 = int(loc.xmin * w); y1 = int(loc.ymin * h)
-            x2 = int((loc.xmin + loc.width) * w); y2 = int((loc.ymin + loc.height) * h)
-            conf = float(det.score[0])
-            outs.append((x1,y1,x2,y2,conf))
-        return outs
+    return get_mp_service(det_model_selection=1, min_detection_confidence=0.3).detect_faces(img_bgr)
 
 def objective(img_clean, img_work):
     det = detect_faces_conf(img_work)
@@ -36,15 +21,12 @@ def temporal_smooth(prev, cur, alpha=0.8):
     if prev is None: return cur
     return alpha*prev + (1-alpha)*cur
 
-def spsa_update(base, work, step=1.0, eps=6):
-    h,w,c = base.shape
-    delta = np.random.choice([-1.0,1.0], size=(h,w,c)).astype(np.float32)
-    x_plus  = np.clip(work.astype(np.float32)+delta, 0, 255).astype(np.uint8)
-    x_minus = np.clip(work.astype(np.float32)-delta, 0, 255).astype(np.uint8)
-    Lp,_,_ = objective(base, x_plus)
-    Lm,_,_ = objective(base, x_minus)
-    g = (Lp - Lm) / (2.0 + 1e-8) * delta
-    g = g / (np.mean(np.abs(g))+1e-8)
+def spsa_update(base, work, step=1.0, eps=6, optimizer=None):
+    oracle = lambda X: [objective(base, np.clip(x, 0, 255).astype(np.uint8))[0] for x in X]
+    opt = optimizer or SPSAOptimizer(K=1, c=1.0, normalize="mean_abs")
+    g = opt.estimate(work.astype(np.float32), oracle)
+    if g is None:
+        return work
     new = work.astype(np.float32) - step*g
     diff = new.astype(np.int32) - base.astype(np.int32)
     diff = np.clip(diff, -eps, eps).astype(np.int16)
@@ -60,7 +42,9 @@ def main():
     ap.add_argument("--iters-per-key", type=int, default=10)
     ap.add_argument("--disp-th", type=float, default=12.0)
     ap.add_argument("--fps", type=int, default=30)
+    ap.add_argument("--face-track", default=None, help="face_track.py 트랙 npz 경로 또는 auto (원본 프레임 검출 생략)")
     args = ap.parse_args()
+    track = resolve_face_track(args.face_track, args.input)
 
     cap = cv2.VideoCapture(args.input)
     if not cap.isOpened(): raise SystemExit("Cannot open input.")
@@ -71,15 +55,21 @@ def main():
     outv = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*"mp4v"), FPS, (W,H))
 
     prev_face_centroid = None
+    opt = SPSAOptimizer(K=1, c=1.0, normalize="mean_abs", log_every=200, name="VideoFacePoison")
     prev_W = None
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.get(cv2.CAP_PROP_FRAME_COUNT)>0 else None
     pbar = tqdm(total=total_frames, desc="VideoFacePoison")
+    f = 0
     while True:
         ret, frame = cap.read()
         if not ret: break
         base = frame.copy()
 
-        det = detect_faces_conf(base)
+        if track is not None:
+            det = [tuple(track.box(f)) + (track.confidence(f),)] if track.has_face(f) else []
+        else:
+            det = detect_faces_conf(base)
+        f += 1
         if len(det)>0:
             x1,y1,x2,y2,_ = det[0]
             cx = 0.5*(x1+x2); cy = 0.5*(y1+y2)
@@ -98,7 +88,7 @@ def main():
             work = base.copy()
             for _ in range(args.iters_per_key):
                 for _s in range(args.steps):
-                    work = spsa_update(base, work, step=1.0, eps=args.eps)
+                    work = spsa_update(base, work, step=1.0, eps=args.eps, optimizer=opt)
 
         prev_W = (work.astype(np.float32)-base.astype(np.float32))
         prev_W = np.clip(prev_W, -args.eps, args.eps)
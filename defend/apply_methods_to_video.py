@@ -5,12 +5,14 @@ apply_methods_to_video.py
 - Requires: OpenCV, numpy, pywt, face_alignment, torch (for LandmarkBreaker), facenet-pytorch (optional for NullSwap/Face models)
 - Uses your existing scripts:
     dwt_lowfreq_perturb.py -> function perturb_dwt_lowfreq(img, alpha, wave)
-    landmarkbreaker_pgd.py -> function pgd_maximize_landmark(img, fa, eps, steps, alpha)
+    landmarkbreaker_pgd.py -> function pgd_maximize_landmark_batch(imgs, fa, eps, steps, alpha, faces)
     nullswap_arcface_pgd.py  -> function pgd_cloak(img, models, eps, steps, alpha)
     leat_latent_ensemble_pgd.py -> function pgd_leat(x0, encoders, eps, steps, alpha)
     spsa_blackbox.py -> spsa_optimize (requires evaluate_image implement)
 """
-import argparse, subprocess, shutil, os, sys, json, uuid
+import argparse, subprocess, shutil, os, sys, json, uuid, hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import cv2, numpy as np
 import itertools, tqdm
@@ -21,34 +23,28 @@ OUTPUT_DIR = ROOT / "output"
 INPUT_VIDEO = INPUT_DIR / "short_test.mp4"
 TMP_FRAMES = ROOT / f"frames_{uuid.uuid4().hex[:8]}"
 TMP_PERT = ROOT / f"pert_{uuid.uuid4().hex[:8]}"
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-TMP_FRAMES.mkdir(parents=True, exist_ok=True)
-TMP_PERT.mkdir(parents=True, exist_ok=True)
+CACHE_DIR = ROOT / "cache"   # (프레임, 체인 prefix, 파라미터) 단위 content-addressed 캐시
+CACHE_MAX_GB = 10.0          # 캐시 용량 상한 (초과 시 오래 안 쓴 노드부터 삭제)
 
 # import functions from uploaded modules (must be in same folder)
 sys.path.append(str(ROOT))
-from dwt_lowfreq_perturb import perturb_dwt_lowfreq
-from landmarkbreaker_pgd import pgd_maximize_landmark
-from nullswap_arcface_pgd import pgd_cloak, InceptionResnetV1
+from dwt_lowfreq_perturb import perturb_dwt_lowfreq, perturb_dwt_lowfreq_batch
+from landmarkbreaker_pgd import pgd_maximize_landmark_batch
+from nullswap_arcface_pgd import pgd_cloak, pgd_null_batch, InceptionResnetV1
 from leat_latent_ensemble_pgd import pgd_leat
+sys.path.append(str(ROOT.parent / "LandmarkBreaker"))
+from face_track import resolve_face_track
 
+# 모델은 첫 사용 시 로드 (import 시 CUDA 초기화 안 함 → spawn 워커마다 1회)
 # face_alignment single instance for LandmarkBreaker
-import face_alignment
-FA = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, flip_input=False)
-
-# NullSwap surrogate model (will try to load; if unavailable, NullSwap will fail)
-try:
-    from facenet_pytorch import InceptionResnetV1 as FNRes
-    NS_MODEL = [FNRes(pretrained='vggface2').eval()]
-except Exception as e:
-    NS_MODEL = None
-    print("WARNING: facenet_pytorch InceptionResnetV1 not available. NULL attack will fail unless you install facenet-pytorch.")
-
-# LEAT: user must provide encoders; we provide a dummy encoder that returns spatial average (weak)
-def dummy_encoder(x):
-    # expects torch tensor [1,3,H,W], but pgd_leat uses such encoders - this dummy returns simple pooled vector
-    import torch
-    return torch.nn.functional.adaptive_avg_pool2d(x,1).view(1,-1)
+FA = None
+
+def get_fa():
+    global FA
+    if FA is None:
+        import face_alignment
+        FA = face_alignment.FaceAlignment(face_alignment.LandmarksType.TWO_D, flip_input=False)
+    return FA
 
 # Helper: ffmpeg extract / combine
 def ffmpeg_extract_frames(video_path, out_dir, fps=None):
@@ -86,137 +82,314 @@ def write_rgb(path, rgb):
 def attack_dwt(img, params):
     return perturb_dwt_lowfreq(img, alpha=params.get("alpha",0.02), wave=params.get("wave","haar"))
 
-def attack_lmb(img, params):
-    # pgd_maximize_landmark(img, fa, eps=..., steps=..., alpha=..., mask_face=True)
-    return pgd_maximize_landmark(img, FA, eps=params.get("eps_px",16)/255.0, steps=params.get("steps",20), alpha=params.get("alpha_px",1.0)/255.0)
+def attack_dwt_batch(imgs, params, srcs=None):
+    """같은 해상도 프레임 스택을 한 번의 dwt2/idwt2 로 처리"""
+    return list(perturb_dwt_lowfreq_batch(np.stack(imgs), alpha=params.get("alpha",0.02), wave=params.get("wave","haar")))
+
+def attack_lmb(img, params, src=None):
+    # 단일 프레임도 배치 경로 사용 (src 가 있으면 얼굴 트랙 재사용, 별도 단일 경로 없음)
+    return attack_lmb_batch([img], params, [src] if src is not None else None)[0]
+
+def attack_lmb_batch(imgs, params, srcs=None):
+    """얼굴 트랙이 있으면 원본 프레임의 박스/랜드마크를 그대로 사용 (체인 중간 결과에서 재검출 안 함)"""
+    faces = None
+    if FACE_TRACK is not None and srcs is not None:
+        faces = []
+        for s in srcs:
+            i = frame_index_of(s)
+            faces.append((FACE_TRACK.box(i), FACE_TRACK.landmarks(i)) if FACE_TRACK.has_face(i) else None)
+    return list(pgd_maximize_landmark_batch(np.stack(imgs), get_fa(), eps=params.get("eps_px",16)/255.0,
+                                            steps=params.get("steps",20), alpha=params.get("alpha_px",1.0)/255.0,
+                                            faces=faces))
 
 ####
 
-try:
-    from facenet_pytorch import InceptionResnetV1 as FNRes
-    import torch
-    NULL_DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    NS_TORCH = FNRes(pretrained='vggface2').eval().to(NULL_DEVICE)
-    NS_AVAILABLE = True
-    print("[NULL] facenet_pytorch loaded on", NULL_DEVICE)
-except Exception as e:
-    NS_TORCH = None
-    NS_AVAILABLE = False
-    print("[NULL][WARN] facenet_pytorch unavailable:", e)
-
-def _to_facenet_tensor(rgb_np):
-    """rgb_np: HxWx3 float[0,1] -> torch [1,3,160,160] float in [-1,1] (facenet_pytorch 규약)"""
-    import torch, cv2
-    H, W = rgb_np.shape[:2]
-    # facenet은 160x160 정규화 입력 기대. 간단 resize (정교하게 하려면 얼굴탐지/얼라인 추가)
-    img = (rgb_np * 255.0).astype(np.uint8)
-    img = cv2.resize(img[:,:,::-1], (160,160))[:,:,::-1]  # keep RGB
-    t = torch.from_numpy(img.transpose(2,0,1)).float() / 255.0
-    t = (t - 0.5) / 0.5     # [-1,1]
-    return t.unsqueeze(0).to(NULL_DEVICE)
-
-def _cosine(a,b,eps=1e-8):
-    import torch
-    na = a.norm(dim=1, keepdim=True) + eps
-    nb = b.norm(dim=1, keepdim=True) + eps
-    return (a*b).sum(dim=1, keepdim=True) / (na*nb)
+# NullSwap surrogate model (첫 NULL 호출 시 로드; 없으면 프레임 그대로 통과)
+NS_TORCH = None
+NULL_DEVICE = None
+NS_AVAILABLE = None  # None = 아직 로드 시도 전
+
+def get_null_model():
+    global NS_TORCH, NULL_DEVICE, NS_AVAILABLE
+    if NS_AVAILABLE is None:
+        try:
+            from facenet_pytorch import InceptionResnetV1 as FNRes
+            import torch
+            NULL_DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            NS_TORCH = FNRes(pretrained='vggface2').eval().to(NULL_DEVICE)
+            NS_AVAILABLE = True
+            print("[NULL] facenet_pytorch loaded on", NULL_DEVICE)
+        except Exception as e:
+            NS_TORCH = None
+            NS_AVAILABLE = False
+            print("[NULL][WARN] facenet_pytorch unavailable:", e)
+    return NS_TORCH
+
+# facetrack.py 가 만든 얼굴 박스 CSV (frame,x,y,w,h; frame은 0-based) → {frame_idx: (x,y,w,h)}
+FACE_BOXES = {}
+FACE_TRACK = None  # face_track.FaceTrack (--face_track): 박스 + 68점, 작업당 1회 검출
+NULL_AMP = False   # bfloat16 autocast (--null_amp)
+
+def load_face_boxes(csv_path):
+    import csv
+    boxes = {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            x, y, w, h = (int(float(row[k])) for k in ("x", "y", "w", "h"))
+            boxes[int(row["frame"])] = (x, y, w, h) if w > 0 and h > 0 else None
+    return boxes
+
+def frame_index_of(path):
+    """ffmpeg 추출 이름 frame_000001.png (1-based) → 0-based 인덱스"""
+    try:
+        return int(Path(path).stem.split("_")[-1]) - 1
+    except ValueError:
+        return None
+
+def _null_args(params):
+    steps = params.get("steps", 30)
+    eps = params.get("eps_px", 8) / 255.0          # 0~255 스케일 → [0,1]
+    alpha = max(eps / max(1, steps//2), 1/255.0)   # conservative step
+    return steps, eps, alpha
 
-def attack_null(img, params):
-    """임베딩 자기-유사도 cos(model(x_adv), model(x_clean))를 최소화하는 PGD."""
-    if not NS_AVAILABLE or NS_TORCH is None:
+def attack_null_batch(imgs, params, srcs=None):
+    """임베딩 자기-유사도 cos(model(x_adv), model(x_clean))를 최소화하는 배치 PGD (얼굴 crop / 트랙 있으면 정렬 crop)."""
+    if get_null_model() is None:
         print("[NULL][WARN] model not available. Passing frame unchanged.")
-        return img
+        return list(imgs)
+    steps, eps, alpha = _null_args(params)
+    idx = [frame_index_of(s) if s is not None else None for s in (srcs or [None]*len(imgs))]
+    boxes = [FACE_BOXES.get(i) for i in idx]
+    # 얼굴 트랙이 있으면 68점으로 5점 정렬 crop
+    lmks = [FACE_TRACK.landmarks(i) for i in idx] if FACE_TRACK is not None else None
+    return pgd_null_batch(list(imgs), boxes, NS_TORCH, eps=eps, steps=steps, alpha=alpha,
+                          device=NULL_DEVICE, amp=params.get("amp", NULL_AMP), landmarks=lmks)
 
-    import torch
-    steps = params.get("steps", 30)
-    eps_px = params.get("eps_px", 8)           # 0~255 스케일
-    eps    = eps_px / 255.0                    # [0,1]
-    alpha  = max(eps / max(1, steps//2), 1/255.0)  # conservative step
-
-    x_clean = _to_facenet_tensor(img).detach()
-    with torch.no_grad():
-        emb_clean = NS_TORCH(x_clean)
-
-    # x_adv는 원해상도에서 직접 최적화(간단화 버전: facenet 입력만 resize 후 grad)
-    # 실전에서는 원본 해상도에서 perturb → facenet 입력으로 다운샘플/정규화
-    x_adv = torch.tensor(img.transpose(2,0,1)[None]).float().to(NULL_DEVICE)
-    x0 = x_adv.clone().detach()
-    x_adv.requires_grad_(True)
-
-    for _ in range(steps):
-        # facenet 입력으로 맞추기
-        x_adv_input = torch.nn.functional.interpolate(x_adv, size=(160,160), mode='bilinear', align_corners=False)
-        x_adv_input = (x_adv_input - 0.5) / 0.5  # [-1,1]
-        emb_adv = NS_TORCH(x_adv_input)
-
-        # cos 유사도 최소화 (self-cloaking)
-        cos_sim = _cosine(emb_adv, emb_clean).mean()
-        loss = cos_sim  # minimize
-        loss.backward()
-
-        with torch.no_grad():
-            x_adv = x_adv - alpha * x_adv.grad.sign()
-            x_adv = torch.max(torch.min(x_adv, x0 + eps), x0 - eps)
-            x_adv = torch.clamp(x_adv, 0.0, 1.0)
-        x_adv.requires_grad_(True)
-
-    out = x_adv.detach().cpu().numpy()[0].transpose(1,2,0)
-    return np.clip(out, 0, 1)
+def attack_null(img, params):
+    return attack_null_batch([img], params)[0]
 
 #####
 
 
 #####
 def attack_leat(img, params):
-    # LEAT은 GPU 커널/엔진 문제를 피하기 위해 CPU 강제 + grad 보장
+    # 등록된 인코더(leat_latent_ensemble_pgd.ENCODER_LOADERS)를 이름으로 지정, 첫 사용 시 lazy 로드
     import torch
-    device = torch.device("cpu")  # 안정성 우선. GPU 쓰려면 "cuda"로 바꿔보되 FIND 에러 나면 다시 cpu 권장.
-    x0 = torch.tensor(img.transpose(2,0,1)[None]).float().to(device)
-    x0.requires_grad_(True)
-
-    # 더미 인코더(순수 torch op만 사용)
-    def dummy_encoder(x):
-        return torch.nn.functional.adaptive_avg_pool2d(x, 1).view(x.shape[0], -1)
-
-    encs = [dummy_encoder]
+    device = params.get("device") or ("cuda" if torch.cuda.is_available() else "cpu")
+    x0 = torch.tensor(img.transpose(2,0,1)[None]).float()
+    encs = params.get("encoders", ["dummy"])
     steps = params.get("steps", 30)
     eps   = params.get("eps", 0.05)      # L_inf in [0,1]
     alpha = params.get("alpha", 0.01)    # step size
-
-    # 간단 PGD: 인코더 피처 L2-노름을 최대화(=특징 불안정화) -> 교란 유도
-    x = x0.clone().detach().requires_grad_(True)
-    for _ in range(steps):
-        feats = [e(x) for e in encs]
-        loss = sum([(f**2).sum() for f in feats])  # 특징 에너지 ↑
-        (-loss).backward()  # maximize => minimize(-loss)
-
-        with torch.no_grad():
-            x = x + alpha * x.grad.sign()
-            x = torch.max(torch.min(x, x0 + eps), x0 - eps)  # L_inf 프로젝션
-            x = torch.clamp(x, 0.0, 1.0)
-        x.requires_grad_(True)
-
-    out = x.detach().cpu().numpy()[0].transpose(1,2,0)
+    x = pgd_leat(x0, encs, eps=eps, steps=steps, alpha=alpha, device=device)
+    out = x.cpu().numpy()[0].transpose(1,2,0)
     return np.clip(out, 0, 1)
 
 METHOD_FUNCS = {
     "DWT": (attack_dwt, [{"alpha":0.02,"wave":"haar"}, {"alpha":0.015,"wave":"haar"}]),
     "LMB": (attack_lmb, [{"eps_px":12,"steps":15,"alpha_px":1.0}, {"eps_px":16,"steps":20,"alpha_px":1.0}]),
     "NULL": (attack_null, [{"eps_px":8,"steps":30}, {"eps_px":10,"steps":40}]),
-    "LEAT": (attack_leat, [{"eps":0.05,"steps":30,"alpha":0.01}]),
+    "LEAT": (attack_leat, [{"eps":0.05,"steps":30,"alpha":0.01}]),  # encoders 기본값 ["dummy"]
     # "SPSA": handled separately if evaluate_image is provided
 }
+# 여러 프레임을 한 번에 처리할 수 있는 메서드: fn(imgs, params, srcs) -> list
+METHOD_BATCH_FUNCS = {
+    "DWT": attack_dwt_batch,
+    "NULL": attack_null_batch,
+    "LMB": attack_lmb_batch,
+}
 ####
 
-def apply_chain(frames, chain, param_combo, out_dir):
-    out_dir.mkdir(parents=True, exist_ok=True)
-    for i, fp in enumerate(tqdm.tqdm(frames, desc=f"Applying {chain}")):
-        rgb = read_rgb(fp)
-        out = rgb.copy()
-        for name, params in zip(chain, param_combo):
+# ---------- 메모이제이션 러너 ----------
+# 체인 DWT→LMB 와 DWT→NULL 은 같은 DWT 결과를 공유 → 노드 = (프레임 해시, 체인 prefix, 파라미터 prefix)
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for blk in iter(lambda: f.read(1 << 20), b""):
+            h.update(blk)
+    return h.hexdigest()
+
+def step_key(parent_key, name, params):
+    spec = json.dumps([name, params], sort_keys=True)
+    return hashlib.sha1(f"{parent_key}|{spec}".encode("utf-8")).hexdigest()
+
+def _digest(data):
+    return hashlib.sha1(data).hexdigest()[:12]
+
+def cache_params(name, params, face_digest, track_digest):
+    """
+    결과에 영향을 주는 전역 설정(main()에서 지정)을 파라미터에 합쳐 캐시 키/작업에 사용
+    - NULL: bf16 autocast(--null_amp) + 얼굴 박스/트랙 (crop·정렬)
+    - LMB:  얼굴 트랙 (박스/랜드마크 재사용)
+    """
+    p = dict(params)
+    if name == "NULL":
+        p.setdefault("amp", NULL_AMP)
+        p["faces"] = face_digest
+    elif name == "LMB" and track_digest is not None:
+        p["track"] = track_digest
+    return p
+
+def cache_path(cache_dir, key):
+    return Path(cache_dir) / key[:2] / f"{key}.npy"
+
+def _save_node(out, res):
+    """노드는 uint8 로 저장 (PNG 프레임과 같은 정밀도, float32 대비 1/4 용량)"""
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f"{out.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp, np.round(np.clip(res, 0, 1) * 255).astype(np.uint8))
+    os.replace(tmp, out)   # 원자적 교체 (동시 워커 안전)
+
+def _load_node(path):
+    arr = np.load(path)
+    return arr.astype(np.float32) / 255.0 if arr.dtype == np.uint8 else arr
+
+def _load_input(src, parent):
+    return _load_node(parent) if parent is not None else read_rgb(src)
+
+def _run_step(task):
+    """워커: 부모 결과(캐시 or 원본 프레임)에 메서드 1개 적용 → 캐시에 저장"""
+    src, parent, name, params, out = task
+    out = Path(out)
+    if out.exists():
+        return None
+    try:
+        img = _load_input(src, parent)
+        if name in METHOD_BATCH_FUNCS:
+            # 배치 경로와 같은 얼굴 인식 경로 (src → 얼굴 박스/트랙) — --batch 1 과 결과·캐시 일치
+            res = METHOD_BATCH_FUNCS[name]([img], params, [src])[0]
+        else:
             fn, _ = METHOD_FUNCS[name]
-            out = fn(out, params)
-        write_rgb(out_dir/fp.name, out)
+            res = fn(img, params)
+        _save_node(out, res)
+    except Exception as e:
+        return f"{name} on {Path(src).name}: {e}"
+    return None
+
+def _run_batch(tasks):
+    """워커: 같은 (메서드, 파라미터) 노드 여러 개를 배치 함수로 한 번에 처리"""
+    todo = [t for t in tasks if not Path(t[4]).exists()]
+    if not todo:
+        return None
+    name, params = todo[0][2], todo[0][3]
+    try:
+        imgs = [_load_input(t[0], t[1]) for t in todo]
+        outs = METHOD_BATCH_FUNCS[name](imgs, params, [t[0] for t in todo])
+        for t, res in zip(todo, outs):
+            _save_node(Path(t[4]), res)
+    except Exception as e:
+        return f"{name} batch of {len(todo)}: {e}"
+    return None
+
+def _group_batches(tasks, batch):
+    """배치 가능한 메서드는 (메서드, 파라미터) 별로 batch개씩 묶음"""
+    singles, groups = [], {}
+    for t in tasks:
+        if batch > 1 and t[2] in METHOD_BATCH_FUNCS:
+            groups.setdefault(json.dumps([t[2], t[3]], sort_keys=True), []).append(t)
+        else:
+            singles.append(t)
+    batches = [g[i:i+batch] for g in groups.values() for i in range(0, len(g), batch)]
+    return singles, batches
+
+def plan_runs(frames, runs, cache_dir):
+    """
+    runs: [(chain, params), ...]
+    반환: levels (prefix 길이별 고유 작업 리스트), run별 최종 캐시 경로 리스트
+    """
+    fhash = [file_hash(fp) for fp in frames]
+    track_digest = None
+    if FACE_TRACK is not None:
+        track_digest = _digest(FACE_TRACK.boxes.tobytes() + FACE_TRACK.lmks.tobytes())
+    face_digest = _digest(json.dumps([sorted(FACE_BOXES.items()), track_digest]).encode("utf-8"))
+    levels = {}
+    finals = []
+    for chain, params in runs:
+        paths = []
+        for i, fp in enumerate(frames):
+            key, parent = fhash[i], None
+            for d, (name, p) in enumerate(zip(chain, params)):
+                p = cache_params(name, p, face_digest, track_digest)
+                key = step_key(key, name, p)
+                cp = cache_path(cache_dir, key)
+                levels.setdefault(d, {})[str(cp)] = (str(fp), parent, name, p, str(cp))
+                parent = str(cp)
+            paths.append(parent)
+        finals.append(paths)
+    return [list(levels[d].values()) for d in sorted(levels)], finals
+
+def _init_worker(face_boxes, face_track, null_amp):
+    """spawn 워커: main()에서 정한 전역 상태 복원 (모델은 첫 사용 시 워커 안에서 로드)"""
+    global FACE_BOXES, FACE_TRACK, NULL_AMP
+    FACE_BOXES, FACE_TRACK, NULL_AMP = face_boxes, face_track, null_amp
+
+def execute_plan(levels, workers=1, batch=1):
+    """prefix 길이 순서대로 고유 노드만 계산 (이미 캐시된 노드는 건너뜀)"""
+    ex = None
+    if workers > 1:
+        # fork 는 부모의 CUDA 컨텍스트를 물려받아 실패/정지 → spawn + 워커별 lazy 모델 로드
+        ex = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(FACE_BOXES, FACE_TRACK, NULL_AMP))
+    try:
+        for d, tasks in enumerate(levels):
+            todo = [t for t in tasks if not Path(t[4]).exists()]
+            print(f"[cache] depth {d+1}: {len(tasks)} nodes, {len(tasks)-len(todo)} cached, {len(todo)} to compute")
+            if not todo:
+                continue
+            singles, batches = _group_batches(todo, batch)
+            jobs = [(_run_step, t) for t in singles] + [(_run_batch, b) for b in batches]
+            if ex is not None:
+                futs = [ex.submit(fn, arg) for fn, arg in jobs]
+                errs = [f.result() for f in tqdm.tqdm(futs, desc=f"depth {d+1}")]
+            else:
+                errs = [fn(arg) for fn, arg in tqdm.tqdm(jobs, desc=f"depth {d+1}")]
+            # 실패한 노드는 캐시에 남지 않음 → 해당 run은 materialize 단계에서 ERROR 처리
+            for e in filter(None, errs):
+                print(f"ERROR: {e}")
+    finally:
+        if ex is not None:
+            ex.shutdown()
+
+def materialize_run(frames, cached, out_dir):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for fp, cp in zip(frames, cached):
+        write_rgb(out_dir/fp.name, _load_node(cp))
+
+def prune_cache(cache_dir, max_bytes, used=()):
+    """이번 실행에서 쓴 노드의 mtime 갱신 후, 상한을 넘으면 가장 오래 안 쓴 노드부터 삭제"""
+    for p in used:
+        try:
+            os.utime(p)
+        except OSError:
+            pass
+    files = []
+    for f in Path(cache_dir).glob("*/*.npy"):
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        files.append((st.st_mtime, st.st_size, f))
+    total = sum(sz for _, sz, _ in files)
+    removed = 0
+    for _, sz, f in sorted(files, key=lambda x: x[0]):
+        if total <= max_bytes:
+            break
+        try:
+            f.unlink()
+            total -= sz
+            removed += 1
+        except OSError:
+            pass
+    print(f"[cache] {total/2**30:.2f} GB in {cache_dir} ({removed} nodes evicted, cap {max_bytes/2**30:.1f} GB)")
+
+def _ptag_value(v):
+    """리스트 값(예: LEAT encoders)은 '+' 로 연결 → 파일명에 괄호/따옴표 없음"""
+    return "+".join(map(str, v)) if isinstance(v, (list, tuple)) else str(v)
+
+def run_id_of(chain, params):
+    chain_name = "-".join(chain)
+    ptag = "__".join("_".join(f"{k}{_ptag_value(v).replace('.','p')}" for k,v in sorted(p.items())) for p in params)
+    return f"{chain_name}__{ptag}"
 
 def generate_chains(methods, max_len):
     chains = []
@@ -237,11 +410,34 @@ def main():
     parser.add_argument("--fps", type=int, default=None)
     parser.add_argument("--max_chain_len", type=int, default=2)
     parser.add_argument("--sample_every", type=int, default=1, help="프레임 샘플링 간격 (1=모두)")
+    parser.add_argument("--cache_dir", default=str(CACHE_DIR), help="체인 prefix 결과 캐시 폴더 (재실행 간 유지)")
+    parser.add_argument("--cache_max_gb", type=float, default=CACHE_MAX_GB, help="캐시 용량 상한 (GB, LRU 삭제)")
+    parser.add_argument("--clear_cache", action="store_true", help="실행 전 캐시 폴더 삭제")
+    parser.add_argument("--workers", type=int, default=1, help="spawn 프로세스 풀 크기 (워커마다 모델 로드, GPU 메모리 주의)")
+    parser.add_argument("--force", action="store_true", help="출력이 있어도 다시 실행")
+    parser.add_argument("--batch", type=int, default=8, help="배치 지원 메서드(DWT, NULL, LMB)의 프레임 배치 크기")
+    parser.add_argument("--face_csv", default=None, help="facetrack.py 얼굴 박스 CSV (NULL crop/정렬에 사용)")
+    parser.add_argument("--null_amp", action="store_true", help="NULL PGD bfloat16 autocast (CPU 포함)")
+    parser.add_argument("--face_track", default=None, help="face_track.py 트랙 npz 경로 또는 auto (입력 영상 해시로 로드/생성)")
     args = parser.parse_args()
 
+    global FACE_BOXES, FACE_TRACK, NULL_AMP
+    if args.face_track:
+        if args.fps is not None:
+            print("[face-track][WARN] --fps resamples frames; track indices would not match. Ignoring --face_track.")
+        else:
+            FACE_TRACK = resolve_face_track(args.face_track, args.input, fa=get_fa())
+            FACE_BOXES = FACE_TRACK.to_face_boxes()
+    if args.face_csv:
+        FACE_BOXES = load_face_boxes(args.face_csv)
+        print(f"[NULL] loaded {len(FACE_BOXES)} face boxes from {args.face_csv}")
+    NULL_AMP = args.null_amp
+
     in_vid = Path(args.input)
     out_root = Path(args.outputs)
     out_root.mkdir(parents=True, exist_ok=True)
+    TMP_FRAMES.mkdir(parents=True, exist_ok=True)
+    TMP_PERT.mkdir(parents=True, exist_ok=True)
 
     print("Extracting frames...")
     ffmpeg_extract_frames(in_vid, TMP_FRAMES, fps=args.fps)
@@ -251,27 +447,43 @@ def main():
 
     methods = list(METHOD_FUNCS.keys())
     chains = generate_chains(methods, args.max_chain_len)
-    print(f"Will run {len(chains)} chains (max_len={args.max_chain_len}) on {len(frames)} frames each.")
-
-    for chain in chains:
-        param_grid = generate_param_grid(chain)
-        for params in param_grid:
-            chain_name = "-".join(chain)
-            ptag = "__".join("_".join(f"{k}{str(v).replace('.','p')}" for k,v in sorted(p.items())) for p in params)
-            run_id = f"{chain_name}__{ptag}"
-            out_frames_dir = TMP_PERT / run_id
-            try:
-                print(f"\n--- Running {run_id} ---")
-                apply_chain(frames, chain, params, out_frames_dir)
-                out_video = out_root / f"{run_id}.mp4"
-                ffmpeg_combine_frames(out_frames_dir, in_vid, out_video, fps=args.fps)
-                meta = {"chain":chain, "params":params, "input":str(in_vid), "output":str(out_video)}
-                with open(out_root/(run_id+".json"), "w", encoding="utf-8") as f:
-                    json.dump(meta, f, ensure_ascii=False, indent=2)
-                print(f"Saved {out_video}")
-            except Exception as e:
-                print(f"ERROR during {run_id}: {e}")
+    runs = [(chain, params) for chain in chains for params in generate_param_grid(chain)]
+    # 결과(mp4+json)가 이미 있는 run은 건너뜀
+    pending = []
+    for chain, params in runs:
+        run_id = run_id_of(chain, params)
+        if not args.force and (out_root/f"{run_id}.mp4").exists() and (out_root/f"{run_id}.json").exists():
+            print(f"[skip] {run_id} (output exists)")
+            continue
+        pending.append((chain, params))
+    print(f"Will run {len(pending)}/{len(runs)} runs ({len(chains)} chains, max_len={args.max_chain_len}) on {len(frames)} frames each.")
+
+    cache_dir = Path(args.cache_dir)
+    if args.clear_cache:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    levels, finals = plan_runs(frames, pending, cache_dir)
+    print(f"Unique work: {sum(len(l) for l in levels)} frame-steps "
+          f"(naive: {sum(len(c)*len(frames) for c,_ in pending)})")
+    execute_plan(levels, workers=args.workers, batch=args.batch)
+
+    for (chain, params), cached in zip(pending, finals):
+        run_id = run_id_of(chain, params)
+        out_frames_dir = TMP_PERT / run_id
+        try:
+            print(f"\n--- Writing {run_id} ---")
+            materialize_run(frames, cached, out_frames_dir)
+            out_video = out_root / f"{run_id}.mp4"
+            ffmpeg_combine_frames(out_frames_dir, in_vid, out_video, fps=args.fps)
+            meta = {"chain":chain, "params":params, "input":str(in_vid), "output":str(out_video)}
+            with open(out_root/(run_id+".json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            print(f"Saved {out_video}")
+        except Exception as e:
+            print(f"ERROR during {run_id}: {e}")
+        finally:
+            shutil.rmtree(out_frames_dir, ignore_errors=True)
     # cleanup
+    prune_cache(cache_dir, args.cache_max_gb * 2**30, used=[t[4] for l in levels for t in l])
     print("Cleaning temporary directories...")
     shutil.rmtree(TMP_FRAMES, ignore_errors=True)
     shutil.rmtree(TMP_PERT, ignore_errors=True)
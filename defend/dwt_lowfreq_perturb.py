@@ -1,32 +1,91 @@
 #!/usr/bin/env python3
 """
-DWT low-frequency perturbation (per-frame)
+DWT low-frequency perturbation (per-frame / batched frame stack)
 - Depend: pywt, numpy, opencv-python
+- 이미지:  python dwt_lowfreq_perturb.py in.png --alpha 0.02
+- 영상:    python dwt_lowfreq_perturb.py in.mp4 --outfile out.mp4 --chunk 32
+           (디코드 → chunk 단위 배치 DWT → 인코드 스트리밍, fps 출력)
 """
-import argparse, cv2, numpy as np, pywt
+import argparse, os, time, cv2, numpy as np, pywt
+
+VIDEO_EXTS = (".mp4", ".avi", ".mov", ".mkv", ".webm")
+
+def perturb_dwt_lowfreq_batch(frames, alpha=0.02, wave='haar', rng=None):
+    """
+    frames: (T,H,W,3) float [0,1]
+    프레임/채널 루프 없이 axes=(1,2) 로 스택 전체를 한 번에 dwt2/idwt2,
+    노이즈도 (T,h,w,3) 한 번에 생성 (스케일은 프레임·채널별 std(cA) — 단일 프레임 버전과 동일)
+    """
+    frames = np.asarray(frames, dtype=np.float32)
+    T, H, W = frames.shape[:3]
+    cA, (cH, cV, cD) = pywt.dwt2(frames, wave, axes=(1, 2))
+    std = cA.std(axis=(1, 2), keepdims=True)  # (T,1,1,3)
+    noise = rng.standard_normal(cA.shape) if rng is not None else np.random.standard_normal(cA.shape)
+    cA_p = cA + noise * (alpha * std)
+    out = pywt.idwt2((cA_p, (cH, cV, cD)), wave, axes=(1, 2))[:, :H, :W]
+    return np.clip(out, 0.0, 1.0).astype(np.float32)
 
 def perturb_dwt_lowfreq(img, alpha=0.02, wave='haar'):
     # img: HxWx3 float [0,1]
-    out = img.copy()
-    for c in range(3):
-        coeffs2 = pywt.dwt2(out[:,:,c], wave)
-        cA, (cH, cV, cD) = coeffs2
-        # add smooth noise to approx coefficients
-        noise = np.random.normal(scale=alpha * np.std(cA), size=cA.shape)
-        cA_p = cA + noise
-        out[:,:,c] = pywt.idwt2((cA_p, (cH,cV,cD)), wave)
-    out = np.clip(out, 0.0, 1.0)
-    return out
+    return perturb_dwt_lowfreq_batch(img[None], alpha=alpha, wave=wave)[0]
+
+def iter_chunks(cap, chunk):
+    buf = []
+    while True:
+        ok, f = cap.read()
+        if not ok: break
+        buf.append(f)
+        if len(buf) == chunk:
+            yield np.stack(buf)
+            buf = []
+    if buf:
+        yield np.stack(buf)
+
+def perturb_video(in_path, out_path, alpha=0.02, wave='haar', chunk=32, fourcc="mp4v"):
+    """
+    영상 스트리밍 스테이지: chunk 프레임씩 디코드 → 배치 DWT → 인코드.
+    메모리는 chunk 크기에만 비례. 반환: (프레임 수, 처리 fps)
+    """
+    cap = cv2.VideoCapture(in_path)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open: {in_path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)); H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    wr = cv2.VideoWriter(out_path, cv2.VideoWriter_fourcc(*fourcc), fps, (W, H))
+    n = 0; t_dwt = 0.0
+    t0 = time.time()
+    for bgr in iter_chunks(cap, max(1, chunk)):
+        rgb = bgr[..., ::-1].astype(np.float32) / 255.0
+        t1 = time.time()
+        adv = perturb_dwt_lowfreq_batch(rgb, alpha=alpha, wave=wave)
+        t_dwt += time.time() - t1
+        out = (adv * 255).astype(np.uint8)[..., ::-1]
+        for f in out:
+            wr.write(np.ascontiguousarray(f))
+        n += len(out)
+    cap.release(); wr.release()
+    total = time.time() - t0
+    print(f"[DWT] {n} frames | end-to-end {n/max(total,1e-9):.1f} fps | DWT stage {n/max(t_dwt,1e-9):.1f} fps")
+    return n, n / max(total, 1e-9)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("infile")
     parser.add_argument("--outfile", default=None)
     parser.add_argument("--alpha", type=float, default=0.02)
+    parser.add_argument("--wave", default="haar")
+    parser.add_argument("--chunk", type=int, default=32, help="영상 모드 배치 프레임 수")
     args = parser.parse_args()
 
-    im = cv2.imread(args.infile)[:,:,::-1].astype(np.float32)/255.0
-    adv = perturb_dwt_lowfreq(im, alpha=args.alpha)
-    outp = args.outfile or args.infile.replace(".png","_dwt.png").replace(".jpg","_dwt.png")
-    cv2.imwrite(outp, (adv*255).astype('uint8')[:,:,::-1])
-    print("Saved", outp)
+    if args.infile.lower().endswith(VIDEO_EXTS):
+        root, _ = os.path.splitext(args.infile)
+        outp = args.outfile or root + "_dwt.mp4"
+        perturb_video(args.infile, outp, alpha=args.alpha, wave=args.wave, chunk=args.chunk)
+        print("Saved", outp)
+    else:
+        im = cv2.imread(args.infile)[:,:,::-1].astype(np.float32)/255.0
+        adv = perturb_dwt_lowfreq(im, alpha=args.alpha, wave=args.wave)
+        outp = args.outfile or args.infile.replace(".png","_dwt.png").replace(".jpg","_dwt.png")
+        cv2.imwrite(outp, (adv*255).astype('uint8')[:,:,::-1])
+        print("Saved", outp)
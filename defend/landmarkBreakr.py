@@ -9,6 +9,14 @@ import torch
 import torch.nn.functional as F
 import face_alignment
 from scipy.spatial import ConvexHull
+import sys
+from pathlib import Path
+
+# 공용 EOT / SPSA 엔진 (LandmarkBreaker/eot_engine.py, spsa_engine.py)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "LandmarkBreaker"))
+from eot_engine import EOTPool, LMB_EOT
+from spsa_engine import SPSAOptimizer
+from face_track import resolve_face_track
 
 # ----------------------------
 # 기본 유틸
@@ -120,26 +128,21 @@ def build_face_mask(h, w, landmarks_list):
 # ----------------------------
 # EOT (강인성용 랜덤 변환)
 # ----------------------------
+_EOT_POOL = None
+
+def get_eot_pool():
+    global _EOT_POOL
+    if _EOT_POOL is None:
+        _EOT_POOL = EOTPool(M=4, **LMB_EOT)
+    return _EOT_POOL
+
 def eot_augment(img_bgr):
-    h,w = img_bgr.shape[:2]
-    # resize jitter
-    scale = np.random.uniform(0.87, 1.10)
-    nh, nw = max(8,int(h*scale)), max(8,int(w*scale))
-    aug = cv2.resize(img_bgr, (nw,nh), interpolation=cv2.INTER_LINEAR)
-    aug = cv2.resize(aug, (w,h), interpolation=cv2.INTER_LINEAR)
-    # jpeg
-    q = int(np.random.uniform(40,90))
-    _, buf = cv2.imencode('.jpg', aug, [int(cv2.IMWRITE_JPEG_QUALITY), q])
-    aug = cv2.imdecode(buf, cv2.IMREAD_COLOR)
-    # blur
-    if np.random.rand() < 0.5:
-        k = np.random.choice([3,5])
-        aug = cv2.GaussianBlur(aug, (k,k), 0)
-    # brightness/contrast
-    alpha = np.random.uniform(0.92, 1.08)
-    beta  = np.random.uniform(-7, 7)
-    aug = np.clip(alpha*aug + beta, 0, 255).astype(np.uint8)
-    return aug
+    # 리사이즈 지터 → jpeg → blur → 밝기/대비 (eot_engine.LMB_EOT)
+    return get_eot_pool()(img_bgr, M=1)[0].copy()
+
+def eot_augment_batch(img_bgr, n):
+    """한 이미지의 EOT 변환본 n개 (n,H,W,3) — 풀 버퍼 뷰"""
+    return get_eot_pool()(img_bgr, M=n)
 
 # ----------------------------
 # 손실(블랙박스): 프레임 BGR → 랜드마크 → 히트맵 → 코사인 손실
@@ -169,7 +172,8 @@ def landmark_breaker_nes(
     sigma_pix=0.5,        # 유한차분 스텝(픽셀단위)
     eot_n=0,              # EOT 변환 횟수(0이면 사용 안함)
     lbpp=False,           # 얼굴 내부 보호(배경 위주 교란)
-    debug=None            # dict: {dir, frame_idx} 등
+    debug=None,           # dict: {dir, frame_idx} 등
+    lms0=None             # 원본 랜드마크 (get_landmarks 형식, 얼굴 트랙) — None이면 직접 검출
 ):
     dev = 'cuda' if torch.cuda.is_available() else 'cpu'
     H, W = frame_bgr.shape[:2]
@@ -177,7 +181,8 @@ def landmark_breaker_nes(
     # 1) 프레임 읽기 (입력 받음)
 
     # 2) 얼굴+랜드마크 얻기 (기본 시각화 저장)
-    lms0 = fa.get_landmarks(frame_bgr)
+    if lms0 is None:
+        lms0 = fa.get_landmarks(frame_bgr)
     if (lms0 is None) or (len(lms0)==0):
         # 얼굴 없음: 그대로 반환
         if debug:
@@ -199,7 +204,21 @@ def landmark_breaker_nes(
     eps  = epsilon_pix / 255.0
     alpha = alpha_pix  / 255.0
     sigma = sigma_pix  / 255.0
-    m = torch.zeros_like(x)
+    # NES: Gaussian 방향 K개를 한 번에, ± 쿼리는 oracle 한 번으로 평가 (spsa_engine)
+    opt = SPSAOptimizer(K=K, c=sigma, dist="gaussian", momentum=momentum, normalize="mean_abs",
+                        name="LMB-NES")
+
+    def oracle(X):
+        out = []
+        for xi in X:
+            img = bgr_from_tensor01(xi)
+            if eot_n > 0:
+                # EOT 평균
+                out.append(float(torch.stack([compute_loss_for_image(a, fa, h_ref)
+                                              for a in eot_augment_batch(img, eot_n)]).mean()))
+            else:
+                out.append(float(compute_loss_for_image(img, fa, h_ref)))
+        return out
 
     # LB++: 얼굴 내부 보호 마스크
     face_mask = build_face_mask(H,W,[lms0[0]])
@@ -209,34 +228,7 @@ def landmark_breaker_nes(
     step_log = []
 
     for t in range(steps):
-        grad_est = torch.zeros_like(x)
-
-        # NES 유한차분
-        for _ in range(K):
-            u = torch.randn_like(x)
-            x_pos = (x + sigma*u).clamp(0,1)
-            x_neg = (x - sigma*u).clamp(0,1)
-
-            img_pos = bgr_from_tensor01(x_pos)
-            img_neg = bgr_from_tensor01(x_neg)
-
-            if eot_n > 0:
-                # EOT 평균
-                losses_pos, losses_neg = [], []
-                for _e in range(eot_n):
-                    losses_pos.append(compute_loss_for_image(eot_augment(img_pos), fa, h_ref))
-                    losses_neg.append(compute_loss_for_image(eot_augment(img_neg), fa, h_ref))
-                Lp = torch.stack(losses_pos).mean()
-                Ln = torch.stack(losses_neg).mean()
-            else:
-                Lp = compute_loss_for_image(img_pos, fa, h_ref)
-                Ln = compute_loss_for_image(img_neg, fa, h_ref)
-
-            diff = (Lp - Ln).detach()
-            grad_est = grad_est + diff * u
-
-        grad_est = grad_est / (K * sigma)
-        m = momentum * m + grad_est / (grad_est.abs().mean() + 1e-12)
+        m = opt.estimate(x, oracle)
 
         if lbpp:
             # 얼굴 내부 보호: 얼굴 안쪽=1 → 보존(업데이트 억제)
@@ -297,6 +289,7 @@ def main():
     ap.add_argument('--max_frames', type=int, default=None, help='최대 처리 프레임 수(디버깅용)')
     ap.add_argument('--debug_dir', type=str, default=None, help='중간 산출물 저장 폴더')
     ap.add_argument('--dump_every', type=int, default=5, help='몇 스텝마다 중간 결과 저장할지')
+    ap.add_argument('--face_track', type=str, default=None, help='face_track.py 트랙 npz 경로 또는 auto (원본 프레임 검출 생략)')
     args = ap.parse_args()
 
     ensure_dir(os.path.dirname(args.output) or '.')
@@ -341,6 +334,7 @@ def main():
         cap = cv2.VideoCapture(args.input)
         if not cap.isOpened():
             raise RuntimeError('입력 비디오를 열 수 없습니다.')
+        track = resolve_face_track(args.face_track, args.input, fa=fa)
         W = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         H = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
@@ -376,7 +370,8 @@ def main():
                 frame, fa,
                 epsilon_pix=args.epsilon, alpha_pix=args.alpha, steps=args.steps,
                 momentum=args.momentum, K=args.k, sigma_pix=args.sigma_pix,
-                eot_n=args.eot, lbpp=args.lbpp, debug=debug
+                eot_n=args.eot, lbpp=args.lbpp, debug=debug,
+                lms0=track.landmarks_list(fidx) if track is not None else None
             )
             vw.write(out)
             last_out = out
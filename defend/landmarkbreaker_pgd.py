@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 """
-LandmarkBreaker-style PGD:
+LandmarkBreaker-style PGD (white-box, FAN heatmap loss):
 - 입력: PNG/JPG 이미지 (RGB)
 - 출력: perturbed image saved as *_adv.png
 - Depend: face_alignment (pip install face-alignment), pytorch, numpy, opencv-python
 """
 import os, sys, argparse, cv2, numpy as np, torch
+import torch.nn.functional as F
 import face_alignment
 from tqdm import tqdm
 
@@ -26,51 +27,142 @@ def landmarks_of(np_img, fa):
         return None
     return preds[0]  # first face
 
-def pgd_maximize_landmark(img, fa, eps=16/255.0, steps=20, alpha=1.0/255.0, mask_face=True):
+# ---------------- FAN white-box ----------------
+# face_alignment 내부 FAN(히트맵 네트워크)을 torch 텐서에 직접 적용 → 픽셀까지 gradient 전달
+# (기존 버전은 numpy 랜드마크로 loss를 만들어 그래프가 끊겨 있었음)
+FAN_RES = 256
+FAN_REF_SCALE = 195.0
+
+def fan_net(fa):
+    net = fa.face_alignment_net
+    for p in net.parameters():
+        p.requires_grad_(False)  # 입력 gradient만 필요
+    return net
+
+def fan_device(fa):
+    try:
+        return next(fa.face_alignment_net.parameters()).device
+    except Exception:
+        return torch.device(getattr(fa, "device", "cpu"))
+
+def detect_box(np_img, fa):
+    """face_alignment 검출기 박스 [x1,y1,x2,y2] (실패 시 랜드마크 범위로 대체)"""
+    u8 = (np_img*255).astype(np.uint8)
+    try:
+        dets = fa.face_detector.detect_from_image(u8.copy())
+        if dets is not None and len(dets) > 0:
+            return np.asarray(dets[0][:4], dtype=np.float32)
+    except Exception:
+        pass
+    lm = landmarks_of(np_img, fa)
+    if lm is None:
+        return None
+    (x1, y1), (x2, y2) = lm.min(axis=0), lm.max(axis=0)
+    return np.array([x1, y1, x2, y2], dtype=np.float32)
+
+def fan_crop_box(d):
+    """face_alignment 전처리와 같은 중심/스케일 → 정사각 crop 박스 (정수 픽셀)"""
+    cx = d[2] - (d[2] - d[0]) / 2.0
+    cy = d[3] - (d[3] - d[1]) / 2.0 - (d[3] - d[1]) * 0.12
+    half = 100.0 * (d[2] - d[0] + d[3] - d[1]) / FAN_REF_SCALE
+    return int(round(cx - half)), int(round(cy - half)), int(round(cx + half)), int(round(cy + half))
+
+def crop_resize(x, box, res=FAN_RES):
+    """x: (3,H,W) tensor → (3,res,res), 이미지 밖은 0 패딩 (미분 가능)"""
+    _, H, W = x.shape
+    x1, y1, x2, y2 = box
+    pl, pr, pt, pb = max(0, -x1), max(0, x2 - W), max(0, -y1), max(0, y2 - H)
+    xp = F.pad(x[None], (pl, pr, pt, pb))
+    patch = xp[..., y1 + pt:y2 + pt, x1 + pl:x2 + pl]
+    return F.interpolate(patch, size=(res, res), mode='bilinear', align_corners=False)[0]
+
+def fan_heatmaps(net, x, boxes):
+    """x: (B,3,H,W) [0,1] → (B,68,64,64)"""
+    inp = torch.stack([crop_resize(x[i], boxes[i]) for i in range(x.shape[0])], dim=0)
+    out = net(inp)
+    if isinstance(out, (list, tuple)):
+        out = out[-1]
+    return out
+
+def heatmap_cosine(h_adv, h_ref):
+    a = F.normalize(h_adv.flatten(2), dim=-1)
+    b = F.normalize(h_ref.flatten(2), dim=-1)
+    return (a * b).sum(dim=-1).mean(dim=1)  # (B,)
+
+def face_hull_mask(img, lm):
+    h, w = img.shape[:2]
+    mask = np.zeros((h,w), dtype=np.uint8)
+    cv2.fillConvexPoly(mask, cv2.convexHull(lm.astype(np.int32)), 1)
+    return mask.astype(np.float32)  # 1 face, 0 background
+
+def pgd_maximize_landmark_batch(imgs, fa, eps=16/255.0, steps=20, alpha=1.0/255.0, mask_face=True, faces=None):
     """
-    Simple PGD: maximize L2 distance between original landmarks and perturbed landmarks
-    - mask_face: only perturb outside face hull (as LandmarkBreaker++ suggests)
+    White-box 배치 PGD: B장의 프레임을 한 번에 FAN에 통과시켜
+    clean 히트맵과의 코사인 유사도를 최소화.
+    - imgs: (B,H,W,3) float [0,1] (같은 해상도)
+    - mask_face: 얼굴 hull 바깥만 교란 (LandmarkBreaker++)
+    - faces: 프레임별 (box[x1,y1,x2,y2], lm(68,2)) 또는 None (얼굴 트랙에서 전달 → 검출 생략)
+             faces 자체가 None 이면 프레임마다 직접 검출
+    얼굴이 없는 프레임은 그대로 반환.
     """
-    h,w,_ = img.shape
-    orig_lm = landmarks_of(img, fa)
-    if orig_lm is None:
-        raise RuntimeError("No face detected")
-    # build face mask hull (1=face area)
-    hull = cv2.convexHull(orig_lm.astype(np.int32))
-    mask = np.zeros((h,w), dtype=np.uint8)
-    cv2.fillConvexPoly(mask, hull, 1)
-    mask = mask.astype(np.float32)  # 1 face, 0 background
-    mask_inv = 1.0 - mask  # perturb only outside if mask_face True
+    imgs = np.asarray(imgs, dtype=np.float32)
+    net = fan_net(fa)
+    dev = fan_device(fa)
+    boxes, keep, masks = [], [], []
+    for i, im in enumerate(imgs):
+        if faces is not None:
+            if faces[i] is None:
+                continue
+            d, lm = faces[i]
+        else:
+            d = detect_box(im, fa)
+            lm = None
+        if d is None:
+            continue
+        keep.append(i)
+        boxes.append(fan_crop_box(d))
+        if mask_face:
+            if lm is None:
+                lm = landmarks_of(im, fa)
+            masks.append(1.0 - face_hull_mask(im, lm) if lm is not None else np.ones(im.shape[:2], np.float32))
+    out = imgs.copy()
+    if not keep:
+        return out
 
-    x0 = torch.tensor(img.transpose(2,0,1)[None], dtype=torch.float32)  # 1x3xHxW
-    x = x0.clone().detach().requires_grad_(True)
-    orig_lm_t = torch.tensor(orig_lm, dtype=torch.float32)
+    x0 = torch.from_numpy(imgs[keep].transpose(0,3,1,2).copy()).to(dev)  # Bx3xHxW
+    m = torch.from_numpy(np.stack(masks)[:,None]).to(dev) if mask_face else None
+    with torch.no_grad():
+        h_ref = fan_heatmaps(net, x0, boxes)
 
+    x = x0.clone()
     for t in range(steps):
-        # convert current x to numpy for face_alignment
-        x_np = x.detach().cpu().numpy()[0].transpose(1,2,0)
-        cur_lm = landmarks_of(x_np, fa)
-        if cur_lm is None:
-            # if detector fails, then attack succeeded - stop
-            break
-        cur_lm_t = torch.tensor(cur_lm, dtype=torch.float32)
-        # loss = negative L2 between orig and cur (we maximize L2 -> minimize negative)
-        loss = -torch.mean((orig_lm_t - cur_lm_t).pow(2))
-        loss.backward()
-        grad = x.grad.data
-        # gradient ascent step (sign)
-        x.data = x.data + alpha * torch.sign(grad)
-        # project onto L_inf ball
-        x.data = torch.max(torch.min(x.data, x0 + eps), x0 - eps)
-        # optionally mask inside face to avoid visible distortion (LandmarkBreaker++)
-        if mask_face:
-            m = torch.tensor(mask_inv[None,None,:,:], dtype=torch.float32)
-            x.data = x0 * (1.0 - m) + x.data * m
-        x.grad.zero_()
-    out = x.detach().cpu().numpy()[0].transpose(1,2,0)
-    out = np.clip(out, 0.0, 1.0)
+        x.requires_grad_(True)
+        loss = heatmap_cosine(fan_heatmaps(net, x, boxes), h_ref).sum()
+        grad, = torch.autograd.grad(loss, x)
+        with torch.no_grad():
+            step = alpha * torch.sign(grad)
+            if m is not None:
+                step = step * m
+            x = x - step  # 유사도 ↓
+            x = torch.max(torch.min(x, x0 + eps), x0 - eps).clamp(0.0, 1.0)
+    out[keep] = x.detach().cpu().numpy().transpose(0,2,3,1)
     return out
 
+def pgd_maximize_landmark(img, fa, eps=16/255.0, steps=20, alpha=1.0/255.0, mask_face=True, face=None):
+    """
+    단일 이미지 호환 래퍼 (FAN white-box PGD)
+    - mask_face: only perturb outside face hull (as LandmarkBreaker++ suggests)
+    - face: (box, lm) 미리 구한 얼굴 (없으면 검출)
+    """
+    if face is None:
+        lm = landmarks_of(img, fa)
+        if lm is None:
+            raise RuntimeError("No face detected")
+        d = detect_box(img, fa)
+        face = (d if d is not None else np.r_[lm.min(axis=0), lm.max(axis=0)], lm)
+    return pgd_maximize_landmark_batch(img[None], fa, eps=eps, steps=steps, alpha=alpha,
+                                       mask_face=mask_face, faces=[face])[0]
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("infile")
@@ -1,57 +1,118 @@
 #!/usr/bin/env python3
 """
 LEAT-style normalized gradient ensemble PGD:
-- You must supply a list of encoder functions that accept torch image and return latent (requires_grad True)
+- Encoders are looked up by name in a registry (register_encoder) and loaded lazily on first use,
+  or passed directly as callables enc(x) -> latent (batch x D)
 - Example encoders are wrappers around pretrained model encoders (StyleCLIP encoder, SimSwap encoder, DiffAE, etc.)
+- 사용 예: python leat_latent_ensemble_pgd.py in.png --encoders facenet,dummy
 """
 import torch, numpy as np, cv2, argparse
 
-def normalized_gradients(encoders, x):
+# ---------------- encoder registry ----------------
+# name -> loader(device) ; 로드된 인스턴스는 (name, device) 별로 캐시
+ENCODER_LOADERS = {}
+_ENCODER_CACHE = {}
+
+def register_encoder(name):
+    """데코레이터: @register_encoder("simswap") def load(device): return enc"""
+    def deco(loader):
+        ENCODER_LOADERS[name] = loader
+        return loader
+    return deco
+
+def get_encoder(name, device='cpu'):
+    key = (name, str(device))
+    if key not in _ENCODER_CACHE:
+        if name not in ENCODER_LOADERS:
+            raise KeyError(f"unknown encoder '{name}' (registered: {sorted(ENCODER_LOADERS)})")
+        enc = ENCODER_LOADERS[name](device)
+        if isinstance(enc, torch.nn.Module):
+            enc = enc.eval().to(device)
+            for p in enc.parameters():
+                p.requires_grad_(False)  # 입력 gradient만 필요
+        _ENCODER_CACHE[key] = enc
+    return _ENCODER_CACHE[key]
+
+def resolve_encoders(encoders, device='cpu'):
+    """이름/callable 혼합 리스트 → callable 리스트"""
+    return [get_encoder(e, device) if isinstance(e, str) else e for e in encoders]
+
+@register_encoder("dummy")
+def _load_dummy(device):
+    # placeholder: returns a linear embedding (NOT a real encoder). Replace with real model.
+    def dummy_encoder(x):
+        return torch.nn.functional.adaptive_avg_pool2d(x, 1).view(x.shape[0], -1)
+    return dummy_encoder
+
+@register_encoder("facenet")
+def _load_facenet(device):
+    from facenet_pytorch import InceptionResnetV1
+    net = InceptionResnetV1(pretrained='vggface2').eval().to(device)
+    for p in net.parameters():
+        p.requires_grad_(False)
+    def facenet_encoder(x):
+        x = torch.nn.functional.interpolate(x, size=(160,160), mode='bilinear', align_corners=False)
+        return net((x - 0.5) / 0.5)
+    return facenet_encoder
+
+# ---------------- normalized gradient ensemble ----------------
+def clean_latents(encoders, x0):
+    """gradient cache: 원본 latent는 1회만 계산 (no_grad)"""
+    with torch.no_grad():
+        return [enc(x0).detach() for enc in encoders]
+
+def normalized_gradients(encoders, x, z0=None):
     """
     encoders: list of callables enc_i(x) -> latent tensor (batch x D)
-    returns: averaged normalized gradient w.r.t x
+    z0: 원본 latent 리스트 (없으면 -||z|| 데모 loss)
+    returns: averaged per-sample normalized gradient w.r.t x
+    - 인코더별 autograd.grad → 각 그래프는 바로 해제 (retain_graph 불필요)
     """
-    grads = []
-    for enc in encoders:
-        # forward
+    x = x.detach().requires_grad_(True)
+    fused = torch.zeros_like(x)
+    for i, enc in enumerate(encoders):
         z = enc(x)
-        # define loss: we want to maximize difference from original latent -> use L2 between z and z0 stored externally
-        # for demo, use negative L2 norm (to get gradient)
-        loss = -torch.norm(z, p=2)
-        loss.backward(retain_graph=True)
-        g = x.grad.detach().clone()
-        # normalize gradient
-        g_norm = g / (g.norm() + 1e-10)
-        grads.append(g_norm)
-        x.grad.zero_()
-    avg = torch.stack(grads, dim=0).mean(dim=0)
-    return avg
-
-def pgd_leat(x0, encoders, eps=0.05, steps=30, alpha=0.01, device='cpu'):
-    x = x0.clone().detach().to(device).requires_grad_(True)
+        if z0 is not None:
+            # 원본 latent와의 거리 최대화 (배치 합)
+            loss = ((z - z0[i]) ** 2).flatten(1).sum(dim=1).sum()
+        else:
+            loss = -torch.norm(z.flatten(1), p=2, dim=1).sum()
+        g, = torch.autograd.grad(loss, x)
+        # normalize gradient (샘플별)
+        g_norm = g / (g.flatten(1).norm(dim=1).view(-1, *[1]*(g.dim()-1)) + 1e-10)
+        fused += g_norm
+    return fused / max(1, len(encoders))
+
+def pgd_leat(x0, encoders, eps=0.05, steps=30, alpha=0.01, device='cpu', random_start=True):
+    """
+    x0: (B,3,H,W) [0,1]
+    encoders: 등록된 이름 또는 callable 리스트
+    """
+    encoders = resolve_encoders(encoders, device)
+    x0 = x0.detach().to(device)
+    z0 = clean_latents(encoders, x0)
+    x = x0.clone()
+    if random_start:
+        # x0 에서는 ||z-z0||² 의 gradient가 0 → 랜덤 시작
+        x = (x + torch.empty_like(x).uniform_(-eps, eps)).clamp(0.0, 1.0)
     for t in range(steps):
-        g = normalized_gradients(encoders, x)
-        x.data = x.data + alpha * torch.sign(g)
-        x.data = torch.max(torch.min(x.data, x0 + eps), x0 - eps)
-        x.grad.zero_()
+        g = normalized_gradients(encoders, x, z0)
+        x = x + alpha * torch.sign(g)
+        x = torch.max(torch.min(x, x0 + eps), x0 - eps).clamp(0.0, 1.0)
     return x.detach()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("infile")
     parser.add_argument("--outfile", default=None)
+    parser.add_argument("--encoders", default="dummy", help="comma separated registered names: " + ",".join(sorted(ENCODER_LOADERS)))
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
     args = parser.parse_args()
 
-    # --- user must implement/plug encoder wrappers: enc(x) -> torch tensor latent
-    def dummy_encoder(x):
-        # placeholder: returns a linear embedding (NOT a real encoder). Replace with real model.
-        # expect x shape [1,3,H,W]
-        return torch.nn.functional.adaptive_avg_pool2d(x,1).view(1,-1)
-
-    encs = [dummy_encoder, dummy_encoder]  # replace with real encoders
+    encs = [e.strip() for e in args.encoders.split(",") if e.strip()]
     im = cv2.imread(args.infile)[:,:,::-1].astype(np.float32)/255.0
     x0 = torch.tensor(im.transpose(2,0,1)[None]).float()
-    adv = pgd_leat(x0, encs, eps=0.05, steps=30, alpha=0.01)
+    adv = pgd_leat(x0, encs, eps=0.05, steps=30, alpha=0.01, device=args.device)
     out = adv.cpu().numpy()[0].transpose(1,2,0)
     out = np.clip(out,0,1)
     outp = args.outfile or args.infile.replace(".png","_leat.png")
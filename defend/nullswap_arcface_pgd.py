@@ -5,7 +5,8 @@ NullSwap-style: PGD to perturb ArcFace embeddings (ensemble optional)
 - You need an ArcFace model (onnx/pytorch). Example uses facenet-pytorch's InceptionResnetV1 as surrogate,
   but for real-world transferability, use ArcFace models (insightface).
 """
-import argparse, cv2, numpy as np, torch
+import argparse, contextlib, cv2, numpy as np, torch
+import torch.nn.functional as F
 from facenet_pytorch import InceptionResnetV1
 
 def preprocess(img, size=160):
@@ -40,6 +41,112 @@ def pgd_cloak(img, models, eps=8/255.0, steps=30, alpha=1.0/255.0):
         x.grad.zero_()
     return deprocess(x)
 
+# ---------------- 배치 NullSwap 엔진 ----------------
+# 얼굴 crop → 160x160 배치 PGD → delta를 원래 프레임 좌표로 되돌려 붙여넣기
+# - 랜드마크(face_track 68점)가 있으면 5점 similarity transform 정렬 crop (ArcFace 템플릿)
+# - 없으면 facetrack 박스 기준 정사각 crop + 리사이즈
+FACENET_SIZE = 160
+# ArcFace 5점 템플릿 (112x112 기준: 왼눈, 오른눈, 코끝, 왼입꼬리, 오른입꼬리 — 이미지 좌우 기준)
+ARCFACE_5PTS = np.array([[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366],
+                         [41.5493, 92.3655], [70.7299, 92.2041]], dtype=np.float32)
+
+def autocast_ctx(device, amp):
+    """amp=True면 bfloat16 autocast (CPU/GPU), 지원 안 되면 float32 그대로"""
+    if not amp:
+        return contextlib.nullcontext()
+    try:
+        return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+    except Exception:
+        return contextlib.nullcontext()
+
+def square_rect(box, W, H):
+    """box (x,y,w,h) → 이미지 안쪽으로 자른 정사각 rect (x1,y1,x2,y2); box 없으면 전체 프레임"""
+    if box is None or box[2] <= 0 or box[3] <= 0:
+        return 0, 0, W, H
+    x, y, w, h = box
+    side = max(w, h)
+    cx, cy = x + w / 2.0, y + h / 2.0
+    x1 = int(max(0, round(cx - side / 2.0))); y1 = int(max(0, round(cy - side / 2.0)))
+    x2 = int(min(W, round(cx + side / 2.0))); y2 = int(min(H, round(cy + side / 2.0)))
+    return x1, y1, x2, y2
+
+def five_points(lmk68):
+    """68점 → 5점 (눈 중심 2개, 코끝, 입꼬리 2개)"""
+    l = np.asarray(lmk68, dtype=np.float32)
+    return np.stack([l[36:42].mean(0), l[42:48].mean(0), l[30], l[48], l[54]])
+
+def align_matrix(lmk68, size=FACENET_SIZE):
+    """5점 → 템플릿 similarity transform (2x3), 추정 실패 시 None"""
+    M, _ = cv2.estimateAffinePartial2D(five_points(lmk68), ARCFACE_5PTS * (size / 112.0), method=cv2.LMEDS)
+    return M
+
+def crop_faces(imgs, boxes, size=FACENET_SIZE, landmarks=None):
+    """
+    imgs: list of HxWx3 float[0,1] → crops (B,size,size,3), rects
+    rects[i]: 정렬 crop 이면 2x3 행렬, 아니면 (x1,y1,x2,y2)
+    """
+    crops, rects = [], []
+    landmarks = landmarks or [None] * len(imgs)
+    for im, b, lm in zip(imgs, boxes, landmarks):
+        H, W = im.shape[:2]
+        M = align_matrix(lm, size) if lm is not None else None
+        if M is not None:
+            crops.append(cv2.warpAffine(im, M, (size, size), flags=cv2.INTER_LINEAR,
+                                        borderMode=cv2.BORDER_REFLECT))
+            rects.append(M)
+            continue
+        x1, y1, x2, y2 = square_rect(b, W, H)
+        crops.append(cv2.resize(im[y1:y2, x1:x2], (size, size), interpolation=cv2.INTER_AREA))
+        rects.append((x1, y1, x2, y2))
+    return np.stack(crops).astype(np.float32), rects
+
+def paste_deltas(imgs, deltas, rects, eps):
+    outs = []
+    for im, d, r in zip(imgs, deltas, rects):
+        if isinstance(r, np.ndarray):
+            # 정렬 crop: 역변환으로 프레임 좌표에 되돌림 (crop 밖은 0)
+            H, W = im.shape[:2]
+            d_full = cv2.warpAffine(d, r, (W, H), flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+                                    borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+            outs.append(np.clip(im + np.clip(d_full, -eps, eps), 0.0, 1.0))
+            continue
+        x1, y1, x2, y2 = r
+        out = im.copy()
+        d_up = cv2.resize(d, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+        out[y1:y2, x1:x2] = np.clip(im[y1:y2, x1:x2] + np.clip(d_up, -eps, eps), 0.0, 1.0)
+        outs.append(out)
+    return outs
+
+def pgd_null_batch(imgs, boxes, model, eps=8/255.0, steps=30, alpha=None, device='cpu', amp=False,
+                   landmarks=None):
+    """
+    B장의 프레임을 한 번에: cos(model(x_adv), model(x_clean)) 최소화 PGD.
+    - imgs: list of HxWx3 float[0,1] (RGB, 해상도 달라도 됨)
+    - boxes: 프레임별 (x,y,w,h) 또는 None (None이면 전체 프레임)
+    - landmarks: 프레임별 68점 (N,2) 또는 None → 있으면 5점 정렬 crop
+    - amp: bfloat16 autocast (CPU 포함, 지원되는 경우)
+    """
+    if alpha is None:
+        alpha = max(eps / max(1, steps // 2), 1/255.0)
+    for p in model.parameters():
+        p.requires_grad_(False)
+    crops, rects = crop_faces(imgs, boxes, landmarks=landmarks)
+    x0 = torch.from_numpy(crops.transpose(0, 3, 1, 2).copy()).to(device)
+    with torch.no_grad(), autocast_ctx(device, amp):
+        emb_clean = model((x0 - 0.5) / 0.5).float()
+    x = x0.clone()
+    for _ in range(steps):
+        x.requires_grad_(True)
+        with autocast_ctx(device, amp):
+            emb = model((x - 0.5) / 0.5)
+        loss = F.cosine_similarity(emb.float(), emb_clean, dim=1).sum()
+        grad, = torch.autograd.grad(loss, x)
+        with torch.no_grad():
+            x = x - alpha * grad.sign()
+            x = torch.max(torch.min(x, x0 + eps), x0 - eps).clamp(0.0, 1.0)
+    deltas = (x - x0).detach().float().cpu().numpy().transpose(0, 2, 3, 1)
+    return paste_deltas(imgs, deltas, rects, eps)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("infile")
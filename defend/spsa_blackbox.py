@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
 """
 SPSA black-box optimizer skeleton
-- You must implement evaluate_image(path) -> float (lower is better/worse depending on definition)
+- You must implement evaluate_array(img) -> float (in-memory, preferred)
+  or evaluate_image(path) -> float (external file-based pipeline, via FileOracle;
+  used automatically while evaluate_array is still the stub)
 - The code performs SPSA updates on an image (or patch) to minimize the evaluation score.
+- 후보 평가는 oracle(X[N,H,W,3]) -> (N,) 배치 콜백 한 번으로 수행 (spsa_engine)
 """
-import numpy as np, cv2, argparse, os, subprocess, tempfile
+import numpy as np, cv2, argparse, os, subprocess, tempfile, sys, shutil, threading, itertools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 공용 SPSA 엔진 (LandmarkBreaker/spsa_engine.py)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "LandmarkBreaker"))
+from spsa_engine import SPSAOptimizer
+
+def evaluate_array(img):
+    """
+    User-provided (in-memory): img HxWx3 float [0,1] RGB -> scalar score.
+    Example: run a face-recognition model directly on the array and return similarity vs expected.
+    Here we raise to force user to implement.
+    """
+    raise NotImplementedError("Please implement evaluate_array(img) (or evaluate_image(path) with --file_oracle)")
 
 def evaluate_image(path):
     """
@@ -14,32 +31,132 @@ def evaluate_image(path):
     """
     raise NotImplementedError("Please implement evaluate_image(path) to run your pipeline and return metric")
 
-def spsa_optimize(img, iters=200, a=0.1, c=0.01, alpha=0.602, gamma=0.101):
+def scratch_root():
+    """tmpfs(/dev/shm)가 있으면 그쪽, 없으면 기본 임시 폴더"""
+    return "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+
+class FileOracle:
+    """
+    파일 기반 외부 파이프라인용 어댑터: evaluate_image(path) -> 배치 oracle
+    - scratch 폴더는 1개만 만들어 재사용 (tmpfs 우선), close()/with 블록 종료 시 삭제
+    - 쿼리 파일명은 전역 카운터로 고유 → 여러 스텝/최적화가 동시에 써도 충돌 없음
+    - workers>1 이면 PNG 저장 + 외부 평가를 스레드 풀에서 동시에 실행
+    """
+    def __init__(self, evaluate=None, workers=1, scratch_dir=None, ext=".png", keep=False):
+        self.evaluate = evaluate or evaluate_image
+        self.ext = ext
+        self.keep = keep
+        self.dir = tempfile.mkdtemp(prefix="spsa_", dir=scratch_dir or scratch_root())
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _path(self):
+        with self._lock:
+            i = next(self._ids)
+        return os.path.join(self.dir, f"q{i:08d}{self.ext}")
+
+    def _one(self, x):
+        path = self._path()
+        cv2.imwrite(path, (np.clip(x, 0.0, 1.0)*255).astype('uint8')[:,:,::-1])
+        try:
+            return float(self.evaluate(path))
+        finally:
+            if not self.keep:
+                os.remove(path)
+
+    def __call__(self, X):
+        ys = self.pool.map(self._one, X) if self.pool else map(self._one, X)
+        return np.asarray(list(ys), dtype=np.float32)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if not self.keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ArrayOracle:
+    """
+    메모리 상 배열을 바로 평가하는 oracle (디스크 I/O 없음)
+    batched=True 면 evaluate(X[N,H,W,3]) -> (N,) 를 한 번 호출,
+    아니면 샘플별 evaluate(x) 를 workers 개 스레드로 동시에 실행
+    - 기본 evaluate_array 가 아직 stub(NotImplementedError)이면 evaluate_image 파일 파이프라인(FileOracle)으로 자동 전환
+    - close()/with 블록 종료 시 스레드 풀 (및 전환된 FileOracle) 정리
+    """
+    def __init__(self, evaluate=None, batched=False, workers=1, fallback=True):
+        self.evaluate = evaluate or evaluate_array
+        self.batched = batched
+        self.workers = workers
+        self.fallback = fallback and evaluate is None
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 and not batched else None
+        self._file = None
+
+    def _eval(self, X):
+        if self.batched:
+            return np.asarray(self.evaluate(X), dtype=np.float32)
+        ys = self.pool.map(self.evaluate, X) if self.pool else map(self.evaluate, X)
+        return np.asarray(list(ys), dtype=np.float32)
+
+    def __call__(self, X):
+        if self._file is not None:
+            return self._file(X)
+        X = np.clip(X, 0.0, 1.0)
+        try:
+            return self._eval(X)
+        except NotImplementedError:
+            if not self.fallback:
+                raise
+            print("[SPSA] evaluate_array not implemented; falling back to evaluate_image (FileOracle)")
+            self._file = FileOracle(workers=self.workers)
+            return self._file(X)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def array_oracle(evaluate=None, batched=False, workers=1):
+    """ArrayOracle 생성 (호환용)"""
+    return ArrayOracle(evaluate, batched=batched, workers=workers)
+
+def spsa_optimize(img, iters=200, a=0.1, c=0.01, alpha=0.602, gamma=0.101, oracle=None, K=1, query_budget=None):
     """
     img: HxWx3 float [0,1]
+    oracle: X(N,H,W,3) -> (N,) 점수 (기본: evaluate_array in-memory oracle, 미구현이면 evaluate_image)
+    K: 스텝당 방향 수 (2K 쿼리가 oracle 한 번에 전달되어 동시에 평가됨)
     return: adv image
     """
+    if oracle is None:
+        with ArrayOracle() as own:
+            return spsa_optimize(img, iters, a, c, alpha, gamma, own, K, query_budget)
+    opt = SPSAOptimizer(K=K, c=c, query_budget=query_budget, log_every=10, name="SPSA")
     x = img.copy()
-    baseline = None
     for k in range(1, iters+1):
         ak = a / (k**alpha)
         ck = c / (k**gamma)
-        # random perturbation vector (binary +1/-1)
-        delta = np.random.choice([1,-1], size=x.shape).astype(np.float32)
-        x_plus = np.clip(x + ck*delta, 0.0, 1.0)
-        x_minus = np.clip(x - ck*delta, 0.0, 1.0)
-        # save temp files and evaluate
-        pfile = lambda arr, idx: f"/tmp/spsa_{k}_{idx}.png"
-        cv2.imwrite(pfile(x_plus, 'p'), (x_plus*255).astype('uint8')[:,:,::-1])
-        cv2.imwrite(pfile(x_minus, 'm'), (x_minus*255).astype('uint8')[:,:,::-1])
-        y_plus = evaluate_image(pfile(x_plus,'p'))
-        y_minus = evaluate_image(pfile(x_minus,'m'))
-        # approximate gradient
-        g_hat = (y_plus - y_minus) / (2.0 * ck * delta)
+        g_hat = opt.estimate(x, oracle, c=ck)
+        if g_hat is None:
+            print(f"Query budget exhausted at iter {k}")
+            break
         # update
         x = x - ak * g_hat  # minimize metric
         x = np.clip(x, 0.0, 1.0)
-        print(f"Iter {k}: y+={y_plus:.4f} y-={y_minus:.4f}")
     return x
 
 if __name__ == "__main__":
@@ -47,12 +164,19 @@ if __name__ == "__main__":
     parser.add_argument("infile")
     parser.add_argument("--outfile", default=None)
     parser.add_argument("--iters", type=int, default=200)
+    parser.add_argument("--k", type=int, default=1, help="스텝당 SPSA 방향 수")
+    parser.add_argument("--budget", type=int, default=None, help="총 평가 횟수 상한")
+    parser.add_argument("--workers", type=int, default=1, help="동시에 실행할 평가 수")
+    parser.add_argument("--file_oracle", action="store_true", help="evaluate_image(path) 파일 기반 파이프라인 사용")
     args = parser.parse_args()
 
     im = cv2.imread(args.infile)[:,:,::-1].astype(np.float32)/255.0
-    # NOTE: user must implement evaluate_image above to integrate with their pipeline
+    # NOTE: user must implement evaluate_array (or evaluate_image) above to integrate with their pipeline
     try:
-        adv = spsa_optimize(im, iters=args.iters)
+        # 기본: evaluate_array (미구현이면 evaluate_image 로 자동 전환), --file_oracle: 처음부터 파일 기반
+        oracle = FileOracle(workers=args.workers) if args.file_oracle else ArrayOracle(workers=args.workers)
+        with oracle:
+            adv = spsa_optimize(im, iters=args.iters, oracle=oracle, K=args.k, query_budget=args.budget)
         outp = args.outfile or args.infile.replace(".png","_spsa.png")
         cv2.imwrite(outp, (adv*255).astype('uint8')[:,:,::-1])
         print("Saved", outp)
@@ -1,9 +1,16 @@
 import cv2
+import numpy as np
 import torch
 from facenet_pytorch import MTCNN
 import pandas as pd
 from PIL import Image
 import os
+import sys
+from pathlib import Path
+
+# 작업 단위 얼굴 트랙 (LandmarkBreaker/face_track.py) — 모든 방어 스테이지가 같은 검출 결과를 공유
+sys.path.append(str(Path(__file__).resolve().parent.parent / "LandmarkBreaker"))
+from face_track import get_face_track
 
 
 def _expand_box(x1, y1, x2, y2, W, H, margin=0.35):
@@ -42,13 +49,14 @@ def extract_frames(video_path, output_dir="frame_split"):
     print(f"[OK] 총 {idx}개의 프레임 추출 완료 → {output_dir}/")
 
 
-def process_video(video_path, output_csv="face_boxes.csv", margin=0.35, output_faces="face_crops"):
+def process_video(video_path, output_csv="face_boxes.csv", margin=0.35, output_faces="face_crops", track=None):
     """
     얼굴 추적 → 얼굴 부분 crop 저장 → CSV 저장
+    track: face_track.FaceTrack 이 있으면 그 박스를 사용 (MTCNN 검출 생략)
     """
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"[INFO] Device: {device}")
-    mtcnn = MTCNN(keep_all=True, device=device)
+    mtcnn = MTCNN(keep_all=True, device=device) if track is None else None
 
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
@@ -65,9 +73,12 @@ def process_video(video_path, output_csv="face_boxes.csv", margin=0.35, output_f
         if not ret:
             break
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(rgb)
-        boxes, probs = mtcnn.detect(pil_img)
+        if track is not None:
+            boxes, probs = ([track.box(frame_idx)], np.array([track.confidence(frame_idx)])) if track.has_face(frame_idx) else (None, None)
+        else:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            pil_img = Image.fromarray(rgb)
+            boxes, probs = mtcnn.detect(pil_img)
 
         if boxes is not None and len(boxes) > 0:
             best_idx = probs.argmax()
@@ -114,8 +125,11 @@ if __name__ == "__main__":
     # ① 프레임 추출
     extract_frames(video_path, "frame_split")
 
-    # ② 얼굴 추적 + 얼굴 crop + CSV 생성
-    process_video(video_path, margin=0.35, output_faces="faces_cropped")
+    # ② 얼굴 트랙 (박스 + 68점 + 신뢰도, 영상 해시 키) 1회 생성 → 이후 스테이지는 --face_track auto 로 재사용
+    track = get_face_track(video_path)
+
+    # ③ 얼굴 crop + CSV 생성 (트랙 박스 사용)
+    process_video(video_path, margin=0.35, output_faces="faces_cropped", track=track)
 
-    # ③ StarGAN용 list 파일 생성
+    # ④ StarGAN용 list 파일 생성
     make_frame_list("faces_cropped", "list_attr_celeba_small.txt")